@@ -1,18 +1,155 @@
 # API_GATEWAY/main.py - VERSIÓN COMPLETA Y CORREGIDA
 
 import os
+import asyncio
+import gzip
+import hashlib
+import importlib.util
 import logging
+import logging.handlers
+import random
+import secrets
+import sys
 import time
+import uuid
+from collections import deque
+from contextvars import ContextVar
 from datetime import datetime
+from functools import partial
 from fastapi import FastAPI, Request, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse, StreamingResponse
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from starlette.background import BackgroundTask
+from starlette.concurrency import run_in_threadpool
+from collections import OrderedDict
+from typing import Optional
+from urllib.parse import quote
+from jose import JWTError, jwt
 import httpx
 import json
 
-# Configurar logging
-logging.basicConfig(level=logging.INFO)
-logger = logging.getLogger(__name__)
+try:
+    import brotli
+except ImportError:  # brotli es opcional: sin él solo se ofrece gzip
+    brotli = None
+
+# El módulo compartido vive en backend/common (en Docker se copia a /app/common)
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "backend"))
+from common.observability import (
+    LOG_LEVEL, REQUEST_ID_HEADER, JsonLinesFormatter, MetricsRegistry, MySQLDatabase, RequestTrace, current_trace, format_timing,
+    http_request_metrics, incoming_request_id, metrics_response, record_span, route_label, sample_debug,
+    setup_logging, start_queue_listener
+)
+from common.revocation import RevocationList
+
+# ================================
+# LOGGING ESTRUCTURADO (JSON LINES)
+# ================================
+
+SERVICE_NAME = "api-gateway"
+logger = setup_logging(SERVICE_NAME)
+
+# ================================
+# MÉTRICAS (FORMATO PROMETHEUS)
+# ================================
+
+metrics_registry = MetricsRegistry()
+http_request_seconds, http_requests_in_flight = http_request_metrics(metrics_registry)
+upstream_request_seconds = metrics_registry.histogram(
+    "upstream_request_duration_seconds", "Latencia hasta recibir los headers del microservicio", ("service",))
+upstream_errors = metrics_registry.counter(
+    "upstream_errors_total", "Fallos hacia microservicios por tipo (timeout, connect, transport, status_5xx, circuit_open)",
+    ("service", "kind"))
+upstream_in_flight = metrics_registry.gauge(
+    "upstream_in_flight", "Peticiones en curso por instancia", ("service", "instance"))
+upstream_connections_opened = metrics_registry.gauge(
+    "upstream_connections_opened", "Conexiones abiertas desde el arranque por instancia", ("service", "instance"))
+bulkhead_wait_seconds = metrics_registry.histogram(
+    "bulkhead_wait_seconds", "Espera en la cola del bulkhead", ("service",))
+bulkhead_rejections = metrics_registry.counter(
+    "bulkhead_rejections_total", "Peticiones rechazadas por el bulkhead", ("service", "priority", "reason"))
+sse_connections = metrics_registry.gauge("sse_connections", "Conexiones SSE abiertas")
+sse_events_published = metrics_registry.counter(
+    "sse_events_published_total", "Eventos publicados en el canal push", ("type",))
+gateway_cache_requests = metrics_registry.counter(
+    "gateway_cache_requests_total", "Consultas a la cache de respuestas por resultado", ("route", "result"))
+idempotency_requests = metrics_registry.counter(
+    "idempotency_requests_total", "Escrituras con Idempotency-Key por resultado", ("service", "result"))
+upstream_hedges = metrics_registry.counter(
+    "upstream_hedges_total", "Segundos intentos lanzados por hedging", ("service",))
+upstream_hedge_wins = metrics_registry.counter(
+    "upstream_hedge_wins_total", "Veces que el intento de hedging respondió primero", ("service",))
+upstream_hedges_skipped = metrics_registry.counter(
+    "upstream_hedges_skipped_total", "Hedges no lanzados por falta de presupuesto u otra instancia sana",
+    ("service", "reason"))
+bulkhead_active = metrics_registry.gauge(
+    "bulkhead_active", "Lugares ocupados del bulkhead por servicio", ("service",))
+upstream_circuit_state = metrics_registry.gauge(
+    "upstream_circuit_state", "Estado del breaker por instancia (0 closed, 1 half_open, 2 open)", ("service", "instance"))
+
+
+# ================================
+# TRAZAS (X-Request-ID / SERVER-TIMING)
+# ================================
+
+# Trazas de peticiones lentas: se escriben en un archivo local, muestreadas
+TRACE_SLOW_MS = float(os.getenv("TRACE_SLOW_MS", "500"))
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "0.1"))
+TRACE_FILE = os.getenv("TRACE_FILE", "/tmp/api-gateway-slow-traces.jsonl")
+TRACE_FILE_MAX_BYTES = int(os.getenv("TRACE_FILE_MAX_BYTES", str(10 * 1024 * 1024)))
+
+class GatewayTrace(RequestTrace):
+    """Spans del gateway para una petición, más el servicio que respondió."""
+
+    __slots__ = ("upstream_service",)
+
+    def __init__(self, request_id: str):
+        super().__init__(request_id)
+        self.upstream_service: Optional[str] = None
+
+    def server_timing(self, total: float, upstream_timing: list[str] = ()) -> str:
+        """Server-Timing combinado: spans del gateway + los del microservicio con prefijo."""
+        entries = [format_timing(name, duration, desc) for name, duration, desc in self.spans]
+        prefix = self.upstream_service or "upstream"
+        for value in upstream_timing:
+            for entry in value.split(","):
+                entry = entry.strip()
+                if entry:
+                    entries.append(f"{prefix}-{entry}")
+        entries.append(format_timing("gateway", total))
+        return ", ".join(entries)
+
+def setup_trace_sink() -> logging.Logger:
+    """Logger propio hacia un archivo rotado; escribe en el hilo del QueueListener."""
+    file_handler = logging.handlers.RotatingFileHandler(
+        TRACE_FILE, maxBytes=TRACE_FILE_MAX_BYTES, backupCount=3, delay=True, encoding="utf-8")
+    file_handler.setFormatter(JsonLinesFormatter(SERVICE_NAME))
+
+    sink = logging.getLogger(f"{SERVICE_NAME}.slow-traces")
+    sink.handlers = [start_queue_listener(file_handler)]
+    sink.propagate = False
+    sink.setLevel(logging.INFO)
+    return sink
+
+trace_sink = setup_trace_sink()
+
+def write_slow_trace(request: Request, trace: GatewayTrace, status_code: int, duration: float,
+                     upstream_timing: list[str]):
+    if duration * 1000 < TRACE_SLOW_MS or random.random() >= TRACE_SAMPLE_RATE:
+        return
+    trace_sink.info("slow_request", extra={"fields": {
+        "method": request.method,
+        "path": request.url.path,
+        "status": status_code,
+        "duration_ms": round(duration * 1000, 2),
+        "upstream_service": trace.upstream_service,
+        "spans": [
+            {"name": name, "duration_ms": round(span * 1000, 2), "desc": desc}
+            for name, span, desc in trace.spans
+        ],
+        "upstream_server_timing": upstream_timing
+    }})
+
 
 app = FastAPI(title="API Gateway", version="2.1")
 
@@ -40,100 +177,1822 @@ BOOKING_URL = os.getenv("BOOKING_URL", "http://booking-service:5000")
 PAYMENT_URL = os.getenv("PAYMENT_URL", "http://payment-service:5000")
 WORKSHOPS_URL = os.getenv("WORKSHOPS_URL", "http://workshops-service:5000")
 
-logger.info(f"🔧 Configuración de servicios:")
-logger.info(f"  AUTH_URL: {AUTH_URL}")
-logger.info(f"  BOOKING_URL: {BOOKING_URL}")
-logger.info(f"  PAYMENT_URL: {PAYMENT_URL}")
-logger.info(f"  WORKSHOPS_URL: {WORKSHOPS_URL}")
+logger.info("🔧 Configuración de servicios:")
+logger.info("  AUTH_URL: %s", AUTH_URL)
+logger.info("  BOOKING_URL: %s", BOOKING_URL)
+logger.info("  PAYMENT_URL: %s", PAYMENT_URL)
+logger.info("  WORKSHOPS_URL: %s", WORKSHOPS_URL)
+
+# Modo del proxy: "stream" reenvía los bodies como flujo de bytes sin parsearlos,
+# "buffered" mantiene el comportamiento anterior (parsear y re-serializar JSON)
+PROXY_MODE = os.getenv("PROXY_MODE", "stream").lower()
+logger.info("  PROXY_MODE: %s", PROXY_MODE)
+
+# Headers hop-by-hop que no deben reenviarse entre conexiones (RFC 7230 §6.1)
+HOP_BY_HOP_HEADERS = {
+    "connection", "keep-alive", "proxy-authenticate", "proxy-authorization",
+    "te", "trailer", "transfer-encoding", "upgrade"
+}
+
+# ================================
+# VERIFICACIÓN JWT EN EL GATEWAY
+# ================================
+
+# La clave se lee una sola vez al arrancar; debe coincidir con la del auth-service
+JWT_SECRET_KEY = os.getenv("JWT_SECRET_KEY", "mysecretkey")
+JWT_ALGORITHM = "HS256"
+
+# Header de confianza con el "sub" verificado que reciben los microservicios
+IDENTITY_HEADER = os.getenv("IDENTITY_HEADER", "X-User-Email")
+
+# Rutas que no requieren token válido (un token viejo en el cliente no debe bloquear el login)
+PUBLIC_PATHS = {
+    "/api/v0/auth/login",
+    "/api/v0/auth/register",
+    "/api/v0/auth/refresh",
+    "/api/v0/auth/logout"
+}
+
+# Cache de tokens ya verificados: token -> claims (LRU acotado, respeta "exp")
+TOKEN_CACHE_SIZE = int(os.getenv("TOKEN_CACHE_SIZE", "10000"))
+verified_tokens: "OrderedDict[str, dict]" = OrderedDict()
+
+def decode_token(token: str) -> dict:
+    """Verifica firma y expiración de un JWT HS256, usando el cache si ya fue verificado."""
+    claims = verified_tokens.get(token)
+    if claims is not None:
+        if claims.get("exp", 0) > time.time():
+            verified_tokens.move_to_end(token)
+            return claims
+        del verified_tokens[token]
+        raise JWTError("Token expirado")
+
+    claims = jwt.decode(token, JWT_SECRET_KEY, algorithms=[JWT_ALGORITHM])
+    if "sub" not in claims:
+        raise JWTError("Token sin 'sub'")
+    if claims.get("type") == "refresh":
+        raise JWTError("Refresh token usado como token de acceso")
+
+    verified_tokens[token] = claims
+    if len(verified_tokens) > TOKEN_CACHE_SIZE:
+        verified_tokens.popitem(last=False)
+    return claims
+
+# Tokens revocados por logout o rotación: el gateway lee la tabla revoked_tokens que escribe
+# auth-service. Un jti que no está en el filtro de Bloom pasa sin tocar MySQL.
+REVOCATION_CAPACITY = int(os.getenv("REVOCATION_CAPACITY", "100000"))
+REVOCATION_FP_RATE = float(os.getenv("REVOCATION_FP_RATE", "0.001"))
+REVOCATION_SYNC_SECONDS = float(os.getenv("REVOCATION_SYNC_SECONDS", "5"))
+REVOCATION_REBUILD_SECONDS = float(os.getenv("REVOCATION_REBUILD_SECONDS", "3600"))
+# Un logout o refresh exitoso por este gateway invalida al instante el token de acceso usado
+TOKEN_REVOKING_PATHS = {"/api/v0/auth/logout", "/api/v0/auth/refresh"}
+
+auth_database = MySQLDatabase(metrics_registry, "users_db")
+# Un solo intento: el sync reintenta en la próxima vuelta y una petición no espera a MySQL caído
+revocation_list = RevocationList(metrics_registry, partial(auth_database.connect, attempts=1),
+                                 REVOCATION_CAPACITY, REVOCATION_FP_RATE)
+revocation_sync_task: Optional[asyncio.Task] = None
+
+async def sync_revocations():
+    while True:
+        full = time.monotonic() - revocation_list.rebuilt_at >= REVOCATION_REBUILD_SECONDS
+        try:
+            await run_in_threadpool(revocation_list.load, full)
+        except Exception as e:
+            logger.warning("🚫 No se pudo sincronizar la lista de revocación: %s", e)
+        await asyncio.sleep(REVOCATION_SYNC_SECONDS)
+
+@app.on_event("startup")
+async def start_revocation_sync():
+    global revocation_sync_task
+    revocation_sync_task = asyncio.create_task(sync_revocations())
+
+@app.on_event("shutdown")
+async def stop_revocation_sync():
+    if revocation_sync_task is not None:
+        revocation_sync_task.cancel()
+
+async def token_revoked(claims: dict) -> bool:
+    jti = claims.get("jti")
+    if not jti or not revocation_list.might_be_revoked(jti):
+        return False
+    try:
+        return await run_in_threadpool(revocation_list.confirm, jti)
+    except Exception as e:
+        # Sin poder confirmar no se deja pasar un token que podría estar revocado
+        logger.error("🚫 No se pudo confirmar la revocación de un token: %s", e)
+        raise HTTPException(status_code=503, detail="No se pudo verificar el token", headers={"Retry-After": "1"})
+
+def forget_revoked_token(request: Request):
+    """Tras un logout/refresh exitoso: saca el token del cache y marca su jti en el filtro."""
+    scheme, _, token = request.headers.get("authorization", "").partition(" ")
+    if scheme.lower() != "bearer" or not token.strip():
+        return
+    token = token.strip()
+    verified_tokens.pop(token, None)
+    try:
+        claims = jwt.decode(token, JWT_SECRET_KEY, algorithms=[JWT_ALGORITHM])
+    except JWTError:
+        return
+    if claims.get("jti"):
+        revocation_list.add(claims["jti"])
+
+async def authenticate_request(request: Request) -> Optional[str]:
+    """Devuelve el email verificado del token, None si no hay token.
+
+    Los tokens inválidos o expirados se rechazan con 401 antes de llegar al microservicio.
+    """
+    if request.url.path in PUBLIC_PATHS:
+        return None
+
+    authorization = request.headers.get("authorization")
+    if not authorization:
+        return None
+
+    scheme, _, token = authorization.partition(" ")
+    if scheme.lower() != "bearer" or not token:
+        raise HTTPException(
+            status_code=401,
+            detail="Token inválido",
+            headers={"WWW-Authenticate": "Bearer"}
+        )
+
+    start_time = time.perf_counter()
+    try:
+        claims = decode_token(token.strip())
+        if await token_revoked(claims):
+            raise JWTError("Token revocado")
+        return claims["sub"]
+    except JWTError as e:
+        logger.warning("🔒 Token rechazado en gateway: %s", e)
+        raise HTTPException(
+            status_code=401,
+            detail="Token inválido",
+            headers={"WWW-Authenticate": "Bearer"}
+        )
+    finally:
+        record_span("gw-auth", time.perf_counter() - start_time)
+
+def build_upstream_headers(request: Request, identity: Optional[str]) -> list[tuple[str, str]]:
+    """Headers para el microservicio: sin host ni hop-by-hop, y con la identidad verificada.
+
+    Cualquier header de identidad enviado por el cliente se descarta para que no pueda suplantarse.
+    """
+    identity_key = IDENTITY_HEADER.lower()
+    headers = [(key, value) for key, value in request.headers.items()
+               if key.lower() not in ("host", identity_key) and key.lower() not in HOP_BY_HOP_HEADERS]
+    if identity:
+        headers.append((IDENTITY_HEADER, identity))
+    return headers
+
+# ================================
+# RATE LIMITING (TOKEN BUCKETS)
+# ================================
+
+def parse_rate(value: str) -> tuple[float, float]:
+    """Convierte "capacidad/segundos" (ej. "10/60") en (capacidad, periodo)."""
+    capacity, _, period = value.partition("/")
+    return float(capacity), float(period or 1)
+
+RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "true").lower() == "true"
+RATE_LIMIT_MAX_KEYS = int(os.getenv("RATE_LIMIT_MAX_KEYS", "50000"))
+RATE_LIMITS = {
+    # login/register: cada intento cuesta un bcrypt en el auth-service
+    "auth": parse_rate(os.getenv("RATE_LIMIT_AUTH", "10/60")),
+    "write": parse_rate(os.getenv("RATE_LIMIT_WRITE", "60/60")),
+    "read": parse_rate(os.getenv("RATE_LIMIT_READ", "600/60"))
+}
+
+class TokenBucketLimiter:
+    """Token buckets por clave con memoria acotada.
+
+    Los buckets se guardan en orden de último uso: los que llevan más de un periodo sin
+    usarse ya estarían llenos, así que se eliminan sin cambiar el resultado. Además
+    nunca se guardan más de max_keys buckets.
+    """
+
+    def __init__(self, capacity: float, period: float, max_keys: int):
+        self.capacity = capacity
+        self.period = period
+        self.rate = capacity / period
+        self.max_keys = max_keys
+        self.buckets: "OrderedDict[str, list[float]]" = OrderedDict()
+        self.rejected = 0
+
+    def _evict(self, now: float):
+        while self.buckets:
+            key, (tokens, last) = next(iter(self.buckets.items()))
+            if now - last < self.period and len(self.buckets) <= self.max_keys:
+                break
+            self.buckets.popitem(last=False)
+
+    def _tokens(self, key: str, now: float) -> float:
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            return self.capacity
+        tokens, last = bucket
+        return min(self.capacity, tokens + (now - last) * self.rate)
+
+    def acquire(self, keys: list[str], cost: float = 1.0) -> float:
+        """Consume `cost` tokens de cada clave. Devuelve 0 si se admitió o los segundos a esperar."""
+        now = time.monotonic()
+        self._evict(now)
+        levels = [self._tokens(key, now) for key in keys]
+        lowest = min(levels)
+        if lowest < cost:
+            self.rejected += 1
+            return (cost - lowest) / self.rate
+
+        for key, tokens in zip(keys, levels):
+            self.buckets[key] = [tokens - cost, now]
+            self.buckets.move_to_end(key)
+        return 0.0
+
+    def snapshot(self) -> dict:
+        return {
+            "capacity": self.capacity,
+            "period_seconds": self.period,
+            "tracked_keys": len(self.buckets),
+            "rejected": self.rejected
+        }
+
+rate_limiters = {
+    route_class: TokenBucketLimiter(capacity, period, RATE_LIMIT_MAX_KEYS)
+    for route_class, (capacity, period) in RATE_LIMITS.items()
+}
+
+# Las sub-peticiones de un batch ya se cobraron en el batch (ver run_batch)
+rate_limit_prepaid: ContextVar[bool] = ContextVar("rate_limit_prepaid", default=False)
+
+def route_class(method: str, path: str) -> str:
+    if method in ("GET", "HEAD", "OPTIONS"):
+        return "read"
+    if path.startswith("/api/v0/auth/"):
+        return "auth"
+    return "write"
+
+def enforce_rate_limit(request: Request, identity: Optional[str], costs: Optional[dict[str, float]] = None):
+    """Aplica la cuota de la clase de ruta por IP y, si hay token verificado, por usuario.
 
-# Cliente HTTP reutilizable con configuración mejorada
+    costs ({clase: tokens}) reemplaza al token de la propia ruta; lo usa el batch para
+    pagar por adelantado todas sus sub-peticiones.
+    """
+    if not RATE_LIMIT_ENABLED or rate_limit_prepaid.get():
+        return
+
+    client_ip = request.client.host if request.client else "unknown"
+    keys = [f"ip:{client_ip}"]
+    if identity:
+        keys.append(f"user:{identity.lower()}")
+
+    for route, cost in (costs or {route_class(request.method, request.url.path): 1.0}).items():
+        wait = rate_limiters[route].acquire(keys, cost)
+        if wait > 0:
+            logger.warning("🚦 Rate limit (%s) para %s", route, keys)
+            raise HTTPException(
+                status_code=429,
+                detail="Demasiadas solicitudes. Espera unos segundos antes de intentarlo de nuevo.",
+                headers={"Retry-After": str(max(1, int(wait + 0.999)))}
+            )
+
+# Timeouts comunes a todos los clientes HTTP del gateway
+UPSTREAM_TIMEOUT = float(os.getenv("UPSTREAM_TIMEOUT", "30"))
+UPSTREAM_CONNECT_TIMEOUT = float(os.getenv("UPSTREAM_CONNECT_TIMEOUT", "3"))
+UPSTREAM_TIMEOUTS = httpx.Timeout(UPSTREAM_TIMEOUT, connect=UPSTREAM_CONNECT_TIMEOUT)
+
+# Cliente para construir peticiones (aplica los timeouts) y llamadas puntuales de diagnóstico.
+# El tráfico proxy se envía por el pool propio de cada instancia (ver UpstreamInstance).
 client = httpx.AsyncClient(
-    timeout=30.0,
-    limits=httpx.Limits(max_keepalive_connections=20, max_connections=100)
+    timeout=UPSTREAM_TIMEOUTS,
+    limits=httpx.Limits(max_keepalive_connections=5, max_connections=20)
 )
 
-# Middleware para logging de requests mejorado
+# ================================
+# CIRCUIT BREAKERS Y REINTENTOS POR UPSTREAM
+# ================================
+
+BREAKER_FAILURE_THRESHOLD = int(os.getenv("BREAKER_FAILURE_THRESHOLD", "5"))
+BREAKER_RESET_TIMEOUT = float(os.getenv("BREAKER_RESET_TIMEOUT", "10"))
+BREAKER_HALF_OPEN_MAX_CALLS = int(os.getenv("BREAKER_HALF_OPEN_MAX_CALLS", "1"))
+
+RETRY_MAX_ATTEMPTS = int(os.getenv("RETRY_MAX_ATTEMPTS", "2"))
+RETRY_BASE_DELAY = float(os.getenv("RETRY_BASE_DELAY", "0.05"))
+RETRY_MAX_DELAY = float(os.getenv("RETRY_MAX_DELAY", "1.0"))
+RETRY_BUDGET_RATIO = float(os.getenv("RETRY_BUDGET_RATIO", "0.2"))
+RETRY_BUDGET_MIN_TOKENS = float(os.getenv("RETRY_BUDGET_MIN_TOKENS", "10"))
+
+# Métodos que se pueden reintentar sin efectos secundarios
+IDEMPOTENT_METHODS = {"GET", "HEAD", "OPTIONS"}
+# Status del upstream que cuentan como fallo y permiten reintento
+RETRYABLE_STATUS = {502, 503, 504}
+
+class CircuitOpenError(Exception):
+    """El circuito del upstream está abierto: se falla rápido sin abrir conexión."""
+
+    def __init__(self, service: str, retry_after: float):
+        super().__init__(f"Circuito abierto para {service}")
+        self.service = service
+        self.retry_after = retry_after
+
+class RetryBudget:
+    """Limita los reintentos a una fracción de las peticiones recientes.
+
+    Cada petición deposita RETRY_BUDGET_RATIO tokens y cada reintento consume uno,
+    así una caída del upstream no multiplica la carga que recibe.
+    """
+
+    def __init__(self, ratio: float, min_tokens: float):
+        self.ratio = ratio
+        self.max_tokens = max(min_tokens, 1.0)
+        self.tokens = self.max_tokens
+        self.retries = 0
+        self.rejected = 0
+
+    def deposit(self):
+        self.tokens = min(self.max_tokens, self.tokens + self.ratio)
+
+    def withdraw(self) -> bool:
+        if self.tokens >= 1.0:
+            self.tokens -= 1.0
+            self.retries += 1
+            return True
+        self.rejected += 1
+        return False
+
+class CircuitBreaker:
+    """Circuit breaker closed -> open -> half_open por upstream.
+
+    Solo cuentan como fallo los errores de conexión, los timeouts y los status 502/503/504:
+    un 500 de una ruta con un bug o de una entrada inválida no dice nada de la instancia.
+    Tras BREAKER_FAILURE_THRESHOLD fallos seguidos el circuito se abre y las peticiones
+    fallan al instante; pasado BREAKER_RESET_TIMEOUT se dejan pasar pocas peticiones de
+    prueba y el circuito se cierra con la primera que tenga éxito.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.state = "closed"
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self.half_open_calls = 0
+        self.half_open_started = 0.0
+        self.short_circuited = 0
+
+    def retry_after(self) -> float:
+        return max(0.0, self.opened_at + BREAKER_RESET_TIMEOUT - time.monotonic())
+
+    def is_available(self) -> bool:
+        """True si el breaker dejaría pasar una petición, sin consumir cupo de prueba."""
+        if self.state == "open":
+            return time.monotonic() - self.opened_at >= BREAKER_RESET_TIMEOUT
+        if self.state == "half_open":
+            return (self.half_open_calls < BREAKER_HALF_OPEN_MAX_CALLS
+                    or time.monotonic() - self.half_open_started > BREAKER_RESET_TIMEOUT)
+        return True
+
+    def allow_request(self) -> bool:
+        now = time.monotonic()
+        if self.state == "open":
+            if now - self.opened_at < BREAKER_RESET_TIMEOUT:
+                self.short_circuited += 1
+                return False
+            self.state = "half_open"
+            self.half_open_calls = 0
+            self.half_open_started = now
+            logger.info("🟡 Circuito %s en half-open, probando upstream", self.name)
+
+        if self.state == "half_open":
+            # Si una prueba quedó colgada (cliente desconectado) se libera el cupo
+            if now - self.half_open_started > BREAKER_RESET_TIMEOUT:
+                self.half_open_calls = 0
+                self.half_open_started = now
+            if self.half_open_calls >= BREAKER_HALF_OPEN_MAX_CALLS:
+                self.short_circuited += 1
+                return False
+            self.half_open_calls += 1
+        return True
+
+    def record_success(self):
+        if self.state != "closed":
+            logger.info("🟢 Circuito %s cerrado", self.name)
+        self.state = "closed"
+        self.consecutive_failures = 0
+        self.half_open_calls = 0
+
+    def record_failure(self):
+        self.consecutive_failures += 1
+        if self.state == "half_open" or self.consecutive_failures >= BREAKER_FAILURE_THRESHOLD:
+            if self.state != "open":
+                logger.warning("🔴 Circuito %s abierto tras %s fallos", self.name, self.consecutive_failures)
+            self.state = "open"
+            self.opened_at = time.monotonic()
+            self.half_open_calls = 0
+
+    def snapshot(self) -> dict:
+        return {
+            "state": self.state,
+            "consecutive_failures": self.consecutive_failures,
+            "retry_after": round(self.retry_after(), 2) if self.state == "open" else 0,
+            "short_circuited": self.short_circuited
+        }
+
+# ================================
+# BULKHEADS Y PRIORIDADES (ADMISSION CONTROL)
+# ================================
+
+# Peticiones concurrentes por servicio (por debajo de los 40 threads de FastAPI en cada servicio)
+BULKHEAD_ENABLED = os.getenv("BULKHEAD_ENABLED", "true").lower() == "true"
+BULKHEAD_LIMIT = int(os.getenv("BULKHEAD_LIMIT", "32"))
+BULKHEAD_QUEUE_SIZE = int(os.getenv("BULKHEAD_QUEUE_SIZE", "64"))
+BULKHEAD_MAX_WAIT = float(os.getenv("BULKHEAD_MAX_WAIT", "0.5"))
+# Las lecturas masivas solo pueden ocupar esta fracción del bulkhead
+BULKHEAD_LOW_PRIORITY_SHARE = float(os.getenv("BULKHEAD_LOW_PRIORITY_SHARE", "0.75"))
+
+# Orden en que se atiende la cola de espera
+PRIORITIES = ("high", "normal", "low")
+
+def parse_routes(value: str) -> list[str]:
+    return [route.strip() for route in value.split(",") if route.strip()]
+
+def match_route(path: str, routes: list[str]) -> Optional[str]:
+    """Ruta configurada que coincide con el path; las terminadas en "*" se comparan como prefijo."""
+    for route in routes:
+        if path == route or (route.endswith("*") and path.startswith(route[:-1])):
+            return route
+    return None
+
+# Health y datos estáticos pasan primero; los listados y búsquedas van al final
+HIGH_PRIORITY_ROUTES = parse_routes(os.getenv(
+    "HIGH_PRIORITY_ROUTES",
+    "/api/v0/payment/methods,/api/v0/auth/health,/api/v0/booking/health,/api/v0/payment/health,/api/v0/workshops/health"
+))
+BULK_READ_ROUTES = parse_routes(os.getenv(
+    "BULK_READ_ROUTES",
+    "/api/v0/workshops/,/api/v0/workshops/buscar,/api/v0/booking/usuario/*,/api/v0/payment/history/*,/api/v0/dashboard/*"
+))
+
+def request_priority(request: Request) -> str:
+    path = request.url.path
+    if match_route(path, HIGH_PRIORITY_ROUTES):
+        return "high"
+    if request.method in ("GET", "HEAD") and match_route(path, BULK_READ_ROUTES):
+        return "low"
+    return "normal"
+
+class BulkheadRejectedError(Exception):
+    def __init__(self, service: str, reason: str):
+        super().__init__(f"Bulkhead de {service} lleno ({reason})")
+        self.service = service
+        self.reason = reason
+
+class Bulkhead:
+    """Límite de peticiones concurrentes a un servicio con una cola de espera corta.
+
+    Si no hay lugar, la petición espera como máximo BULKHEAD_MAX_WAIT en una cola acotada;
+    al liberarse un lugar se entrega directamente al primer waiter de mayor prioridad.
+    """
+
+    def __init__(self, service: str, limit: int, queue_size: int, max_wait: float):
+        self.service = service
+        self.limit = limit
+        self.queue_size = queue_size
+        self.max_wait = max_wait
+        self.active = 0
+        self.waiters = {priority: deque() for priority in PRIORITIES}
+        self.admitted = 0
+        self.rejected = {priority: 0 for priority in PRIORITIES}
+
+    def capacity(self, priority: str) -> int:
+        if priority == "low":
+            return max(1, int(self.limit * BULKHEAD_LOW_PRIORITY_SHARE))
+        return self.limit
+
+    def queued(self) -> int:
+        return sum(len(waiters) for waiters in self.waiters.values())
+
+    def can_admit(self, priority: str) -> bool:
+        if self.active >= self.capacity(priority):
+            return False
+        # No adelantarse a quien ya espera con igual o mayor prioridad
+        for level in PRIORITIES:
+            if self.waiters[level]:
+                return False
+            if level == priority:
+                return True
+        return True
+
+    async def acquire(self, priority: str):
+        if self.can_admit(priority):
+            self.active += 1
+            self.admitted += 1
+            return
+        if self.queued() >= self.queue_size:
+            self.reject(priority, "queue_full")
+
+        future = asyncio.get_running_loop().create_future()
+        self.waiters[priority].append(future)
+        start_time = time.perf_counter()
+        try:
+            await asyncio.wait({future}, timeout=self.max_wait)
+        except asyncio.CancelledError:
+            self.abandon(priority, future)
+            raise
+        wait = time.perf_counter() - start_time
+        bulkhead_wait_seconds.observe(wait, self.service)
+        record_span("bulkhead-wait", wait, self.service)
+        if not future.done():
+            self.abandon(priority, future)
+            self.reject(priority, "deadline")
+        self.admitted += 1
+
+    def abandon(self, priority: str, future: asyncio.Future):
+        if future.done() and not future.cancelled():
+            # El lugar ya había sido entregado: se devuelve
+            self.release()
+            return
+        future.cancel()
+        try:
+            self.waiters[priority].remove(future)
+        except ValueError:
+            pass
+
+    def reject(self, priority: str, reason: str):
+        self.rejected[priority] += 1
+        bulkhead_rejections.inc(self.service, priority, reason)
+        raise BulkheadRejectedError(self.service, reason)
+
+    def release(self):
+        self.active -= 1
+        for priority in PRIORITIES:
+            waiters = self.waiters[priority]
+            while waiters and self.active < self.capacity(priority):
+                future = waiters.popleft()
+                if future.done():
+                    continue
+                self.active += 1
+                future.set_result(True)
+            if waiters:
+                # El de mayor prioridad sigue esperando: los de menor prioridad no pasan
+                return
+
+    def snapshot(self) -> dict:
+        return {
+            "limit": self.limit,
+            "low_priority_limit": self.capacity("low"),
+            "active": self.active,
+            "queued": {priority: len(waiters) for priority, waiters in self.waiters.items()},
+            "admitted": self.admitted,
+            "rejected": self.rejected
+        }
+
+def bulkhead_exception(e: BulkheadRejectedError) -> HTTPException:
+    logger.warning("🚧 %s, rechazando", e)
+    return HTTPException(
+        status_code=503,
+        detail="El servidor está muy ocupado en este momento. Vuelve a intentarlo en unos segundos.",
+        headers={"Retry-After": str(max(1, int(BULKHEAD_MAX_WAIT + 0.999)))}
+    )
+
+# ================================
+# HEDGING DE LECTURAS IDEMPOTENTES
+# ================================
+
+# Opt-in: si el primer intento no respondió dentro del percentil HEDGE_PERCENTILE de la
+# latencia reciente del servicio, se lanza un segundo intento hacia otra instancia sana y gana
+# la primera respuesta válida. Con una sola instancia por servicio no se hace hedging.
+HEDGE_ENABLED = os.getenv("HEDGE_ENABLED", "false").lower() == "true"
+HEDGE_ROUTES = parse_routes(os.getenv(
+    "HEDGE_ROUTES",
+    "/api/v0/workshops/buscar,/api/v0/payment/history/*"
+))
+HEDGE_PERCENTILE = float(os.getenv("HEDGE_PERCENTILE", "0.95"))
+HEDGE_MIN_DELAY = float(os.getenv("HEDGE_MIN_DELAY", "0.02"))
+# Hasta juntar HEDGE_MIN_SAMPLES latencias se usa un retraso fijo
+HEDGE_DEFAULT_DELAY = float(os.getenv("HEDGE_DEFAULT_DELAY", "0.1"))
+HEDGE_MIN_SAMPLES = int(os.getenv("HEDGE_MIN_SAMPLES", "20"))
+HEDGE_WINDOW = int(os.getenv("HEDGE_WINDOW", "500"))
+# Cada lectura hedgeable deposita HEDGE_BUDGET_RATIO tokens: como máximo ~10% de carga extra
+HEDGE_BUDGET_RATIO = float(os.getenv("HEDGE_BUDGET_RATIO", "0.1"))
+HEDGE_BUDGET_MIN_TOKENS = float(os.getenv("HEDGE_BUDGET_MIN_TOKENS", "5"))
+
+def hedge_route(request: Request) -> Optional[str]:
+    """Patrón de HEDGE_ROUTES que aplica a la petición (o None si no se hace hedging).
+
+    El patrón, y no el path concreto, identifica la ventana de latencias: así una ruta
+    barata no toma el retraso de una lenta del mismo servicio y las claves quedan acotadas.
+    """
+    if not HEDGE_ENABLED or request.method != "GET":
+        return None
+    return match_route(request.url.path, HEDGE_ROUTES)
+
+class LatencyWindow:
+    """Últimas latencias exitosas de una ruta; el percentil se recalcula como mucho 1 vez/s."""
+
+    def __init__(self, size: int):
+        self.samples = deque(maxlen=size)
+        self.cached_delay = HEDGE_DEFAULT_DELAY
+        self.computed_at = 0.0
+
+    def record(self, latency: float):
+        self.samples.append(latency)
+
+    def hedge_delay(self) -> float:
+        now = time.monotonic()
+        if now - self.computed_at >= 1.0:
+            self.computed_at = now
+            if len(self.samples) >= HEDGE_MIN_SAMPLES:
+                ordered = sorted(self.samples)
+                index = min(len(ordered) - 1, int(len(ordered) * HEDGE_PERCENTILE))
+                self.cached_delay = max(HEDGE_MIN_DELAY, ordered[index])
+        return self.cached_delay
+
+# ================================
+# MODO COMPUESTO (UN SOLO PROCESO)
+# ================================
+
+# Con COMPOSITE_MODE=true el gateway importa las apps de los cuatro servicios y el proxy
+# las llama por ASGI en el mismo proceso: sin serializar, sin red y sin volver a parsear
+# HTTP. Sirve para sitios chicos y como línea base para medir el costo de la distribución.
+COMPOSITE_MODE = os.getenv("COMPOSITE_MODE", "false").lower() == "true"
+SERVICES_DIR = os.getenv(
+    "SERVICES_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "backend")
+)
+
+def load_service_app(service: str):
+    """Importa backend/<service>-service/main.py con un nombre de módulo propio."""
+    module_name = f"{service}_service_main"
+    spec = importlib.util.spec_from_file_location(
+        module_name, os.path.join(SERVICES_DIR, f"{service}-service", "main.py"))
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[module_name] = module
+
+    root = logging.getLogger()
+    handlers, level = list(root.handlers), root.level
+    try:
+        spec.loader.exec_module(module)
+    finally:
+        # Cada servicio configura el root logger al importarse; se conserva el del gateway
+        root.handlers = handlers
+        root.setLevel(level)
+    logger.info("🧩 %s-service montado en el gateway", service)
+    return module.app
+
+composite_apps = (
+    {service: load_service_app(service) for service in ("auth", "booking", "payment", "workshops")}
+    if COMPOSITE_MODE else {}
+)
+
+@app.on_event("startup")
+async def start_composite_apps():
+    # ASGITransport no envía eventos lifespan: se corren a mano (ej. crear tablas)
+    for service_app in composite_apps.values():
+        await service_app.router.startup()
+
+@app.on_event("shutdown")
+async def stop_composite_apps():
+    for service_app in composite_apps.values():
+        await service_app.router.shutdown()
+
+# ================================
+# POOLS DE INSTANCIAS POR UPSTREAM
+# ================================
+
+HEALTH_CHECK_INTERVAL = float(os.getenv("HEALTH_CHECK_INTERVAL", "5"))
+HEALTH_CHECK_TIMEOUT = float(os.getenv("HEALTH_CHECK_TIMEOUT", "2"))
+HEALTH_UNHEALTHY_THRESHOLD = int(os.getenv("HEALTH_UNHEALTHY_THRESHOLD", "2"))
+HEALTH_LATENCY_WINDOW = int(os.getenv("HEALTH_LATENCY_WINDOW", "100"))
+
+class HealthStatus:
+    """Último resultado del health check de una instancia y sus latencias recientes."""
+
+    def __init__(self):
+        self.status = "unknown"
+        self.consecutive_failures = 0
+        self.checks_total = 0
+        self.last_checked: Optional[str] = None
+        self.response_code: Optional[int] = None
+        self.response = None
+        self.error: Optional[str] = None
+        self.latencies_ms: deque = deque(maxlen=HEALTH_LATENCY_WINDOW)
+
+    @property
+    def is_down(self) -> bool:
+        return self.status == "down"
+
+    def record(self, latency_ms: float, response_code: Optional[int] = None, response=None,
+               error: Optional[str] = None):
+        self.checks_total += 1
+        self.last_checked = datetime.now().isoformat()
+        self.response_code = response_code
+        self.response = response
+        self.error = error
+        if error is None:
+            self.latencies_ms.append(latency_ms)
+
+        if error is None and response_code == 200:
+            self.consecutive_failures = 0
+            database = response.get("database") if isinstance(response, dict) else None
+            # El servicio responde pero sin base de datos: sigue recibiendo tráfico
+            self.status = "up" if database in (None, "connected") else "degraded"
+        else:
+            self.consecutive_failures += 1
+            if self.consecutive_failures >= HEALTH_UNHEALTHY_THRESHOLD or self.status == "unknown":
+                self.status = "down"
+
+    def percentiles(self) -> dict:
+        if not self.latencies_ms:
+            return {}
+        ordered = sorted(self.latencies_ms)
+        last = len(ordered) - 1
+        return {
+            "p50": round(ordered[int(last * 0.50)], 2),
+            "p95": round(ordered[int(last * 0.95)], 2),
+            "p99": round(ordered[int(last * 0.99)], 2),
+            "samples": len(ordered)
+        }
+
+    def snapshot(self) -> dict:
+        return {
+            "status": self.status,
+            "last_checked": self.last_checked,
+            "response_code": self.response_code,
+            "consecutive_failures": self.consecutive_failures,
+            "checks_total": self.checks_total,
+            "latency_ms": self.percentiles(),
+            "error": self.error
+        }
+
+def pool_setting(service: str, name: str, default: str) -> str:
+    """Configuración del pool de un servicio, ej. BOOKING_POOL_MAX_CONNECTIONS."""
+    return os.getenv(f"{service.upper()}_POOL_{name}", default)
+
+def h2_available() -> bool:
+    try:
+        import h2  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+class UpstreamInstance:
+    """Una réplica de un microservicio con su propio breaker, contador de peticiones en curso
+    y pool de conexiones HTTP.
+
+    Cada instancia tiene su propio httpx.AsyncClient, así una ráfaga hacia un servicio no
+    desaloja las conexiones keep-alive de los demás. Opcionalmente usa HTTP/2 (solo con
+    URLs https://, que lo negocian por ALPN, y con el paquete h2) o un Unix domain socket
+    si el servicio corre en el mismo host. El health prober usa un cliente aparte de una
+    conexión, para no ocupar lugares del pool de tráfico.
+    """
+
+    def __init__(self, service: str, url: str, weight: float = 1.0, uds: Optional[str] = None, app=None):
+        self.service = service
+        self.url = url.rstrip("/")
+        self.weight = weight
+        self.uds = uds
+        self.in_process = app is not None
+        self.in_flight = 0
+        self.requests_total = 0
+        self.connections_opened = 0
+        self.breaker = CircuitBreaker(f"{service}@{self.url}")
+        self.health = HealthStatus()
+
+        self.http2 = pool_setting(service, "HTTP2", "false").lower() == "true"
+        if self.http2 and (app is not None or uds or not self.url.startswith("https://")):
+            # httpx solo negocia HTTP/2 por TLS; con http:// (y uvicorn, que no habla h2c)
+            # el flag no cambiaría nada
+            logger.warning("⚠️ HTTP/2 pedido para %s pero %s no es https://, se usa HTTP/1.1", service, self.url)
+            self.http2 = False
+        if self.http2 and not h2_available():
+            logger.warning("⚠️ HTTP/2 pedido para %s pero falta el paquete h2, se usa HTTP/1.1", service)
+            self.http2 = False
+        self.limits = httpx.Limits(
+            max_connections=int(pool_setting(service, "MAX_CONNECTIONS", "50")),
+            max_keepalive_connections=int(pool_setting(service, "MAX_KEEPALIVE", "20")),
+            keepalive_expiry=float(pool_setting(service, "KEEPALIVE_EXPIRY", "30"))
+        )
+        self.client = httpx.AsyncClient(timeout=UPSTREAM_TIMEOUTS, transport=self.transport(app, self.limits))
+        self.probe_client = httpx.AsyncClient(
+            timeout=HEALTH_CHECK_TIMEOUT,
+            transport=self.transport(app, httpx.Limits(max_connections=1, max_keepalive_connections=1))
+        )
+
+    def transport(self, app, limits: httpx.Limits) -> httpx.AsyncBaseTransport:
+        if app is not None:
+            # Modo compuesto: la app del servicio se llama en el mismo proceso, sin red
+            return httpx.ASGITransport(app=app)
+        return httpx.AsyncHTTPTransport(uds=self.uds, http2=self.http2, limits=limits)
+
+    async def trace(self, event_name: str, info: dict):
+        """Hook de httpcore: cuenta las conexiones nuevas para medir el reuso del pool."""
+        if event_name in ("connection.connect_tcp.complete", "connection.connect_unix_socket.complete"):
+            self.connections_opened += 1
+
+    def connection_stats(self) -> dict:
+        reused = max(0, self.requests_total - self.connections_opened)
+        return {
+            "transport": "asgi" if self.in_process else ("uds" if self.uds else "tcp"),
+            "http2": self.http2,
+            "max_connections": self.limits.max_connections,
+            "max_keepalive_connections": self.limits.max_keepalive_connections,
+            "connections_opened": self.connections_opened,
+            "requests": self.requests_total,
+            "reuse_ratio": round(reused / self.requests_total, 3) if self.requests_total else None
+        }
+
+    def snapshot(self) -> dict:
+        return {
+            "url": self.url,
+            "weight": self.weight,
+            "in_flight": self.in_flight,
+            "requests_total": self.requests_total,
+            "connections": self.connection_stats(),
+            "circuit": self.breaker.snapshot(),
+            "health": self.health.snapshot()
+        }
+
+class UpstreamPool:
+    """Conjunto de instancias de un servicio balanceado por menor número de peticiones en curso.
+
+    Las instancias con el circuito abierto o marcadas "down" por el health prober quedan
+    fuera (outlier ejection) y las de peso 0 no reciben peticiones nuevas, lo que permite
+    drenarlas durante un despliegue.
+    """
+
+    def __init__(self, name: str, instances: list[UpstreamInstance]):
+        self.name = name
+        self.instances = instances
+        self.budget = RetryBudget(RETRY_BUDGET_RATIO, RETRY_BUDGET_MIN_TOKENS)
+        self.bulkhead = Bulkhead(
+            name,
+            int(os.getenv(f"{name.upper()}_BULKHEAD_LIMIT", str(BULKHEAD_LIMIT))),
+            BULKHEAD_QUEUE_SIZE,
+            BULKHEAD_MAX_WAIT
+        )
+        # Ventanas de latencia por ruta de hedging
+        self.latencies: dict[str, LatencyWindow] = {}
+        self.hedge_budget = RetryBudget(HEDGE_BUDGET_RATIO, HEDGE_BUDGET_MIN_TOKENS)
+
+    def latency_window(self, route: str) -> LatencyWindow:
+        window = self.latencies.get(route)
+        if window is None:
+            window = self.latencies[route] = LatencyWindow(HEDGE_WINDOW)
+        return window
+
+    def get_instance(self, url: str) -> Optional[UpstreamInstance]:
+        url = url.rstrip("/")
+        return next((instance for instance in self.instances if instance.url == url), None)
+
+    def pick(self, exclude: set[str] = frozenset()) -> Optional[UpstreamInstance]:
+        """Instancia disponible con menos peticiones en curso relativas a su peso."""
+        candidates = [instance for instance in self.instances
+                      if instance.weight > 0 and instance.breaker.is_available()]
+        # Si el prober marca todas como caídas se confía en los breakers (fail-open)
+        candidates = [instance for instance in candidates if not instance.health.is_down] or candidates
+        # Al reintentar se prefiere otra instancia, pero si no hay otra se repite la misma
+        preferred = [instance for instance in candidates if instance.url not in exclude]
+        candidates = preferred or candidates
+        if not candidates:
+            return None
+
+        best_score = min((instance.in_flight + 1) / instance.weight for instance in candidates)
+        best = [instance for instance in candidates
+                if (instance.in_flight + 1) / instance.weight == best_score]
+        return random.choice(best)
+
+    def retry_after(self) -> float:
+        waits = [instance.breaker.retry_after() for instance in self.instances if instance.weight > 0]
+        return min(waits) if waits else BREAKER_RESET_TIMEOUT
+
+    def snapshot(self) -> dict:
+        requests = sum(instance.requests_total for instance in self.instances)
+        opened = sum(instance.connections_opened for instance in self.instances)
+        return {
+            "instances": [instance.snapshot() for instance in self.instances],
+            "connection_reuse_ratio": round(max(0, requests - opened) / requests, 3) if requests else None,
+            "bulkhead": self.bulkhead.snapshot(),
+            "hedging": {
+                "delay_ms": {route: round(window.hedge_delay() * 1000, 2)
+                             for route, window in self.latencies.items()},
+                "hedges": self.hedge_budget.retries,
+                "skipped_by_budget": self.hedge_budget.rejected
+            },
+            "retries": self.budget.retries,
+            "retries_rejected_by_budget": self.budget.rejected
+        }
+
+def parse_instances(service: str, value: str) -> list[UpstreamInstance]:
+    """Lee una lista de instancias separadas por comas, con peso y socket Unix opcionales.
+
+    Ejemplo: "http://booking-1:5000,http://booking-2:5000;weight=2;uds=/run/booking.sock"
+    """
+    instances = []
+    for item in value.split(","):
+        item = item.strip()
+        if not item:
+            continue
+        url, *options = item.split(";")
+        settings = dict(option.strip().partition("=")[::2] for option in options if "=" in option)
+        instances.append(UpstreamInstance(
+            service,
+            url.strip(),
+            weight=float(settings.get("weight", "1")),
+            uds=settings.get("uds") or None
+        ))
+    return instances
+
+SERVICE_URLS = {
+    "auth": AUTH_URL,
+    "booking": BOOKING_URL,
+    "payment": PAYMENT_URL,
+    "workshops": WORKSHOPS_URL
+}
+if COMPOSITE_MODE:
+    # El host es solo una etiqueta: las rutas y respuestas son las mismas que por la red
+    pools = {
+        name: UpstreamPool(name, [UpstreamInstance(name, f"http://{name}-service", app=service_app)])
+        for name, service_app in composite_apps.items()
+    }
+else:
+    pools = {name: UpstreamPool(name, parse_instances(name, value)) for name, value in SERVICE_URLS.items()}
+
+def primary_instance(service: str) -> UpstreamInstance:
+    """Primera instancia del servicio (para endpoints de diagnóstico)."""
+    return pools[service].instances[0]
+
+def primary_url(service: str) -> str:
+    return primary_instance(service).url
+
+def instance_label(service: str, instance: UpstreamInstance) -> str:
+    return service if len(pools[service].instances) == 1 else f"{service}@{instance.url}"
+
+# ================================
+# HEALTH PROBER EN SEGUNDO PLANO
+# ================================
+
+async def probe_instance(instance: UpstreamInstance):
+    start = time.perf_counter()
+    try:
+        response = await instance.probe_client.get(f"{instance.url}/health")
+        latency_ms = (time.perf_counter() - start) * 1000
+        try:
+            body = response.json()
+        except ValueError:
+            body = response.text[:200]
+        instance.health.record(latency_ms, response.status_code, body)
+    except Exception as e:
+        instance.health.record((time.perf_counter() - start) * 1000, error=str(e) or type(e).__name__)
+
+    if instance.health.is_down and instance.health.consecutive_failures == HEALTH_UNHEALTHY_THRESHOLD:
+        logger.warning("🏥 %s@%s marcado como caído: %s", instance.service, instance.url, instance.health.error)
+
+async def probe_all_instances():
+    await asyncio.gather(*(probe_instance(instance)
+                           for pool in pools.values() for instance in pool.instances))
+
+async def health_prober():
+    """Revisa todas las instancias en paralelo cada HEALTH_CHECK_INTERVAL segundos."""
+    while True:
+        try:
+            await probe_all_instances()
+        except Exception as e:
+            logger.error("❌ Error en health prober: %s", e)
+        await asyncio.sleep(HEALTH_CHECK_INTERVAL)
+
+health_prober_task: Optional[asyncio.Task] = None
+
+@app.on_event("startup")
+async def start_health_prober():
+    global health_prober_task
+    health_prober_task = asyncio.create_task(health_prober())
+    logger.info("🏥 Health prober iniciado (cada %ss)", HEALTH_CHECK_INTERVAL)
+
+def backoff_delay(attempt: int) -> float:
+    """Backoff exponencial con full jitter."""
+    return random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * (2 ** attempt)))
+
+def transport_error_kind(e: httpx.TransportError) -> str:
+    if isinstance(e, httpx.TimeoutException):
+        return "timeout"
+    if isinstance(e, httpx.ConnectError):
+        return "connect"
+    return "transport"
+
+async def send_upstream(service: str, build_request, stream: bool = False,
+                        idempotent: bool = False, priority: str = "normal",
+                        hedge: Optional[str] = None) -> httpx.Response:
+    """Envía la petición a la mejor instancia del servicio pasando por su circuit breaker.
+
+    build_request(base_url) se llama en cada intento para construir un httpx.Request nuevo.
+    Solo las peticiones idempotentes se reintentan (en otra instancia si la hay), y solo
+    mientras quede presupuesto de reintentos en el pool. Todos los intentos ocupan un
+    solo lugar del bulkhead del servicio, que se libera al recibir los headers.
+    Con hedge=<ruta> (solo idempotentes) puede lanzarse un segundo intento en paralelo,
+    usando la latencia reciente de esa ruta para decidir cuándo.
+    """
+    pool = pools[service]
+    if BULKHEAD_ENABLED:
+        await pool.bulkhead.acquire(priority)
+    try:
+        if hedge and idempotent:
+            return await send_hedged(service, pool, hedge, build_request, stream)
+        return await send_with_retries(service, pool, build_request, stream, idempotent)
+    finally:
+        if BULKHEAD_ENABLED:
+            pool.bulkhead.release()
+
+async def send_with_retries(service: str, pool: UpstreamPool, build_request, stream: bool,
+                            idempotent: bool, latencies: Optional[LatencyWindow] = None,
+                            tried: Optional[set[str]] = None) -> httpx.Response:
+    """Envía con reintentos acotados por presupuesto; `tried` acumula las instancias usadas."""
+    pool.budget.deposit()
+    attempt = 0
+    tried = set() if tried is None else tried
+    trace = current_trace.get()
+    if trace is not None:
+        trace.upstream_service = service
+
+    while True:
+        instance = pool.pick(exclude=tried)
+        if instance is None or not instance.breaker.allow_request():
+            upstream_errors.inc(service, "circuit_open")
+            raise CircuitOpenError(service, pool.retry_after())
+        tried.add(instance.url)
+
+        can_retry = idempotent and attempt < RETRY_MAX_ATTEMPTS
+        # En modo stream se cuenta hasta recibir los headers, que es donde el upstream trabaja
+        instance.in_flight += 1
+        instance.requests_total += 1
+        start_time = time.perf_counter()
+        try:
+            upstream_request = build_request(instance.url)
+            upstream_request.extensions["trace"] = instance.trace
+            if trace is not None:
+                upstream_request.headers[REQUEST_ID_HEADER] = trace.request_id
+            response = await instance.client.send(upstream_request, stream=stream)
+        except httpx.TransportError as e:
+            upstream_errors.inc(service, transport_error_kind(e))
+            instance.breaker.record_failure()
+            if can_retry and pool.budget.withdraw():
+                attempt += 1
+                delay = backoff_delay(attempt)
+                record_span("retry-wait", delay, service)
+                await asyncio.sleep(delay)
+                continue
+            raise
+        finally:
+            instance.in_flight -= 1
+            record_span("upstream", time.perf_counter() - start_time, service)
+        upstream_request_seconds.observe(time.perf_counter() - start_time, service)
+
+        if response.status_code < 500:
+            instance.breaker.record_success()
+            if latencies is not None:
+                latencies.record(time.perf_counter() - start_time)
+            return response
+
+        upstream_errors.inc(service, "status_5xx")
+        if response.status_code not in RETRYABLE_STATUS:
+            # La instancia respondió: el 500 es de la ruta, no abre el circuito de todas
+            instance.breaker.record_success()
+            return response
+        instance.breaker.record_failure()
+        if can_retry and pool.budget.withdraw():
+            await response.aclose()
+            attempt += 1
+            logger.warning("🔁 Reintento %s a %s tras status %s de %s", attempt, service, response.status_code, instance.url)
+            delay = backoff_delay(attempt)
+            record_span("retry-wait", delay, service)
+            await asyncio.sleep(delay)
+            continue
+        return response
+
+def close_losing_response(task: asyncio.Task):
+    # Si el perdedor alcanzó a recibir respuesta, se libera su conexión
+    if not task.cancelled() and task.exception() is None:
+        asyncio.ensure_future(task.result().aclose())
+
+def hedge_candidate(pool: UpstreamPool, tried: set[str]) -> Optional[UpstreamInstance]:
+    """Otra instancia sana para el hedge; repetir en la misma solo duplicaría su carga."""
+    instance = pool.pick(exclude=tried)
+    if instance is None or instance.url in tried or instance.health.is_down:
+        return None
+    return instance
+
+def acceptable_result(task: asyncio.Task) -> bool:
+    # Un 502/503/504 rápido no le gana a un intento más lento que puede salir bien
+    return task.exception() is None and task.result().status_code not in RETRYABLE_STATUS
+
+async def send_hedged(service: str, pool: UpstreamPool, route: str, build_request, stream: bool) -> httpx.Response:
+    """Primer intento normal; si no responde dentro del retraso de hedging, hay otra instancia
+    sana y hay presupuesto, se lanza un segundo intento hacia esa otra instancia.
+    Gana la primera respuesta que no sea error ni status reintentable; el otro intento se cancela."""
+    pool.hedge_budget.deposit()
+    latencies = pool.latency_window(route)
+    primary_tried: set[str] = set()
+    primary = asyncio.ensure_future(
+        send_with_retries(service, pool, build_request, stream, True, latencies, primary_tried))
+    tasks = [primary]
+    winner = None
+    try:
+        done, _ = await asyncio.wait(tasks, timeout=latencies.hedge_delay())
+        if not done and hedge_candidate(pool, primary_tried) is None:
+            upstream_hedges_skipped.inc(service, "no_instance")
+            await asyncio.wait(tasks)
+        elif not done and not pool.hedge_budget.withdraw():
+            upstream_hedges_skipped.inc(service, "budget")
+            await asyncio.wait(tasks)
+        elif not done:
+            upstream_hedges.inc(service)
+            record_span("hedge", latencies.hedge_delay(), service)
+            tasks.append(asyncio.ensure_future(
+                send_with_retries(service, pool, build_request, stream, True, latencies, set(primary_tried))))
+            pending = set(tasks)
+            while pending and winner is None:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                winner = next((task for task in tasks if task in done and acceptable_result(task)), None)
+            if winner is not None and winner is not primary:
+                upstream_hedge_wins.inc(service)
+
+        # Sin ganador (o sin hedge) se devuelve el resultado o el error del intento original
+        winner = winner or primary
+        return winner.result()
+    finally:
+        for task in tasks:
+            if task is winner:
+                continue
+            if task.done():
+                close_losing_response(task)
+            else:
+                task.add_done_callback(close_losing_response)
+                task.cancel()
+
+def circuit_open_exception(e: CircuitOpenError) -> HTTPException:
+    logger.warning("⛔ %s, fallando rápido", e)
+    return HTTPException(
+        status_code=503,
+        detail="Error al conectar con el servidor. Estamos trabajando para encender el horno para ti. Vuelve más tarde.",
+        headers={"Retry-After": str(max(1, int(e.retry_after + 0.999)))}
+    )
+
+# Middleware para logging de requests: una sola línea de acceso por petición
 @app.middleware("http")
 async def log_requests(request: Request, call_next):
-    start_time = time.time()
-    
-    # Log request details con mejor formato
-    client_ip = request.client.host if request.client else "unknown"
-    logger.info(f"🔵 {request.method} {request.url.path} from {client_ip}")
-    
-    # Log headers importantes (sin datos sensibles)
-    important_headers = {
-        "content-type": request.headers.get("content-type"),
-        "user-agent": request.headers.get("user-agent", "")[:50] + "..." if len(request.headers.get("user-agent", "")) > 50 else request.headers.get("user-agent", ""),
-        "authorization": "Bearer ***" if request.headers.get("authorization") else None
-    }
-    filtered_headers = {k: v for k, v in important_headers.items() if v}
-    if filtered_headers:
-        logger.info(f"📋 Headers: {filtered_headers}")
-    
-    response = await call_next(request)
+    start_time = time.perf_counter()
+    trace = GatewayTrace(incoming_request_id(request))
+    current_trace.set(trace)
+    http_requests_in_flight.inc()
+    try:
+        response = await call_next(request)
+    except Exception:
+        http_request_seconds.observe(time.perf_counter() - start_time, request.method, route_label(request), "500")
+        raise
+    finally:
+        http_requests_in_flight.dec()
+    duration = time.perf_counter() - start_time
+    http_request_seconds.observe(duration, request.method, route_label(request), str(response.status_code))
+
+    # El X-Request-ID del upstream se reemplaza (en peticiones coalescidas sería el de otro cliente)
+    upstream_timing = response.headers.getlist("server-timing")
+    if upstream_timing:
+        del response.headers["server-timing"]
+    response.headers[REQUEST_ID_HEADER] = trace.request_id
+    response.headers["Server-Timing"] = trace.server_timing(duration, upstream_timing)
+    write_slow_trace(request, trace, response.status_code, duration, upstream_timing)
     
-    process_time = time.time() - start_time
-    status_emoji = "✅" if response.status_code < 400 else "❌" if response.status_code >= 500 else "⚠️"
-    logger.info(f"{status_emoji} {request.method} {request.url.path} - Status: {response.status_code} - Time: {process_time:.2f}s")
+    # Con LOG_LEVEL=WARNING (producción) solo se registran los 5xx y no se arma nada más
+    level = logging.ERROR if response.status_code >= 500 else logging.INFO
+    if logger.isEnabledFor(level):
+        fields = {
+            "method": request.method,
+            "path": request.url.path,
+            "status": response.status_code,
+            "duration_ms": round(duration * 1000, 2),
+            "client_ip": request.client.host if request.client else "unknown"
+        }
+        if sample_debug():
+            # Headers importantes (sin datos sensibles)
+            user_agent = request.headers.get("user-agent", "")
+            fields["headers"] = {
+                "content-type": request.headers.get("content-type"),
+                "user-agent": user_agent[:50] + "..." if len(user_agent) > 50 else user_agent,
+                "authorization": "Bearer ***" if request.headers.get("authorization") else None
+            }
+        logger.log(level, "request", extra={"fields": fields})
     
     return response
 
+def build_upstream_path(request: Request, strip_prefix: str, add_prefix: str = "") -> str:
+    path = request.url.path.removeprefix(strip_prefix)
+    if add_prefix and not path.startswith(add_prefix):
+        path = add_prefix + path
+    return path
+
+# FUNCIÓN PROXY EN MODO STREAMING
+async def proxy_stream(request: Request, service: str, strip_prefix: str, add_prefix: str = "",
+                       identity: Optional[str] = None, priority: str = "normal", hedge: Optional[str] = None):
+    """Reenvía request y response como flujos de bytes, sin decodificar ni re-serializar.
+
+    El status, los headers (incluyendo content-length y content-encoding) y el body
+    del microservicio llegan al cliente sin cambios.
+    """
+    path = build_upstream_path(request, strip_prefix, add_prefix)
+    logger.debug("🔄 Streaming: %s %s -> %s%s", request.method, request.url.path, service, path)
+
+    headers = build_upstream_headers(request, identity)
+
+    # Solo se abre un stream de subida si el cliente realmente envía body
+    has_body = "content-length" in request.headers or "transfer-encoding" in request.headers
+    content = request.stream() if has_body else None
+
+    def build_request(base_url: str):
+        return client.build_request(
+            method=request.method,
+            url=f"{base_url}{path}",
+            headers=headers,
+            params=request.url.query,
+            content=content
+        )
+
+    try:
+        response = await send_upstream(
+            service, build_request, stream=True,
+            idempotent=request.method in IDEMPOTENT_METHODS and content is None,
+            priority=priority,
+            hedge=hedge
+        )
+    except Exception as e:
+        raise upstream_http_exception(e, service)
+
+    logger.debug("✅ Response from %s: %s", service, response.status_code)
+
+    # Los GET 200 de tamaño acotado se leen completos para poder calcular ETag y comprimir
+    if is_conditional_candidate(request, response):
+        try:
+            body = b"".join([chunk async for chunk in response.aiter_raw()])
+        finally:
+            await response.aclose()
+        return await build_optimized_response(request, response.status_code, response.headers.multi_items(), body)
+
+    streaming_response = StreamingResponse(
+        response.aiter_raw(),
+        status_code=response.status_code,
+        background=BackgroundTask(response.aclose)
+    )
+    # raw_headers conserva headers repetidos (ej. set-cookie) tal como llegan
+    streaming_response.raw_headers = encode_response_headers(response.headers.multi_items())
+    return streaming_response
+
+def encode_response_headers(items) -> list[tuple[bytes, bytes]]:
+    return [
+        (key.encode("latin-1"), value.encode("latin-1"))
+        for key, value in items
+        if key.lower() not in HOP_BY_HOP_HEADERS
+    ]
+
+def upstream_http_exception(e: Exception, service: str) -> HTTPException:
+    """Traduce un error al contactar el upstream en la respuesta HTTP del gateway."""
+    if isinstance(e, HTTPException):
+        return e
+    if isinstance(e, CircuitOpenError):
+        return circuit_open_exception(e)
+    if isinstance(e, BulkheadRejectedError):
+        return bulkhead_exception(e)
+    if isinstance(e, httpx.TimeoutException):
+        logger.error("⏰ Timeout al conectar con %s", service)
+        status_code = 504
+    elif isinstance(e, httpx.ConnectError):
+        logger.error("🔌 Error de conexión con %s", service)
+        status_code = 503
+    else:
+        logger.error("❌ Error proxying to %s: %s", service, e)
+        status_code = 500
+    return HTTPException(
+        status_code=status_code,
+        detail="Error al conectar con el servidor. Estamos trabajando para encender el horno para ti. Vuelve más tarde."
+    )
+
+# ================================
+# COMPRESIÓN Y ETAG / 304 NOT MODIFIED
+# ================================
+
+COMPRESSION_MIN_SIZE = int(os.getenv("COMPRESSION_MIN_SIZE", "1024"))
+COMPRESSION_LEVEL = int(os.getenv("COMPRESSION_LEVEL", "5"))
+# Por encima de este tamaño se comprime en un thread para no bloquear el event loop
+COMPRESSION_THREAD_MIN_SIZE = int(os.getenv("COMPRESSION_THREAD_MIN_SIZE", str(256 * 1024)))
+ETAG_MAX_BODY_BYTES = int(os.getenv("ETAG_MAX_BODY_BYTES", str(2 * 1024 * 1024)))
+COMPRESSED_CACHE_SIZE = int(os.getenv("COMPRESSED_CACHE_SIZE", "256"))
+
+# Cuerpos ya comprimidos por (etag, encoding): un catálogo sin cambios se comprime una sola vez
+compressed_cache: "OrderedDict[tuple[str, str], bytes]" = OrderedDict()
+conditional_stats = {"not_modified": 0, "compressed": 0, "compressed_cache_hits": 0, "bytes_saved": 0}
+
+def compute_etag(body: bytes) -> str:
+    return '"' + hashlib.blake2b(body, digest_size=16).hexdigest() + '"'
+
+def choose_encoding(accept_encoding: str) -> Optional[str]:
+    """Elige br o gzip según Accept-Encoding (respetando q=0)."""
+    accepted = {}
+    for part in accept_encoding.split(","):
+        token, _, params = part.partition(";")
+        quality = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        accepted[token.strip().lower()] = quality
+
+    if brotli is not None and accepted.get("br", 0) > 0:
+        return "br"
+    if accepted.get("gzip", 0) > 0:
+        return "gzip"
+    return None
+
+def etag_matches(if_none_match: str, etags: set[str]) -> bool:
+    if if_none_match.strip() == "*":
+        return True
+    return any(tag.strip().removeprefix("W/") in etags for tag in if_none_match.split(","))
+
+async def compress_body(body: bytes, encoding: str, etag: str) -> bytes:
+    key = (etag, encoding)
+    cached = compressed_cache.get(key)
+    if cached is not None:
+        compressed_cache.move_to_end(key)
+        conditional_stats["compressed_cache_hits"] += 1
+        return cached
+
+    if encoding == "br":
+        compress = partial(brotli.compress, quality=COMPRESSION_LEVEL)
+    else:
+        compress = partial(gzip.compress, compresslevel=COMPRESSION_LEVEL)
+    if len(body) >= COMPRESSION_THREAD_MIN_SIZE:
+        compressed = await asyncio.to_thread(compress, body)
+    else:
+        compressed = compress(body)
+
+    compressed_cache[key] = compressed
+    if len(compressed_cache) > COMPRESSED_CACHE_SIZE:
+        compressed_cache.popitem(last=False)
+    return compressed
+
+def is_conditional_candidate(request: Request, response: httpx.Response) -> bool:
+    """GET 200 sin codificar y con content-length conocido y acotado."""
+    if request.method != "GET" or response.status_code != 200:
+        return False
+    if "content-encoding" in response.headers:
+        return False
+    content_length = response.headers.get("content-length")
+    return content_length is not None and content_length.isdigit() and int(content_length) <= ETAG_MAX_BODY_BYTES
+
+async def build_optimized_response(request: Request, status_code: int, headers: list[tuple[str, str]],
+                                   body: bytes) -> Response:
+    """Arma la respuesta final de un body ya leído: ETag fuerte, 304 si el cliente ya lo
+    tiene y compresión gzip/br si el body supera COMPRESSION_MIN_SIZE."""
+    header_names = {key.lower() for key, _ in headers}
+    if request.method != "GET" or status_code != 200 or "content-encoding" in header_names:
+        response = Response(content=body, status_code=status_code)
+        response.raw_headers = encode_response_headers(headers)
+        return response
+
+    etag = next((value for key, value in headers if key.lower() == "etag"), None) or compute_etag(body)
+    encoding = None
+    if len(body) >= COMPRESSION_MIN_SIZE:
+        encoding = choose_encoding(request.headers.get("accept-encoding", ""))
+
+    # Cada representación (sin comprimir, gzip, br) tiene su propio ETag fuerte
+    base_tag = etag[:-1] if etag.endswith('"') else etag
+    closing = '"' if etag.endswith('"') else ""
+    representation_etag = f"{base_tag}-{encoding}{closing}" if encoding else etag
+    known_etags = {etag, f"{base_tag}-gzip{closing}", f"{base_tag}-br{closing}"}
+
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match and etag_matches(if_none_match, known_etags):
+        conditional_stats["not_modified"] += 1
+        conditional_stats["bytes_saved"] += len(body)
+        return Response(status_code=304, headers={"ETag": representation_etag, "Vary": "Accept-Encoding"})
+
+    out_headers = [(key, value) for key, value in headers if key.lower() not in ("content-length", "etag")]
+    if encoding:
+        compressed = await compress_body(body, encoding, etag)
+        conditional_stats["compressed"] += 1
+        conditional_stats["bytes_saved"] += len(body) - len(compressed)
+        body = compressed
+        out_headers.append(("Content-Encoding", encoding))
+    out_headers += [
+        ("Content-Length", str(len(body))),
+        ("ETag", representation_etag),
+        ("Vary", "Accept-Encoding")
+    ]
+
+    response = Response(content=body, status_code=status_code)
+    response.raw_headers = encode_response_headers(out_headers)
+    return response
+
+# ================================
+# COALESCING DE GETs IDÉNTICOS (SINGLE-FLIGHT)
+# ================================
+
+# Rutas con coalescing activado; las terminadas en "*" se comparan como prefijo
+COALESCE_ROUTES = parse_routes(os.getenv(
+    "COALESCE_ROUTES",
+    "/api/v0/workshops/,/api/v0/workshops/buscar,/api/v0/payment/methods"
+))
+
+class UpstreamResult:
+    """Respuesta de un upstream leída completa, para poder entregarla a varios clientes."""
+
+    def __init__(self, status_code: int, headers: list[tuple[str, str]], body: bytes, generation: int = 0):
+        self.status_code = status_code
+        self.headers = headers
+        self.body = body
+        # Generación de la cache de respuestas cuando se inició la petición al upstream
+        self.generation = generation
+
+# Peticiones en curso por clave (método, path, query, identidad) y contadores por ruta
+coalescing_inflight: dict[tuple, asyncio.Task] = {}
+coalescing_stats: dict[str, dict] = {}
+
+def coalesce_route(path: str) -> Optional[str]:
+    return match_route(path, COALESCE_ROUTES)
+
+async def fetch_upstream_result(service: str, path: str, method: str, headers, query: str,
+                                priority: str = "normal", hedge: Optional[str] = None,
+                                content: Optional[bytes] = None) -> UpstreamResult:
+    generation = response_cache.generation
+    response = await send_upstream(
+        service,
+        lambda base_url: client.build_request(method, f"{base_url}{path}", headers=headers, params=query,
+                                              content=content),
+        stream=True,
+        idempotent=method in IDEMPOTENT_METHODS and not content,
+        priority=priority,
+        hedge=hedge
+    )
+    try:
+        # Bytes sin decodificar: content-encoding y content-length siguen siendo válidos
+        body = b"".join([chunk async for chunk in response.aiter_raw()])
+    finally:
+        await response.aclose()
+    return UpstreamResult(response.status_code, response.headers.multi_items(), body, generation)
+
+def discard_task_exception(task: asyncio.Task):
+    # Evita el warning "exception was never retrieved" si todos los clientes se desconectaron
+    if not task.cancelled():
+        task.exception()
+
+async def fetch_coalesced(request: Request, service: str, route: str, path: str,
+                          identity: Optional[str] = None, priority: str = "normal",
+                          hedge: Optional[str] = None) -> UpstreamResult:
+    """Comparte una sola petición al upstream entre todos los GET idénticos concurrentes.
+
+    La petición corre en su propia task, así que si el cliente que la originó se desconecta
+    los demás siguen recibiendo la respuesta.
+    """
+    key = (request.method, path, request.url.query, identity or "")
+    stats = coalescing_stats.setdefault(route, {"upstream_calls": 0, "coalesced": 0})
+
+    task = coalescing_inflight.get(key)
+    if task is not None:
+        stats["coalesced"] += 1
+    else:
+        stats["upstream_calls"] += 1
+        headers = build_upstream_headers(request, identity)
+        task = asyncio.ensure_future(
+            fetch_upstream_result(service, path, request.method, headers, request.url.query, priority, hedge)
+        )
+        coalescing_inflight[key] = task
+        task.add_done_callback(lambda _: coalescing_inflight.pop(key, None))
+        task.add_done_callback(discard_task_exception)
+
+    return await asyncio.shield(task)
+
+async def proxy_coalesced(request: Request, service: str, route: str, strip_prefix: str,
+                          add_prefix: str = "", identity: Optional[str] = None, priority: str = "normal",
+                          hedge: Optional[str] = None):
+    path = build_upstream_path(request, strip_prefix, add_prefix)
+    try:
+        result = await fetch_coalesced(request, service, route, path, identity, priority, hedge)
+    except Exception as e:
+        raise upstream_http_exception(e, service)
+    return await build_optimized_response(request, result.status_code, result.headers, result.body)
+
+# ================================
+# CACHE DE RESPUESTAS GET
+# ================================
+
+CACHE_ENABLED = os.getenv("CACHE_ENABLED", "true").lower() == "true"
+# Reglas "ruta=ttl[;swr=segundos][;per_user]". swr = tiempo extra en que se sirve la copia
+# vencida mientras se refresca en segundo plano; per_user separa la cache por usuario
+CACHE_ROUTES = os.getenv(
+    "CACHE_ROUTES",
+    "/api/v0/workshops/=30;swr=60,/api/v0/workshops/buscar=15;swr=30,/api/v0/payment/methods=300;swr=600"
+)
+CACHE_MAX_ENTRIES = int(os.getenv("CACHE_MAX_ENTRIES", "1000"))
+CACHE_MAX_BYTES = int(os.getenv("CACHE_MAX_BYTES", str(32 * 1024 * 1024)))
+CACHE_MAX_ENTRY_BYTES = int(os.getenv("CACHE_MAX_ENTRY_BYTES", str(1024 * 1024)))
+# Servicios cuyas copias se invalidan cuando otro escribe: reservar/cancelar cambia los cupos
+# de los talleres, que viven en la tabla workshops
+CACHE_WRITE_INVALIDATES = {"booking": ("booking", "workshops")}
+# Headers propios de cada respuesta que no se guardan con la copia
+CACHE_SKIP_HEADERS = {"server-timing", "x-request-id", "set-cookie"}
+
+class CacheRule:
+    def __init__(self, route: str, service: str, ttl: float, swr: float, per_user: bool):
+        self.route = route
+        self.service = service
+        self.ttl = ttl
+        self.swr = swr
+        self.per_user = per_user
+
+def parse_cache_rules(value: str) -> dict[str, CacheRule]:
+    rules = {}
+    for item in parse_routes(value):
+        head, *options = item.split(";")
+        route, _, ttl = head.partition("=")
+        route = route.strip()
+        settings = dict(option.strip().partition("=")[::2] for option in options)
+        service = route.removeprefix("/api/v0/").split("/", 1)[0]
+        rules[route] = CacheRule(route, service, float(ttl or 60), float(settings.get("swr") or 0),
+                                 "per_user" in settings)
+    return rules
+
+CACHE_RULES = parse_cache_rules(CACHE_ROUTES)
+
+def cache_rule(path: str) -> Optional[CacheRule]:
+    route = match_route(path, list(CACHE_RULES))
+    return CACHE_RULES[route] if route else None
+
+def cache_control_directives(headers: list[tuple[str, str]]) -> dict[str, str]:
+    directives = {}
+    for key, value in headers:
+        if key.lower() != "cache-control":
+            continue
+        for part in value.split(","):
+            name, _, argument = part.strip().partition("=")
+            if name:
+                directives[name.lower()] = argument.strip('"')
+    return directives
+
+def response_ttl(rule: CacheRule, result: UpstreamResult) -> Optional[float]:
+    """TTL de la respuesta: el Cache-Control del upstream manda sobre el de la regla.
+    None si no se debe guardar."""
+    if result.status_code != 200 or len(result.body) > CACHE_MAX_ENTRY_BYTES:
+        return None
+    if any(key.lower() == "set-cookie" for key, _ in result.headers):
+        return None
+    directives = cache_control_directives(result.headers)
+    if "no-store" in directives or "no-cache" in directives:
+        return None
+    if "private" in directives and not rule.per_user:
+        return None
+    for name in ("s-maxage", "max-age"):
+        if name in directives:
+            try:
+                return float(directives[name])
+            except ValueError:
+                return None
+    return rule.ttl
+
+class CacheEntry:
+    __slots__ = ("result", "rule", "stored_at", "fresh_until", "stale_until", "size")
+
+    def __init__(self, result: UpstreamResult, rule: CacheRule, ttl: float):
+        self.result = result
+        self.rule = rule
+        self.stored_at = time.monotonic()
+        self.fresh_until = self.stored_at + ttl
+        self.stale_until = self.fresh_until + rule.swr
+        self.size = len(result.body) + sum(len(key) + len(value) for key, value in result.headers)
+
+class ResponseCache:
+    """LRU acotado por cantidad de entradas y por bytes. Clave: (path, query, usuario)."""
+
+    def __init__(self, max_entries: int, max_bytes: int):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.entries: "OrderedDict[tuple, CacheEntry]" = OrderedDict()
+        self.bytes = 0
+        # Refrescos en segundo plano por clave (también evita que la task sea recolectada)
+        self.refreshing: dict[tuple, asyncio.Task] = {}
+        # Cada purge la incrementa: una respuesta pedida antes de la purga no se guarda
+        self.generation = 0
+        self.stats = {"hits": 0, "stale_hits": 0, "misses": 0, "stores": 0, "evictions": 0, "purged": 0,
+                      "stale_stores_skipped": 0}
+
+    def get(self, key: tuple) -> Optional[CacheEntry]:
+        entry = self.entries.get(key)
+        if entry is not None:
+            self.entries.move_to_end(key)
+        return entry
+
+    def put(self, key: tuple, entry: CacheEntry):
+        self.remove(key)
+        self.entries[key] = entry
+        self.bytes += entry.size
+        self.stats["stores"] += 1
+        while self.entries and (len(self.entries) > self.max_entries or self.bytes > self.max_bytes):
+            _, evicted = self.entries.popitem(last=False)
+            self.bytes -= evicted.size
+            self.stats["evictions"] += 1
+
+    def remove(self, key: tuple) -> bool:
+        entry = self.entries.pop(key, None)
+        if entry is None:
+            return False
+        self.bytes -= entry.size
+        return True
+
+    def purge(self, prefix: str = "", service: Optional[str] = None) -> int:
+        # Aunque no haya copias: puede haber misses o refrescos en curso con datos previos
+        self.generation += 1
+        keys = [key for key, entry in self.entries.items()
+                if key[0].startswith(prefix) and (service is None or entry.rule.service == service)]
+        for key in keys:
+            self.remove(key)
+        self.stats["purged"] += len(keys)
+        return len(keys)
+
+    def snapshot(self) -> dict:
+        return {
+            "entries": len(self.entries),
+            "bytes": self.bytes,
+            "max_entries": self.max_entries,
+            "max_bytes": self.max_bytes,
+            "refreshing": len(self.refreshing),
+            "generation": self.generation,
+            "rules": {route: {"ttl": rule.ttl, "swr": rule.swr, "per_user": rule.per_user}
+                      for route, rule in CACHE_RULES.items()},
+            **self.stats
+        }
+
+response_cache = ResponseCache(CACHE_MAX_ENTRIES, CACHE_MAX_BYTES)
+
+def store_response(key: tuple, rule: CacheRule, result: UpstreamResult):
+    if result.generation != response_cache.generation:
+        # Se pidió antes de una escritura que purgó la cache: puede traer datos previos
+        response_cache.stats["stale_stores_skipped"] += 1
+        return
+    ttl = response_ttl(rule, result)
+    if ttl is None or ttl <= 0:
+        return
+    headers = [(name, value) for name, value in result.headers if name.lower() not in CACHE_SKIP_HEADERS]
+    # El ETag se calcula una sola vez por copia, no en cada hit
+    if not any(name.lower() == "etag" for name, _ in headers):
+        headers.append(("ETag", compute_etag(result.body)))
+    response_cache.put(key, CacheEntry(UpstreamResult(result.status_code, headers, result.body), rule, ttl))
+
+async def cached_response(request: Request, entry_result: UpstreamResult, state: str, age: float) -> Response:
+    headers = list(entry_result.headers) + [("X-Cache", state), ("Age", str(int(age)))]
+    return await build_optimized_response(request, entry_result.status_code, headers, entry_result.body)
+
+def schedule_refresh(request: Request, key: tuple, rule: CacheRule, service: str, path: str,
+                     identity: Optional[str]):
+    if key in response_cache.refreshing:
+        return
+    headers = build_upstream_headers(request, identity)
+    query = request.url.query
+
+    async def refresh():
+        try:
+            result = await fetch_upstream_result(service, path, "GET", headers, query, "low")
+            store_response(key, rule, result)
+        except Exception as e:
+            logger.warning("♻️ No se pudo refrescar la cache de %s: %s", key[0], e)
+        finally:
+            response_cache.refreshing.pop(key, None)
+
+    response_cache.refreshing[key] = asyncio.ensure_future(refresh())
+
+async def proxy_cached(request: Request, service: str, rule: CacheRule, strip_prefix: str,
+                       add_prefix: str = "", identity: Optional[str] = None, priority: str = "normal",
+                       hedge: Optional[str] = None):
+    """GET servido desde la cache si hay copia fresca; si está vencida pero dentro de swr se
+    sirve igual y se refresca en segundo plano. Los misses pasan por el coalescing."""
+    path = build_upstream_path(request, strip_prefix, add_prefix)
+    key = (request.url.path, request.url.query, (identity or "") if rule.per_user else "")
+    bypass = "no-cache" in request.headers.get("cache-control", "").lower()
+    entry = None if bypass else response_cache.get(key)
+    now = time.monotonic()
+
+    if entry is not None and now < entry.fresh_until:
+        response_cache.stats["hits"] += 1
+        gateway_cache_requests.inc(rule.route, "hit")
+        return await cached_response(request, entry.result, "HIT", now - entry.stored_at)
+    if entry is not None and now < entry.stale_until:
+        response_cache.stats["stale_hits"] += 1
+        gateway_cache_requests.inc(rule.route, "stale")
+        schedule_refresh(request, key, rule, service, path, identity)
+        return await cached_response(request, entry.result, "STALE", now - entry.stored_at)
+
+    response_cache.stats["misses"] += 1
+    gateway_cache_requests.inc(rule.route, "miss")
+    try:
+        result = await fetch_coalesced(request, service, rule.route, path, identity, priority, hedge)
+    except Exception as e:
+        # stale-if-error: mejor una copia vieja que un error
+        entry = entry or response_cache.get(key)
+        if entry is not None:
+            logger.warning("♻️ %s no responde, sirviendo copia vencida de %s", service, key[0])
+            return await cached_response(request, entry.result, "STALE", now - entry.stored_at)
+        raise upstream_http_exception(e, service)
+
+    store_response(key, rule, result)
+    return await cached_response(request, result, "MISS", 0)
+
 # FUNCIÓN PROXY MEJORADA
-async def proxy(request: Request, target_base: str, strip_prefix: str, add_prefix: str = ""):
+async def proxy(request: Request, service: str, strip_prefix: str, add_prefix: str = ""):
+    response = await forward_request(request, service, strip_prefix, add_prefix)
+    publish_push_events(response, service)
+    if service == "auth" and request.url.path in TOKEN_REVOKING_PATHS and response.status_code < 400:
+        forget_revoked_token(request)
+    # Una escritura exitosa invalida las copias cacheadas que dependen de ese servicio
+    if CACHE_ENABLED and request.method not in ("GET", "HEAD", "OPTIONS") and response.status_code < 400:
+        for affected in CACHE_WRITE_INVALIDATES.get(service, (service,)):
+            purged = response_cache.purge(service=affected)
+            if purged:
+                logger.debug("🧹 %s copias de %s invalidadas tras %s", purged, affected, request.method)
+    return response
+
+async def forward_request(request: Request, service: str, strip_prefix: str, add_prefix: str = ""):
+    identity = await authenticate_request(request)
+    enforce_rate_limit(request, identity)
+    priority = request_priority(request)
+    hedge = hedge_route(request)
+
+    idempotency_key = request.headers.get(IDEMPOTENCY_HEADER)
+    if idempotency_key and request.method in IDEMPOTENCY_METHODS:
+        return await proxy_idempotent(request, service, idempotency_key, strip_prefix, add_prefix,
+                                      identity, priority)
+
+    rule = cache_rule(request.url.path) if CACHE_ENABLED and request.method == "GET" else None
+    if rule:
+        return await proxy_cached(request, service, rule, strip_prefix, add_prefix, identity, priority, hedge)
+
+    route = coalesce_route(request.url.path) if request.method in ("GET", "HEAD") else None
+    if route:
+        return await proxy_coalesced(request, service, route, strip_prefix, add_prefix, identity, priority, hedge)
+
+    if PROXY_MODE == "stream":
+        return await proxy_stream(request, service, strip_prefix, add_prefix, identity, priority, hedge)
+
     try:
-        # Construir la URL destino
-        path = request.url.path.removeprefix(strip_prefix)
+        # Construir el path destino (la instancia se elige en send_upstream)
+        path = build_upstream_path(request, strip_prefix, add_prefix)
         
-        # Agregar prefijo específico para cada servicio si es necesario
-        if add_prefix and not path.startswith(add_prefix):
-            path = add_prefix + path
-        
-        # Construir URL completa
-        target_url = f"{target_base}{path}"
-        
-        logger.info(f"🔄 Proxying: {request.method} {request.url.path} -> {target_url}")
+        logger.debug("🔄 Proxying: %s %s -> %s%s", request.method, request.url.path, service, path)
         
         # Construir query parameters
         params = dict(request.query_params) if request.query_params else {}
-        if params:
-            logger.info(f"🔍 Query params: {params}")
         
         # Leer body del request
         body = await request.body()
-        if body:
+        
+        # Detalle de query y body solo en una muestra de peticiones con nivel DEBUG
+        debug_detail = sample_debug()
+        if debug_detail and params:
+            logger.debug("🔍 Query params: %s", params)
+        if debug_detail and body:
             try:
                 body_json = json.loads(body.decode())
                 # No logear datos sensibles como passwords
                 safe_body = {k: "***" if k in ["password", "card_number", "cvv"] else v 
                            for k, v in body_json.items()}
-                logger.info(f"📦 Request body: {safe_body}")
+                logger.debug("📦 Request body: %s", safe_body)
             except:
-                logger.info(f"📦 Request body (raw): {len(body)} bytes")
+                logger.debug("📦 Request body (raw): %s bytes", len(body))
         
-        # Preparar headers (excluir host y otros problemáticos)
-        headers = {key: value for key, value in request.headers.items() 
-                  if key.lower() not in ["host", "content-length", "connection"]}
+        # Preparar headers (excluir host y otros problemáticos) con la identidad verificada
+        headers = {key: value for key, value in build_upstream_headers(request, identity)
+                  if key.lower() != "content-length"}
         
         # Hacer la petición al microservicio
-        response = await client.request(
-            method=request.method,
-            url=target_url,
-            headers=headers,
-            content=body,
-            params=params
+        response = await send_upstream(
+            service,
+            lambda base_url: client.build_request(
+                method=request.method,
+                url=f"{base_url}{path}",
+                headers=headers,
+                content=body,
+                params=params
+            ),
+            idempotent=request.method in IDEMPOTENT_METHODS and not body,
+            priority=priority,
+            hedge=hedge
         )
         
-        logger.info(f"✅ Response from {target_base}: {response.status_code}")
+        logger.debug("✅ Response from %s: %s", service, response.status_code)
         
         # Log response body for debugging (primeros 300 chars)
-        try:
-            response_preview = response.text[:300]
-            if len(response.text) > 300:
-                response_preview += "..."
-            logger.info(f"📥 Response preview: {response_preview}")
-        except:
-            logger.info("📥 Response body not readable")
+        if debug_detail:
+            try:
+                response_preview = response.text[:300]
+                if len(response.text) > 300:
+                    response_preview += "..."
+                logger.debug("📥 Response preview: %s", response_preview)
+            except:
+                logger.debug("📥 Response body not readable")
         
         # Preparar headers de respuesta
         response_headers = {key: value for key, value in response.headers.items() 
@@ -156,20 +2015,24 @@ async def proxy(request: Request, target_base: str, strip_prefix: str, add_prefi
                 headers=response_headers
             )
         
+    except CircuitOpenError as e:
+        raise circuit_open_exception(e)
+    except BulkheadRejectedError as e:
+        raise bulkhead_exception(e)
     except httpx.TimeoutException:
-        logger.error(f"⏰ Timeout al conectar con {target_base}")
+        logger.error("⏰ Timeout al conectar con %s", service)
         raise HTTPException(
             status_code=504, 
             detail=f"Error al conectar con el servidor. Estamos trabajando para encender el horno para ti. Vuelve más tarde."
         )
     except httpx.ConnectError:
-        logger.error(f"🔌 Error de conexión con {target_base}")
+        logger.error("🔌 Error de conexión con %s", service)
         raise HTTPException(
             status_code=503, 
             detail=f"Error al conectar con el servidor. Estamos trabajando para encender el horno para ti. Vuelve más tarde."
         )
     except Exception as e:
-        logger.error(f"❌ Error proxying to {target_base}: {str(e)}")
+        logger.error("❌ Error proxying to %s: %s", service, e)
         raise HTTPException(
             status_code=500, 
             detail=f"Error al conectar con el servidor. Estamos trabajando para encender el horno para ti. Vuelve más tarde."
@@ -181,30 +2044,630 @@ async def proxy(request: Request, target_base: str, strip_prefix: str, add_prefi
 
 @app.api_route("/api/v0/auth/{path:path}", methods=["GET","POST","PUT","PATCH","DELETE"])
 async def proxy_auth(request: Request, path: str):
-    logger.info(f"🔐 Auth request: {request.method} /api/v0/auth/{path}")
-    return await proxy(request, AUTH_URL, "/api/v0/auth", "")
+    logger.debug("🔐 Auth request: %s /api/v0/auth/%s", request.method, path)
+    return await proxy(request, "auth", "/api/v0/auth", "")
 
 @app.api_route("/api/v0/booking/{path:path}", methods=["GET","POST","PUT","PATCH","DELETE"])
 async def proxy_booking(request: Request, path: str):
-    logger.info(f"📅 Booking request: {request.method} /api/v0/booking/{path}")
+    logger.debug("📅 Booking request: %s /api/v0/booking/%s", request.method, path)
     
     # Log especial para cancelaciones y restauraciones
     if "cancelar" in path:
-        logger.info(f"🗑️ CANCELACIÓN DETECTADA: {path}")
+        logger.info("🗑️ CANCELACIÓN DETECTADA: %s", path)
     elif "restaurar" in path:
-        logger.info(f"🔄 RESTAURACIÓN DETECTADA: {path}")
+        logger.info("🔄 RESTAURACIÓN DETECTADA: %s", path)
     
-    return await proxy(request, BOOKING_URL, "/api/v0/booking", "")
+    return await proxy(request, "booking", "/api/v0/booking", "")
 
 @app.api_route("/api/v0/payment/{path:path}", methods=["GET","POST","PUT","PATCH","DELETE"])
 async def proxy_payment(request: Request, path: str):
-    logger.info(f"💳 Payment request: {request.method} /api/v0/payment/{path}")
-    return await proxy(request, PAYMENT_URL, "/api/v0/payment", "")
+    logger.debug("💳 Payment request: %s /api/v0/payment/%s", request.method, path)
+    return await proxy(request, "payment", "/api/v0/payment", "")
 
 @app.api_route("/api/v0/workshops/{path:path}", methods=["GET","POST","PUT","PATCH","DELETE"])
 async def proxy_workshops(request: Request, path: str):
-    logger.info(f"🎓 Workshops request: {request.method} /api/v0/workshops/{path}")
-    return await proxy(request, WORKSHOPS_URL, "/api/v0/workshops", "")
+    logger.debug("🎓 Workshops request: %s /api/v0/workshops/%s", request.method, path)
+    return await proxy(request, "workshops", "/api/v0/workshops", "")
+
+# ================================
+# DASHBOARD AGREGADO
+# ================================
+
+async def fetch_upstream_json(service: str, path: str, identity: Optional[str]):
+    """GET interno a un microservicio; devuelve (status, json) usando pools y breakers."""
+    headers = {IDENTITY_HEADER: identity} if identity else {}
+    response = await send_upstream(
+        service,
+        lambda base_url: client.build_request("GET", f"{base_url}{path}", headers=headers),
+        idempotent=True,
+        priority="low"
+    )
+    return response.status_code, response.json()
+
+def dashboard_error(e: BaseException) -> str:
+    if isinstance(e, CircuitOpenError):
+        return "Servicio temporalmente no disponible"
+    if isinstance(e, BulkheadRejectedError):
+        return "Servicio saturado"
+    if isinstance(e, httpx.TimeoutException):
+        return "Timeout"
+    if isinstance(e, httpx.TransportError):
+        return "Error de conexión"
+    return str(e)
+
+@app.get("/api/v0/dashboard/{email:path}")
+async def get_dashboard(email: str, request: Request):
+    """Reservas (con su taller), historial de pagos y estadísticas en una sola respuesta.
+
+    Las cuatro consultas a los microservicios se hacen en paralelo. Si alguna falla se
+    devuelve el resto con "partial": true y el detalle en "errors". Solo el propio usuario
+    puede pedir su dashboard: sin token 401, con el token de otro usuario 403.
+    """
+    identity = await authenticate_request(request)
+    enforce_rate_limit(request, identity)
+    if not identity:
+        raise HTTPException(status_code=401, detail="Se requiere token", headers={"WWW-Authenticate": "Bearer"})
+    if identity.lower() != email.lower():
+        raise HTTPException(status_code=403, detail="No autorizado para acceder a datos de otro usuario")
+
+    # El email va codificado: "+", "#" o "?" romperían el path del microservicio
+    encoded = quote(email, safe="@")
+    sections = {
+        "bookings": ("booking", f"/usuario/{encoded}"),
+        "workshops": ("workshops", "/"),
+        "payments": ("payment", f"/history/{encoded}"),
+        "stats": ("booking", f"/usuario/{encoded}/estadisticas")
+    }
+    results = await asyncio.gather(
+        *(fetch_upstream_json(service, path, identity) for service, path in sections.values()),
+        return_exceptions=True
+    )
+
+    data = {}
+    errors = {}
+    for name, result in zip(sections, results):
+        if isinstance(result, BaseException):
+            errors[name] = dashboard_error(result)
+            data[name] = None
+            continue
+        status_code, body = result
+        if status_code == 404:
+            # Los microservicios responden 404 cuando la lista está vacía
+            data[name] = [] if name in ("bookings", "workshops") else None
+        elif status_code >= 400:
+            errors[name] = body.get("detail", f"Status {status_code}") if isinstance(body, dict) else f"Status {status_code}"
+            data[name] = None
+        else:
+            data[name] = body
+
+    # Unir reservas con talleres usando un índice por id (solo se envían los talleres reservados)
+    workshops_by_id = {workshop["id"]: workshop for workshop in data["workshops"] or []}
+    bookings = [
+        {**booking, "workshop": workshops_by_id.get(booking["workshop_id"])}
+        for booking in data["bookings"] or []
+    ]
+
+    payments = data["payments"]
+    return {
+        "user_email": email,
+        "bookings": bookings if data["bookings"] is not None else None,
+        "payments": payments.get("payments", []) if payments else ([] if "payments" not in errors else None),
+        "total_payments": payments.get("total_payments", 0) if payments else 0,
+        "stats": data["stats"],
+        "partial": bool(errors),
+        "errors": errors,
+        "timestamp": datetime.now().isoformat()
+    }
+
+# ================================
+# BATCH DE SUB-PETICIONES
+# ================================
+
+BATCH_PATH = "/api/v0/batch"
+BATCH_MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", "20"))
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "5"))
+BATCH_ITEM_TIMEOUT = float(os.getenv("BATCH_ITEM_TIMEOUT", "10"))
+# Batches en curso a la vez (cada uno ocupa hasta BATCH_CONCURRENCY lugares en los servicios)
+BATCH_BULKHEAD_LIMIT = int(os.getenv("BATCH_BULKHEAD_LIMIT", "8"))
+BATCH_METHODS = {"GET", "POST", "PUT", "PATCH", "DELETE"}
+# Headers del batch que se copian a cada sub-petición
+BATCH_FORWARD_HEADERS = ("authorization", "accept-language", "user-agent")
+
+def parse_batch_item(index: int, item) -> dict:
+    if not isinstance(item, dict):
+        raise HTTPException(status_code=400, detail=f"Elemento {index}: se esperaba un objeto")
+    method = str(item.get("method", "GET")).upper()
+    path = item.get("path")
+    if method not in BATCH_METHODS:
+        raise HTTPException(status_code=400, detail=f"Elemento {index}: método no soportado")
+    if not isinstance(path, str) or not path.startswith("/api/v0/"):
+        raise HTTPException(status_code=400, detail=f"Elemento {index}: 'path' debe empezar con /api/v0/")
+    route = path.partition("?")[0].rstrip("/")
+    if route == BATCH_PATH:
+        raise HTTPException(status_code=400, detail=f"Elemento {index}: no se permiten batches anidados")
+    if route in (EVENTS_STREAM_PATH, EVENTS_TICKET_PATH):
+        # Un stream SSE no termina (ocuparía un lugar del batch hasta el timeout) y su ticket
+        # solo sirve para abrirlo
+        raise HTTPException(status_code=400, detail=f"Elemento {index}: el canal de eventos no se puede usar en un batch")
+    return {"id": item.get("id"), "method": method, "path": path, "body": item.get("body")}
+
+batch_bulkhead = Bulkhead("batch", BATCH_BULKHEAD_LIMIT, BULKHEAD_QUEUE_SIZE, BULKHEAD_MAX_WAIT)
+
+def batch_costs(items: list[dict]) -> dict[str, float]:
+    """Tokens de rate limiting del batch: uno por sub-petición en la cuota de su clase."""
+    costs: dict[str, float] = {}
+    for item in items:
+        route = route_class(item["method"], item["path"].partition("?")[0])
+        costs[route] = costs.get(route, 0.0) + 1.0
+    for route, cost in costs.items():
+        if cost > rate_limiters[route].capacity:
+            # Nunca entraría en el bucket: esperar no serviría de nada
+            raise HTTPException(status_code=413, detail=f"Demasiadas sub-peticiones de tipo '{route}' en un batch")
+    return costs
+
+async def run_batch_item(internal: httpx.AsyncClient, semaphore: asyncio.Semaphore, index: int,
+                         item: dict, headers: dict) -> dict:
+    result = {"index": index}
+    if item["id"] is not None:
+        result["id"] = item["id"]
+
+    async with semaphore:
+        start_time = time.perf_counter()
+        try:
+            response = await asyncio.wait_for(
+                internal.request(
+                    item["method"],
+                    item["path"],
+                    headers={**headers, REQUEST_ID_HEADER: f"{headers[REQUEST_ID_HEADER]}-{index}"},
+                    json=item["body"]
+                ),
+                timeout=BATCH_ITEM_TIMEOUT
+            )
+        except asyncio.TimeoutError:
+            result.update(status=504, error="Timeout")
+            return result
+        except Exception as e:
+            logger.error("❌ Error en sub-petición %s %s del batch: %s", item["method"], item["path"], e)
+            result.update(status=502, error="Error interno del gateway")
+            return result
+        result["duration_ms"] = round((time.perf_counter() - start_time) * 1000, 2)
+
+    try:
+        body = response.json()
+    except ValueError:
+        body = response.text
+    result.update(status=response.status_code, body=body)
+    return result
+
+@app.post(BATCH_PATH)
+async def run_batch(request: Request):
+    """Ejecuta varias sub-peticiones en una sola ida y vuelta.
+
+    Cada sub-petición pasa por las rutas del propio gateway (autenticación, bulkheads,
+    coalescing), en paralelo hasta BATCH_CONCURRENCY y con BATCH_ITEM_TIMEOUT cada una.
+    El rate limiting se cobra entero al batch, un token por sub-petición, y el batch
+    ocupa un lugar de su propio bulkhead. No hay orden garantizado entre ellas: si una
+    depende de otra, van en batches separados.
+    """
+    try:
+        items = await request.json()
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Se esperaba un arreglo JSON de sub-peticiones")
+    if not isinstance(items, list) or not items:
+        raise HTTPException(status_code=400, detail="Se esperaba un arreglo JSON de sub-peticiones")
+    if len(items) > BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=413, detail=f"Máximo {BATCH_MAX_ITEMS} sub-peticiones por batch")
+    parsed = [parse_batch_item(index, item) for index, item in enumerate(items)]
+    identity = await authenticate_request(request)
+    enforce_rate_limit(request, identity, batch_costs(parsed))
+
+    headers = {name: request.headers[name] for name in BATCH_FORWARD_HEADERS if name in request.headers}
+    # Sin compresión: la respuesta se decodifica aquí mismo
+    headers["accept-encoding"] = "identity"
+    trace = current_trace.get()
+    headers[REQUEST_ID_HEADER] = trace.request_id if trace else uuid.uuid4().hex
+
+    # La IP del cliente se conserva para que el rate limiting lo cuente a él y no al gateway
+    client_address = (request.client.host, request.client.port) if request.client else ("127.0.0.1", 0)
+    transport = httpx.ASGITransport(app=app, client=client_address, raise_app_exceptions=False)
+    semaphore = asyncio.Semaphore(BATCH_CONCURRENCY)
+    if BULKHEAD_ENABLED:
+        try:
+            await batch_bulkhead.acquire(request_priority(request))
+        except BulkheadRejectedError as e:
+            raise bulkhead_exception(e)
+    # Las sub-peticiones corren en este contexto y lo heredan: no se vuelven a cobrar
+    prepaid_token = rate_limit_prepaid.set(True)
+    try:
+        async with httpx.AsyncClient(transport=transport, base_url="http://gateway") as internal:
+            results = await asyncio.gather(
+                *(run_batch_item(internal, semaphore, index, item, headers) for index, item in enumerate(parsed))
+            )
+    finally:
+        rate_limit_prepaid.reset(prepaid_token)
+        if BULKHEAD_ENABLED:
+            batch_bulkhead.release()
+
+    return {
+        "results": results,
+        "count": len(results),
+        "failed": sum(1 for result in results if result["status"] >= 400),
+        "timestamp": datetime.now().isoformat()
+    }
+
+# ================================
+# CANAL PUSH (SERVER-SENT EVENTS)
+# ================================
+
+# Los microservicios adjuntan sus eventos en este header; el gateway lo quita y los publica
+PUSH_EVENT_HEADER = "X-Push-Event"
+EVENTS_STREAM_PATH = "/api/v0/events/stream"
+EVENTS_TICKET_PATH = "/api/v0/events/ticket"
+SSE_MAX_CONNECTIONS = int(os.getenv("SSE_MAX_CONNECTIONS", "10000"))
+SSE_QUEUE_SIZE = int(os.getenv("SSE_QUEUE_SIZE", "64"))
+SSE_HEARTBEAT_INTERVAL = float(os.getenv("SSE_HEARTBEAT_INTERVAL", "15"))
+# Eventos recientes para reenviar a quien se reconecta con Last-Event-ID
+SSE_REPLAY_SIZE = int(os.getenv("SSE_REPLAY_SIZE", "512"))
+# EventSource no manda headers: el JWT se cambia por un ticket de un solo uso para la URL
+SSE_TICKET_TTL = float(os.getenv("SSE_TICKET_TTL", "30"))
+SSE_MAX_TICKETS = int(os.getenv("SSE_MAX_TICKETS", "10000"))
+
+SSE_HEARTBEAT = b": ping\n\n"
+
+class EventHub:
+    """Fan-out de eventos a conexiones SSE por tópico (user:<email>, workshop:<id>, workshops).
+
+    Cada evento se serializa una sola vez y se encola en la cola acotada de cada suscriptor;
+    una conexión que no consume se desconecta en vez de frenar a las demás.
+    """
+
+    def __init__(self):
+        self.topics: dict[str, set] = {}
+        self.subscribers: set = set()
+        self.replay: deque = deque(maxlen=SSE_REPLAY_SIZE)
+        self.next_id = 1
+        self.stats = {"published": 0, "delivered": 0, "dropped_subscribers": 0}
+
+    def subscribe(self, topics: list[str]) -> asyncio.Queue:
+        queue = asyncio.Queue(maxsize=SSE_QUEUE_SIZE)
+        queue.topics = topics
+        self.subscribers.add(queue)
+        for topic in topics:
+            self.topics.setdefault(topic, set()).add(queue)
+        return queue
+
+    def unsubscribe(self, queue: asyncio.Queue):
+        self.subscribers.discard(queue)
+        for topic in queue.topics:
+            subscribers = self.topics.get(topic)
+            if subscribers is not None:
+                subscribers.discard(queue)
+                if not subscribers:
+                    del self.topics[topic]
+
+    def deliver(self, queue: asyncio.Queue, message: bytes):
+        try:
+            queue.put_nowait(message)
+            self.stats["delivered"] += 1
+        except asyncio.QueueFull:
+            # Consumidor lento: se le avisa con None para que cierre y se reconecte
+            self.unsubscribe(queue)
+            self.stats["dropped_subscribers"] += 1
+            while not queue.empty():
+                queue.get_nowait()
+            queue.put_nowait(None)
+
+    def publish(self, event: dict):
+        topics = event_topics(event)
+        event_id = self.next_id
+        self.next_id += 1
+        message = (
+            f"id: {event_id}\nevent: {event['type']}\n"
+            f"data: {json.dumps(event, ensure_ascii=False, separators=(',', ':'))}\n\n"
+        ).encode()
+        self.replay.append((event_id, topics, message))
+        self.stats["published"] += 1
+        sse_events_published.inc(event["type"])
+
+        targets = set()
+        for topic in topics:
+            targets |= self.topics.get(topic, set())
+        for queue in targets:
+            self.deliver(queue, message)
+
+    def missed_since(self, last_event_id: int, topics: list[str]) -> list[bytes]:
+        wanted = set(topics)
+        return [message for event_id, event_topics_, message in self.replay
+                if event_id > last_event_id and wanted.intersection(event_topics_)]
+
+    def heartbeat(self):
+        for queue in list(self.subscribers):
+            if queue.empty():
+                self.deliver(queue, SSE_HEARTBEAT)
+
+    def snapshot(self) -> dict:
+        return {"connections": len(self.subscribers), "topics": len(self.topics), **self.stats}
+
+def event_topics(event: dict) -> list[str]:
+    topics = []
+    if event.get("user_email"):
+        topics.append(f"user:{str(event['user_email']).lower()}")
+    if event["type"] == "workshop.seats_changed" and event.get("workshop_id") is not None:
+        topics += [f"workshop:{event['workshop_id']}", "workshops"]
+    return topics
+
+event_hub = EventHub()
+
+def publish_push_events(response: Response, service: str):
+    """Publica los eventos adjuntos por el microservicio y quita el header de la respuesta."""
+    raw = response.headers.get(PUSH_EVENT_HEADER)
+    if raw is None:
+        return
+    del response.headers[PUSH_EVENT_HEADER]
+    try:
+        events = json.loads(raw)
+    except ValueError:
+        logger.warning("📡 Header %s inválido desde %s", PUSH_EVENT_HEADER, service)
+        return
+    for event in events if isinstance(events, list) else [events]:
+        if isinstance(event, dict) and event.get("type"):
+            event_hub.publish(event)
+
+async def sse_heartbeat():
+    while True:
+        await asyncio.sleep(SSE_HEARTBEAT_INTERVAL)
+        event_hub.heartbeat()
+
+sse_heartbeat_task: Optional[asyncio.Task] = None
+
+@app.on_event("startup")
+async def start_sse_heartbeat():
+    global sse_heartbeat_task
+    sse_heartbeat_task = asyncio.create_task(sse_heartbeat())
+
+class StreamTickets:
+    """Tickets opacos de un solo uso -> email, para abrir el canal SSE.
+
+    El ticket queda en los access logs (va en la URL), pero ya no sirve después del primer
+    uso o de SSE_TICKET_TTL. Viven en memoria: con varias réplicas del gateway hace falta
+    que el ticket y el stream lleguen a la misma.
+    """
+
+    def __init__(self, ttl: float, max_entries: int):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.tickets: "OrderedDict[str, tuple[str, float]]" = OrderedDict()
+
+    def issue(self, identity: str) -> str:
+        now = time.monotonic()
+        # Orden de emisión = orden de vencimiento: los vencidos están al principio
+        while self.tickets and next(iter(self.tickets.values()))[1] <= now:
+            self.tickets.popitem(last=False)
+        ticket = secrets.token_urlsafe(32)
+        self.tickets[ticket] = (identity, now + self.ttl)
+        if len(self.tickets) > self.max_entries:
+            self.tickets.popitem(last=False)
+        return ticket
+
+    def redeem(self, ticket: str) -> Optional[str]:
+        identity, expires_at = self.tickets.pop(ticket, (None, 0.0))
+        return identity if expires_at > time.monotonic() else None
+
+stream_tickets = StreamTickets(SSE_TICKET_TTL, SSE_MAX_TICKETS)
+
+@app.post(EVENTS_TICKET_PATH)
+async def issue_stream_ticket(request: Request):
+    """Ticket para ?ticket= del canal SSE; requiere el token en Authorization."""
+    identity = await authenticate_request(request)
+    enforce_rate_limit(request, identity)
+    if not identity:
+        raise HTTPException(status_code=401, detail="Se requiere token", headers={"WWW-Authenticate": "Bearer"})
+    return JSONResponse(
+        {"ticket": stream_tickets.issue(identity), "expires_in": int(SSE_TICKET_TTL)},
+        headers={"Cache-Control": "no-store"}
+    )
+
+async def stream_identity(request: Request) -> Optional[str]:
+    """Email del ticket de ?ticket= (EventSource) o del token en Authorization (otros clientes)."""
+    if request.headers.get("authorization"):
+        return await authenticate_request(request)
+    ticket = request.query_params.get("ticket")
+    if not ticket:
+        return None
+    identity = stream_tickets.redeem(ticket)
+    if identity is None:
+        raise HTTPException(status_code=401, detail="Ticket inválido o vencido")
+    return identity
+
+@app.get(EVENTS_STREAM_PATH)
+async def event_stream(request: Request, workshops: str = ""):
+    """Canal SSE con los eventos del usuario autenticado (reservas y pagos) y los cambios de
+    cupos de los talleres pedidos en ?workshops=1,2,3 (o ?workshops=* para todos)."""
+    identity = await stream_identity(request)
+    enforce_rate_limit(request, identity)
+    if len(event_hub.subscribers) >= SSE_MAX_CONNECTIONS:
+        raise HTTPException(status_code=503, detail="Demasiadas conexiones abiertas",
+                            headers={"Retry-After": str(int(SSE_HEARTBEAT_INTERVAL))})
+
+    topics = [f"user:{identity.lower()}"] if identity else []
+    for workshop_id in parse_routes(workshops):
+        topics.append("workshops" if workshop_id == "*" else f"workshop:{workshop_id}")
+    if not topics:
+        raise HTTPException(status_code=400, detail="Se requiere ticket o al menos un taller en ?workshops=")
+
+    # El cliente que reabre el canal con un ticket nuevo manda el último id en la query
+    last_event_id = request.headers.get("last-event-id") or request.query_params.get("last_event_id", "")
+    missed = event_hub.missed_since(int(last_event_id), topics) if last_event_id.isdigit() else []
+    queue = event_hub.subscribe(topics)
+
+    async def messages():
+        sse_connections.inc()
+        try:
+            # retry: espera sugerida al navegador antes de reconectarse
+            yield f"retry: {int(SSE_HEARTBEAT_INTERVAL * 1000)}\n\n".encode()
+            for message in missed:
+                yield message
+            while True:
+                message = await queue.get()
+                if message is None:
+                    return
+                yield message
+        finally:
+            event_hub.unsubscribe(queue)
+            sse_connections.dec()
+
+    return StreamingResponse(
+        messages(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+# ================================
+# IDEMPOTENCY-KEY EN ESCRITURAS
+# ================================
+
+# Un POST repetido con la misma Idempotency-Key devuelve la respuesta original en vez de
+# ejecutarse otra vez; los duplicados que llegan mientras la original corre la esperan
+IDEMPOTENCY_HEADER = "Idempotency-Key"
+IDEMPOTENCY_METHODS = {"POST", "PUT", "PATCH", "DELETE"}
+IDEMPOTENCY_TTL = float(os.getenv("IDEMPOTENCY_TTL", str(24 * 3600)))
+IDEMPOTENCY_MAX_ENTRIES = int(os.getenv("IDEMPOTENCY_MAX_ENTRIES", "10000"))
+IDEMPOTENCY_MAX_BYTES = int(os.getenv("IDEMPOTENCY_MAX_BYTES", str(16 * 1024 * 1024)))
+IDEMPOTENCY_MAX_KEY_LENGTH = 255
+# Headers de la respuesta original que no se repiten al reproducirla
+IDEMPOTENCY_SKIP_HEADERS = {"server-timing", "x-request-id", PUSH_EVENT_HEADER.lower()}
+
+class IdempotencyRecord:
+    __slots__ = ("fingerprint", "task", "result", "expires_at", "size")
+
+    def __init__(self, fingerprint: str, task: asyncio.Task):
+        self.fingerprint = fingerprint
+        self.task = task
+        self.result: Optional[UpstreamResult] = None
+        self.expires_at = float("inf")
+        self.size = 0
+
+class IdempotencyStore:
+    """Respuestas por (usuario o IP, clave): LRU acotado en entradas y bytes, con TTL.
+    Las peticiones en curso no se desalojan; solo ocupan memoria mientras duran."""
+
+    def __init__(self, max_entries: int, max_bytes: int):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.entries: "OrderedDict[tuple, IdempotencyRecord]" = OrderedDict()
+        self.bytes = 0
+        self.stats = {"executed": 0, "replayed": 0, "waited": 0, "mismatched": 0, "evictions": 0}
+
+    def get(self, key: tuple) -> Optional[IdempotencyRecord]:
+        record = self.entries.get(key)
+        if record is None:
+            return None
+        if record.expires_at <= time.monotonic():
+            self.discard(key)
+            return None
+        self.entries.move_to_end(key)
+        return record
+
+    def begin(self, key: tuple, fingerprint: str, task: asyncio.Task):
+        self.entries[key] = IdempotencyRecord(fingerprint, task)
+        self.stats["executed"] += 1
+
+    def complete(self, key: tuple, result: UpstreamResult):
+        record = self.entries.get(key)
+        if record is None:
+            return
+        record.result = result
+        record.expires_at = time.monotonic() + IDEMPOTENCY_TTL
+        record.size = len(result.body) + sum(len(name) + len(value) for name, value in result.headers)
+        self.bytes += record.size
+        self.evict()
+
+    def evict(self):
+        for key in list(self.entries):
+            if len(self.entries) <= self.max_entries and self.bytes <= self.max_bytes:
+                return
+            if self.entries[key].result is not None:
+                self.discard(key)
+                self.stats["evictions"] += 1
+
+    def discard(self, key: tuple):
+        record = self.entries.pop(key, None)
+        if record is not None:
+            self.bytes -= record.size
+
+    def snapshot(self) -> dict:
+        return {"entries": len(self.entries), "bytes": self.bytes, "ttl": IDEMPOTENCY_TTL, **self.stats}
+
+idempotency_store = IdempotencyStore(IDEMPOTENCY_MAX_ENTRIES, IDEMPOTENCY_MAX_BYTES)
+
+def replayable_result(result: UpstreamResult) -> UpstreamResult:
+    # Sin eventos push ni headers de traza: solo la petición original los publica
+    headers = [(name, value) for name, value in result.headers if name.lower() not in IDEMPOTENCY_SKIP_HEADERS]
+    return UpstreamResult(result.status_code, headers, result.body)
+
+def finish_idempotent(key: tuple, task: asyncio.Task):
+    # Errores de red y 5xx no se guardan: un reintento con la misma clave vuelve a ejecutarse
+    if task.cancelled() or task.exception() is not None or task.result().status_code >= 500:
+        idempotency_store.discard(key)
+        return
+    idempotency_store.complete(key, replayable_result(task.result()))
+
+def idempotent_response(result: UpstreamResult, replayed: bool) -> Response:
+    response = Response(content=result.body, status_code=result.status_code)
+    response.raw_headers = encode_response_headers(
+        list(result.headers) + [("Idempotent-Replayed", "true" if replayed else "false")])
+    return response
+
+async def proxy_idempotent(request: Request, service: str, idempotency_key: str, strip_prefix: str,
+                           add_prefix: str = "", identity: Optional[str] = None, priority: str = "normal"):
+    if len(idempotency_key) > IDEMPOTENCY_MAX_KEY_LENGTH:
+        raise HTTPException(status_code=400, detail=f"{IDEMPOTENCY_HEADER} demasiado larga")
+
+    path = build_upstream_path(request, strip_prefix, add_prefix)
+    body = await request.body()
+    digest = hashlib.blake2b(f"{request.method} {path}?{request.url.query}\n".encode(), digest_size=16)
+    digest.update(body)
+    fingerprint = digest.hexdigest()
+    client_ip = request.client.host if request.client else "unknown"
+    key = (identity or f"ip:{client_ip}", idempotency_key)
+
+    record = idempotency_store.get(key)
+    if record is not None:
+        if record.fingerprint != fingerprint:
+            idempotency_store.stats["mismatched"] += 1
+            idempotency_requests.inc(service, "mismatch")
+            raise HTTPException(status_code=422,
+                                detail=f"{IDEMPOTENCY_HEADER} ya usada con una petición distinta")
+        result = record.result
+        if result is None:
+            idempotency_store.stats["waited"] += 1
+            try:
+                result = replayable_result(await asyncio.shield(record.task))
+            except Exception as e:
+                raise upstream_http_exception(e, service)
+            if result.status_code >= 500:
+                # El 5xx no queda guardado: se entrega como fallo propio, no como reproducción
+                return idempotent_response(result, replayed=False)
+        idempotency_store.stats["replayed"] += 1
+        idempotency_requests.inc(service, "replayed")
+        logger.info("♻️ Respuesta reproducida para %s %s", request.method, request.url.path)
+        return idempotent_response(result, replayed=True)
+
+    headers = [(name, value) for name, value in build_upstream_headers(request, identity)
+               if name.lower() not in ("content-length", "idempotency-key")]
+    # La escritura corre en su propia task: si el cliente se desconecta igual queda guardada
+    task = asyncio.ensure_future(
+        fetch_upstream_result(service, path, request.method, headers, request.url.query, priority, content=body)
+    )
+    idempotency_store.begin(key, fingerprint, task)
+    idempotency_requests.inc(service, "executed")
+    task.add_done_callback(lambda done: finish_idempotent(key, done))
+    task.add_done_callback(discard_task_exception)
+    try:
+        result = await asyncio.shield(task)
+    except Exception as e:
+        raise upstream_http_exception(e, service)
+    return idempotent_response(result, replayed=False)
 
 # ================================
 # RUTAS PROPIAS DEL GATEWAY
@@ -220,6 +2683,26 @@ async def hello_world():
         "version": "2.1",
         "timestamp": datetime.now().isoformat(),
         "features": [
+            "Streaming proxy mode",
+            "Gateway-side JWT verification",
+            "Per-upstream circuit breakers with retry budgets",
+            "Multi-instance upstream pools (least outstanding requests)",
+            "Aggregated dashboard endpoint",
+            "Request coalescing for identical GETs",
+            "Token-bucket rate limiting per IP and user",
+            "Background health prober with cached status",
+            "Structured JSON logging through a background queue",
+            "gzip/brotli compression and ETag/304 responses",
+            "Dedicated connection pools per upstream (HTTP/2 over https, Unix sockets)",
+            "Prometheus metrics at /metrics",
+            "X-Request-ID propagation with merged Server-Timing",
+            "Per-upstream bulkheads with priority admission and load shedding",
+            "Batch endpoint (POST /api/v0/batch) with concurrent sub-requests",
+            "Opt-in hedged requests for idempotent reads (HEDGE_ENABLED)",
+            "Single-process composite mode mounting all services (COMPOSITE_MODE)",
+            "GET response cache with per-route TTL and stale-while-revalidate",
+            "Server-sent events push channel (POST /api/v0/events/ticket, then GET /api/v0/events/stream?ticket=)",
+            "Idempotency-Key replay for write requests",
             "Enhanced logging", 
             "Booking cancellation with hiding", 
             "Booking restoration",
@@ -234,36 +2717,25 @@ async def debug_services():
     logger.info("🔍 Debug services endpoint called")
     results = {}
     
-    services = {
-        "auth": f"{AUTH_URL}/health",
-        "booking": f"{BOOKING_URL}/health", 
-        "payment": f"{PAYMENT_URL}/health",
-        "workshops": f"{WORKSHOPS_URL}/health"
-    }
-    
-    for name, url in services.items():
-        try:
-            logger.info(f"🏥 Checking health of {name} at {url}")
-            response = await client.get(url, timeout=5.0)
-            results[name] = {
-                "status": "OK",
-                "url": url,
-                "response_code": response.status_code,
-                "response": response.json() if response.status_code == 200 else response.text
-            }
-            logger.info(f"✅ {name} service is healthy")
-        except Exception as e:
-            logger.error(f"❌ {name} service error: {str(e)}")
-            results[name] = {
-                "status": "ERROR", 
-                "url": url,
-                "error": str(e)
+    # Estado cacheado por el health prober (sin llamar a los servicios en esta petición)
+    for service, pool in pools.items():
+        for instance in pool.instances:
+            health = instance.health
+            results[instance_label(service, instance)] = {
+                "status": "OK" if health.status in ("up", "degraded") else "ERROR",
+                "health": health.status,
+                "url": f"{instance.url}/health",
+                "response_code": health.response_code,
+                "response": health.response,
+                "error": health.error,
+                "last_checked": health.last_checked,
+                "latency_ms": health.percentiles()
             }
     
     # Test especial para booking service - verificar nuevas funcionalidades
     booking_features = {}
     try:
-        debug_response = await client.get(f"{BOOKING_URL}/debug", timeout=5.0)
+        debug_response = await primary_instance("booking").client.get(f"{primary_url('booking')}/debug", timeout=5.0)
         if debug_response.status_code == 200:
             booking_debug = debug_response.json()
             booking_features = {
@@ -281,11 +2753,23 @@ async def debug_services():
         "timestamp": datetime.now().isoformat(),
         "services": results,
         "booking_features": booking_features,
+        "upstream_pools": {name: pool.snapshot() for name, pool in pools.items()},
+        "coalescing": {"routes": COALESCE_ROUTES, "stats": coalescing_stats},
+        "response_cache": response_cache.snapshot(),
+        "push_channel": event_hub.snapshot(),
+        "idempotency": idempotency_store.snapshot(),
+        "rate_limits": {name: limiter.snapshot() for name, limiter in rate_limiters.items()},
+        "batch_bulkhead": batch_bulkhead.snapshot(),
+        "conditional_responses": conditional_stats,
         "environment": {
             "AUTH_URL": AUTH_URL,
             "BOOKING_URL": BOOKING_URL, 
             "PAYMENT_URL": PAYMENT_URL,
-            "WORKSHOPS_URL": WORKSHOPS_URL
+            "WORKSHOPS_URL": WORKSHOPS_URL,
+            "PROXY_MODE": PROXY_MODE,
+            "COMPOSITE_MODE": COMPOSITE_MODE,
+            "LOG_LEVEL": LOG_LEVEL,
+            "IDENTITY_HEADER": IDENTITY_HEADER
         },
         "version": "2.1 - Complete with booking cancellation/restoration support",
         "proxy_configuration": {
@@ -297,20 +2781,38 @@ async def debug_services():
     }
     
     healthy_services = len([s for s in results.values() if s['status'] == 'OK'])
-    logger.info(f"🔍 Debug results: {healthy_services}/{len(results)} services healthy")
+    logger.info("🔍 Debug results: %s/%s services healthy", healthy_services, len(results))
     
     return debug_info
 
 # Health check del gateway
+CIRCUIT_STATE_VALUES = {"closed": 0, "half_open": 1, "open": 2}
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    # Los gauges de los pools se toman del estado actual en el momento del scrape
+    for name, pool in pools.items():
+        for instance in pool.instances:
+            upstream_in_flight.set(instance.in_flight, name, instance.url)
+            upstream_connections_opened.set(instance.connections_opened, name, instance.url)
+            upstream_circuit_state.set(CIRCUIT_STATE_VALUES.get(instance.breaker.state, 0), name, instance.url)
+        bulkhead_active.set(pool.bulkhead.active, name)
+    bulkhead_active.set(batch_bulkhead.active, "batch")
+    return metrics_response(metrics_registry)
+
 @app.get("/health")
 async def gateway_health():
-    logger.info("🏥 Gateway health check")
+    logger.debug("🏥 Gateway health check")
     return {
         "status": "API Gateway OK", 
         "port": 5004, 
         "timestamp": datetime.now().isoformat(),
         "uptime": "Available",
-        "version": "2.1"
+        "version": "2.1",
+        "upstreams": {
+            instance_label(service, instance): instance.health.status
+            for service, pool in pools.items() for instance in pool.instances
+        }
     }
 
 # Nuevo endpoint para probar específicamente las rutas de booking
@@ -320,27 +2822,29 @@ async def test_booking_routes():
     logger.info("🧪 Testing booking routes")
     
     tests = []
+    booking_url = primary_url("booking")
+    booking_client = primary_instance("booking").client
     
     # Test 1: Health check del booking service
     try:
-        response = await client.get(f"{BOOKING_URL}/health", timeout=3.0)
+        response = await booking_client.get(f"{booking_url}/health", timeout=3.0)
         tests.append({
             "test": "Booking service health",
             "status": "OK" if response.status_code == 200 else "ERROR",
             "response_code": response.status_code,
-            "url": f"{BOOKING_URL}/health"
+            "url": f"{booking_url}/health"
         })
     except Exception as e:
         tests.append({
             "test": "Booking service health",
             "status": "ERROR",
             "error": str(e),
-            "url": f"{BOOKING_URL}/health"
+            "url": f"{booking_url}/health"
         })
     
     # Test 2: Debug del booking service para verificar rutas
     try:
-        response = await client.get(f"{BOOKING_URL}/debug", timeout=3.0)
+        response = await booking_client.get(f"{booking_url}/debug", timeout=3.0)
         if response.status_code == 200:
             debug_data = response.json()
             has_cancel = any("/cancelar/" in route for route in debug_data.get("routes", []))
@@ -376,7 +2880,7 @@ async def test_booking_routes():
     
     for path in test_paths:
         stripped = path.removeprefix("/api/v0/booking")
-        target_url = f"{BOOKING_URL}{stripped}"
+        target_url = f"{booking_url}{stripped}"
         tests.append({
             "test": f"Path construction for {path}",
             "input_path": path,
@@ -388,7 +2892,7 @@ async def test_booking_routes():
     return {
         "test_summary": "Booking routes connectivity test",
         "timestamp": datetime.now().isoformat(),
-        "booking_service_url": BOOKING_URL,
+        "booking_service_url": booking_url,
         "tests": tests,
         "recommendations": [
             "Ensure booking-service is running on the correct port",
@@ -406,30 +2910,20 @@ async def test_connectivity():
     logger.info("🔌 Testing basic connectivity")
     
     tests = []
-    services = {
-        "auth": AUTH_URL,
-        "booking": BOOKING_URL,
-        "payment": PAYMENT_URL, 
-        "workshops": WORKSHOPS_URL
-    }
-    
-    for name, base_url in services.items():
-        try:
-            response = await client.get(f"{base_url}/health", timeout=3.0)
-            tests.append({
-                "service": name,
-                "status": "OK" if response.status_code == 200 else "ERROR",
-                "url": base_url,
-                "response_code": response.status_code,
-                "response_time": "< 3s"
-            })
-        except Exception as e:
-            tests.append({
-                "service": name,
-                "status": "ERROR",
-                "url": base_url,
-                "error": str(e)
-            })
+    for service, pool in pools.items():
+        for instance in pool.instances:
+            health = instance.health
+            test = {
+                "service": instance_label(service, instance),
+                "status": "OK" if health.status in ("up", "degraded") else "ERROR",
+                "url": instance.url,
+                "response_code": health.response_code,
+                "latency_ms": health.percentiles(),
+                "last_checked": health.last_checked
+            }
+            if health.error:
+                test["error"] = health.error
+            tests.append(test)
     
     all_healthy = all(test["status"] == "OK" for test in tests)
     
@@ -467,8 +2961,74 @@ async def get_cancellation_info():
         }
     }
 
+# ================================
+# ADMINISTRACIÓN DE POOLS DE UPSTREAMS
+# ================================
+
+# Token para endpoints administrativos; si no está configurado quedan deshabilitados
+GATEWAY_ADMIN_TOKEN = os.getenv("GATEWAY_ADMIN_TOKEN", "")
+
+def require_admin(request: Request):
+    token = request.headers.get("x-admin-token")
+    if not GATEWAY_ADMIN_TOKEN or token != GATEWAY_ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Operación administrativa no autorizada")
+
+@app.get("/api/v0/gateway/upstreams")
+async def get_upstreams():
+    """Estado de las instancias de cada servicio: peso, peticiones en curso y circuito"""
+    return {
+        "pools": {name: pool.snapshot() for name, pool in pools.items()},
+        "timestamp": datetime.now().isoformat()
+    }
+
+@app.put("/api/v0/gateway/upstreams/{service}")
+async def set_upstream_weight(service: str, request: Request):
+    """Cambia el peso de una instancia. Con peso 0 se drena: no recibe peticiones nuevas
+    y las que están en curso terminan normalmente."""
+    require_admin(request)
+    if service not in pools:
+        raise HTTPException(status_code=404, detail="Servicio no encontrado")
+
+    try:
+        data = await request.json()
+        url = str(data["url"])
+        weight = float(data["weight"])
+    except Exception:
+        raise HTTPException(status_code=400, detail="Se requiere 'url' y 'weight' numérico")
+    if weight < 0:
+        raise HTTPException(status_code=400, detail="El peso no puede ser negativo")
+
+    instance = pools[service].get_instance(url)
+    if instance is None:
+        raise HTTPException(status_code=404, detail="Instancia no encontrada")
+
+    instance.weight = weight
+    logger.info("⚖️ Peso de %s@%s actualizado a %s", service, instance.url, weight)
+    return instance.snapshot()
+
+@app.get("/api/v0/gateway/cache")
+async def get_cache_status(request: Request):
+    require_admin(request)
+    return {"cache": response_cache.snapshot(), "timestamp": datetime.now().isoformat()}
+
+@app.delete("/api/v0/gateway/cache")
+async def purge_cache(request: Request, prefix: str = ""):
+    """Borra las copias cacheadas cuyo path empieza con prefix (todas si no se indica)."""
+    require_admin(request)
+    purged = response_cache.purge(prefix)
+    logger.info("🧹 Cache purgada (prefijo '%s'): %s entradas", prefix, purged)
+    return {"purged": purged, "prefix": prefix}
+
 # Cerrar cliente al apagar la aplicación
 @app.on_event("shutdown")
 async def shutdown_event():
+    if health_prober_task:
+        health_prober_task.cancel()
+    if sse_heartbeat_task:
+        sse_heartbeat_task.cancel()
     await client.aclose()
+    for pool in pools.values():
+        for instance in pool.instances:
+            await instance.client.aclose()
+            await instance.probe_client.aclose()
     logger.info("🔌 HTTP client closed")
\ No newline at end of file
@@ -0,0 +1,19 @@
+# API_GATEWAY/tests/conftest.py - CARGA DEL GATEWAY PARA LOS TESTS
+#
+# Correr desde API_GATEWAY con las dependencias de requirements.txt más pytest:
+#     python -m pytest tests
+# El main se importa una sola vez como "gateway_main" (también agrega backend/ al sys.path).
+
+import importlib.util
+import os
+import sys
+
+GATEWAY_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+os.environ.setdefault("CACHE_ENABLED", "false")
+os.environ.setdefault("TRACE_FILE", os.path.join(os.getenv("TMPDIR", "/tmp"), "gateway-test-traces.jsonl"))
+
+spec = importlib.util.spec_from_file_location("gateway_main", os.path.join(GATEWAY_DIR, "main.py"))
+gateway_main = importlib.util.module_from_spec(spec)
+sys.modules["gateway_main"] = gateway_main
+spec.loader.exec_module(gateway_main)
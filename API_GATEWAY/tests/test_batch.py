@@ -0,0 +1,61 @@
+# API_GATEWAY/tests/test_batch.py - EL BATCH PAGA RATE LIMITING POR SUB-PETICIÓN
+
+import httpx
+import pytest
+from fastapi import FastAPI, Request
+from fastapi.testclient import TestClient
+
+import gateway_main as gateway
+
+@pytest.fixture
+def setup(monkeypatch):
+    calls: list = []
+    upstream = FastAPI()
+
+    @upstream.get("/{path:path}")
+    async def echo(path: str, request: Request):
+        calls.append(path)
+        return {"path": path}
+
+    for pool in gateway.pools.values():
+        for instance in pool.instances:
+            monkeypatch.setattr(instance, "client", httpx.AsyncClient(transport=httpx.ASGITransport(app=upstream)))
+    monkeypatch.setattr(gateway, "RATE_LIMIT_ENABLED", True)
+    monkeypatch.setitem(gateway.rate_limiters, "read", gateway.TokenBucketLimiter(3, 60, 100))
+    monkeypatch.setitem(gateway.rate_limiters, "write", gateway.TokenBucketLimiter(10, 60, 100))
+    # Sin "with": no corren los eventos de startup (health prober, sync de revocaciones)
+    return TestClient(gateway.app), calls
+
+def reads(count: int) -> list[dict]:
+    return [{"method": "GET", "path": f"/api/v0/workshops/item-{index}"} for index in range(count)]
+
+def test_batch_is_charged_per_item(setup):
+    client, calls = setup
+    response = client.post(gateway.BATCH_PATH, json=reads(3))
+    assert response.status_code == 200
+    assert [result["status"] for result in response.json()["results"]] == [200, 200, 200]
+    # Las sub-peticiones no se cobran de nuevo, pero la cuota de lectura ya se agotó
+    assert gateway.rate_limiters["read"].snapshot()["rejected"] == 0
+    assert client.get("/api/v0/workshops/otra").status_code == 429
+    # El POST del batch no consume la cuota de escritura
+    assert gateway.rate_limiters["write"].buckets == {}
+
+def test_batch_over_quota_is_rejected(setup):
+    client, calls = setup
+    assert client.post(gateway.BATCH_PATH, json=reads(2)).status_code == 200
+    response = client.post(gateway.BATCH_PATH, json=reads(2))
+    assert response.status_code == 429
+    assert "retry-after" in response.headers
+    assert len(calls) == 2
+
+def test_batch_larger_than_bucket_is_rejected(setup):
+    client, calls = setup
+    assert client.post(gateway.BATCH_PATH, json=reads(4)).status_code == 413
+    assert calls == []
+
+def test_batch_bulkhead_full(setup, monkeypatch):
+    client, calls = setup
+    monkeypatch.setattr(gateway, "batch_bulkhead", gateway.Bulkhead("batch", 1, 0, 0.01))
+    gateway.batch_bulkhead.active = 1
+    assert client.post(gateway.BATCH_PATH, json=reads(1)).status_code == 503
+    assert calls == []
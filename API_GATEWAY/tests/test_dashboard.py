@@ -0,0 +1,29 @@
+# API_GATEWAY/tests/test_dashboard.py - EL DASHBOARD SOLO LO VE SU DUEÑO
+
+import time
+import uuid
+
+import pytest
+from fastapi.testclient import TestClient
+from jose import jwt
+
+import gateway_main as gateway
+
+def make_token(email: str) -> str:
+    claims = {"sub": email, "jti": uuid.uuid4().hex, "type": "access", "exp": int(time.time()) + 600}
+    return jwt.encode(claims, gateway.JWT_SECRET_KEY, algorithm=gateway.JWT_ALGORITHM)
+
+@pytest.fixture
+def client():
+    # Sin "with": no corren los eventos de startup (health prober, sync de revocaciones)
+    return TestClient(gateway.app)
+
+def test_dashboard_requires_token(client):
+    response = client.get("/api/v0/dashboard/ana@example.com")
+    assert response.status_code == 401
+    assert response.headers["www-authenticate"] == "Bearer"
+
+def test_dashboard_rejects_other_user(client):
+    headers = {"Authorization": f"Bearer {make_token('beto@example.com')}"}
+    response = client.get("/api/v0/dashboard/ana@example.com", headers=headers)
+    assert response.status_code == 403
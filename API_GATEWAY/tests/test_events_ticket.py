@@ -0,0 +1,46 @@
+# API_GATEWAY/tests/test_events_ticket.py - EL CANAL SSE SE ABRE CON TICKET, NO CON EL JWT
+
+import time
+import uuid
+
+import pytest
+from fastapi.testclient import TestClient
+from jose import jwt
+
+import gateway_main as gateway
+
+def make_token(email: str) -> str:
+    claims = {"sub": email, "jti": uuid.uuid4().hex, "type": "access", "exp": int(time.time()) + 600}
+    return jwt.encode(claims, gateway.JWT_SECRET_KEY, algorithm=gateway.JWT_ALGORITHM)
+
+@pytest.fixture
+def client():
+    # Sin "with": no corren los eventos de startup (health prober, sync de revocaciones)
+    return TestClient(gateway.app)
+
+def test_ticket_requires_token(client):
+    assert client.post(gateway.EVENTS_TICKET_PATH).status_code == 401
+
+def test_ticket_is_single_use(client):
+    response = client.post(gateway.EVENTS_TICKET_PATH, headers={"Authorization": f"Bearer {make_token('ana@example.com')}"})
+    assert response.status_code == 200
+    assert response.headers["cache-control"] == "no-store"
+    ticket = response.json()["ticket"]
+
+    assert gateway.stream_tickets.redeem(ticket) == "ana@example.com"
+    assert gateway.stream_tickets.redeem(ticket) is None
+
+def test_expired_ticket_is_rejected():
+    tickets = gateway.StreamTickets(ttl=0.01, max_entries=10)
+    ticket = tickets.issue("ana@example.com")
+    time.sleep(0.02)
+    assert tickets.redeem(ticket) is None
+
+def test_stream_rejects_unknown_ticket(client):
+    response = client.get(gateway.EVENTS_STREAM_PATH, params={"ticket": "no-existe"})
+    assert response.status_code == 401
+
+def test_stream_ignores_jwt_in_query(client):
+    # ?token= ya no identifica al usuario: sin ticket ni talleres no hay tópicos
+    response = client.get(gateway.EVENTS_STREAM_PATH, params={"token": make_token("ana@example.com")})
+    assert response.status_code == 400
@@ -0,0 +1,147 @@
+# API_GATEWAY/tests/test_revocation.py - UN TOKEN REVOCADO NO PASA POR EL GATEWAY
+#
+# Los microservicios se reemplazan por una app ASGI y la tabla revoked_tokens por una lista.
+
+import time
+import uuid
+
+import httpx
+import pytest
+from fastapi import FastAPI, Request
+from fastapi.testclient import TestClient
+from jose import jwt
+
+import gateway_main as gateway
+from common.revocation import BloomFilter
+
+class FakeRevokedTokens:
+    """Tabla revoked_tokens en memoria con las tres sentencias que usa RevocationList."""
+
+    def __init__(self):
+        self.rows: list[tuple[int, str]] = []
+
+    def insert(self, jti: str) -> bool:
+        if any(row_jti == jti for _, row_jti in self.rows):
+            return False
+        self.rows.append((len(self.rows) + 1, jti))
+        return True
+
+    def connect(self):
+        return FakeConnection(self)
+
+class FakeConnection:
+    def __init__(self, table: FakeRevokedTokens):
+        self.table = table
+
+    def cursor(self):
+        return FakeCursor(self.table)
+
+    def commit(self):
+        pass
+
+    def close(self):
+        pass
+
+class FakeCursor:
+    def __init__(self, table: FakeRevokedTokens):
+        self.table = table
+        self.result: list = []
+        self.rowcount = 0
+
+    def execute(self, operation: str, params: tuple = ()):
+        if operation.startswith("SELECT id, jti"):
+            self.result = [row for row in self.table.rows if row[0] > params[0]]
+        elif operation.startswith("SELECT 1"):
+            self.result = [(1,)] if any(jti == params[0] for _, jti in self.table.rows) else []
+        elif operation.startswith("INSERT IGNORE"):
+            self.rowcount = 1 if self.table.insert(params[0]) else 0
+        else:
+            raise AssertionError(f"Sentencia inesperada: {operation}")
+
+    def fetchall(self):
+        return self.result
+
+    def fetchone(self):
+        return self.result[0] if self.result else None
+
+    def close(self):
+        pass
+
+def make_token(email: str) -> tuple[str, str]:
+    jti = uuid.uuid4().hex
+    claims = {"sub": email, "jti": jti, "type": "access", "exp": int(time.time()) + 600}
+    return jwt.encode(claims, gateway.JWT_SECRET_KEY, algorithm=gateway.JWT_ALGORITHM), jti
+
+def make_upstream(table: FakeRevokedTokens, calls: list) -> FastAPI:
+    """auth-service mínimo (logout revoca el token) y eco para el resto de los servicios."""
+    upstream = FastAPI()
+
+    @upstream.post("/logout")
+    async def logout(request: Request):
+        token = request.headers["authorization"].partition(" ")[2]
+        claims = jwt.decode(token, gateway.JWT_SECRET_KEY, algorithms=[gateway.JWT_ALGORITHM])
+        table.insert(claims["jti"])
+        return {"message": "Logout exitoso"}
+
+    @upstream.get("/{path:path}")
+    async def echo(path: str, request: Request):
+        calls.append(path)
+        return {"path": path, "identity": request.headers.get(gateway.IDENTITY_HEADER)}
+
+    return upstream
+
+@pytest.fixture
+def setup(monkeypatch):
+    table = FakeRevokedTokens()
+    calls: list = []
+    upstream = make_upstream(table, calls)
+    monkeypatch.setattr(gateway.revocation_list, "connect", table.connect)
+    monkeypatch.setattr(gateway.revocation_list, "filter", BloomFilter(1000, 0.001))
+    monkeypatch.setattr(gateway.revocation_list, "confirmed", set())
+    monkeypatch.setattr(gateway.revocation_list, "last_id", 0)
+    gateway.verified_tokens.clear()
+    for pool in gateway.pools.values():
+        for instance in pool.instances:
+            monkeypatch.setattr(instance, "client", httpx.AsyncClient(transport=httpx.ASGITransport(app=upstream)))
+    # Sin "with": no corren los eventos de startup (health prober, sync de revocaciones)
+    return TestClient(gateway.app), table, calls
+
+def test_logout_revokes_token_at_gateway(setup):
+    client, table, calls = setup
+    token, _ = make_token("ana@example.com")
+    headers = {"Authorization": f"Bearer {token}"}
+
+    response = client.get("/api/v0/booking/bookings/user/ana@example.com", headers=headers)
+    assert response.status_code == 200
+    assert response.json()["identity"] == "ana@example.com"
+
+    response = client.post("/api/v0/auth/logout", headers=headers, json={})
+    assert response.status_code == 200
+
+    calls.clear()
+    for path in ("/api/v0/booking/bookings/user/ana@example.com", "/api/v0/payment/payments/history",
+                 "/api/v0/auth/profile", "/api/v0/dashboard/ana@example.com"):
+        response = client.get(path, headers=headers)
+        assert response.status_code == 401, path
+    # Rechazado en el gateway: ningún microservicio recibió la petición
+    assert calls == []
+
+def test_revocation_from_another_replica_after_sync(setup):
+    client, table, calls = setup
+    token, jti = make_token("beto@example.com")
+    headers = {"Authorization": f"Bearer {token}"}
+
+    assert client.get("/api/v0/workshops/workshops", headers=headers).status_code == 200
+
+    # Logout atendido por otro gateway: este se entera en el próximo sync de la tabla
+    table.insert(jti)
+    gateway.revocation_list.load()
+    assert client.get("/api/v0/workshops/workshops", headers=headers).status_code == 401
+
+def test_valid_token_is_not_rejected(setup):
+    client, table, calls = setup
+    table.insert(uuid.uuid4().hex)
+    gateway.revocation_list.load()
+    token, _ = make_token("carla@example.com")
+    response = client.get("/api/v0/workshops/workshops", headers={"Authorization": f"Bearer {token}"})
+    assert response.status_code == 200
@@ -0,0 +1,34 @@
+# API_GATEWAY/tests/test_upstream_pools.py - POOLS DE CONEXIONES POR INSTANCIA
+
+import asyncio
+
+from fastapi import FastAPI
+
+import gateway_main as gateway
+
+def test_http2_only_for_https(monkeypatch):
+    monkeypatch.setenv("BOOKING_POOL_HTTP2", "true")
+    monkeypatch.setattr(gateway, "h2_available", lambda: True)
+    assert gateway.UpstreamInstance("booking", "http://booking-service:8000").http2 is False
+    assert gateway.UpstreamInstance("booking", "http://booking", uds="/tmp/booking.sock").http2 is False
+    assert gateway.UpstreamInstance("booking", "https://booking.internal").http2 is True
+
+def test_prober_uses_its_own_client():
+    upstream = FastAPI()
+
+    @upstream.get("/health")
+    async def health():
+        return {"status": "ok"}
+
+    instance = gateway.UpstreamInstance("booking", "http://booking-service", app=upstream)
+    assert instance.probe_client is not instance.client
+
+    async def probe():
+        async def fail(*args, **kwargs):
+            raise AssertionError("el prober no debe usar el cliente de tráfico")
+        instance.client.get = fail
+        await gateway.probe_instance(instance)
+
+    asyncio.run(probe())
+    assert instance.health.checks_total == 1
+    assert instance.health.error is None
@@ -1,18 +1,49 @@
-from fastapi import FastAPI, HTTPException, Depends, status
+from fastapi import FastAPI, HTTPException, Depends, Request, BackgroundTasks, status
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
-from pydantic import BaseModel, EmailStr, Field, validator
+from starlette.concurrency import run_in_threadpool
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from pydantic import BaseModel, EmailStr, Field, ValidationError, validator
 import mysql.connector
+import asyncio
+import csv
+import io
+import json
+import math
+import multiprocessing
+import sys
+import threading
 import bcrypt
+import os
 import time
+import uuid
 from jose import JWTError, jwt
+from collections import OrderedDict
+from typing import Optional
 from datetime import datetime, timedelta
 
-SECRET_KEY = "mysecretkey"
+SECRET_KEY = os.getenv("JWT_SECRET_KEY", "mysecretkey")
 ALGORITHM = "HS256"
-ACCESS_TOKEN_EXPIRE_MINUTES = 30
+ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", "30"))
 
-app = FastAPI(title="Auth Service", version="2.0")
+# El módulo compartido vive en backend/common (en Docker se copia a /app/common)
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.observability import (
+    MetricsRegistry, MySQLDatabase, TimedJSONResponse, instrument_service, record_span, setup_logging
+)
+from common.revocation import RevocationList
+
+# ================================
+# LOGGING, MÉTRICAS Y TRAZAS
+# ================================
+
+SERVICE_NAME = "auth-service"
+logger = setup_logging(SERVICE_NAME)
+metrics_registry = MetricsRegistry()
+
+app = FastAPI(title="Auth Service", version="2.0", default_response_class=TimedJSONResponse)
 
 app.add_middleware(
     CORSMiddleware,
@@ -22,6 +53,8 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+instrument_service(app, metrics_registry)
+
 class RegisterData(BaseModel):
     name: str = Field(..., min_length=2, max_length=100)
     email: EmailStr
@@ -36,6 +69,14 @@ class RegisterData(BaseModel):
 class Token(BaseModel):
     access_token: str
     token_type: str
+    refresh_token: Optional[str] = None
+    expires_in: Optional[int] = None
+
+class RefreshRequest(BaseModel):
+    refresh_token: str
+
+class LogoutRequest(BaseModel):
+    refresh_token: Optional[str] = None
 
 class UserOut(BaseModel):
     id: int
@@ -44,20 +85,10 @@ class UserOut(BaseModel):
 
 # ✅ CORREGIDO: tokenUrl ahora coincide con la ruta proxy
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/login")
+optional_oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/login", auto_error=False)
 
-def get_connection():
-    for attempt in range(20):
-        try:
-            return mysql.connector.connect(
-                host="db",
-                user="root",
-                password="12345",
-                database="users_db"
-            )
-        except mysql.connector.Error as e:
-            print(f"[auth-service] Intento {attempt+1} fallido: {e}, esperando...")
-            time.sleep(3)
-    raise Exception("No se pudo conectar a la base de datos.")
+database = MySQLDatabase(metrics_registry, "users_db")
+get_connection = database.connect
 
 @app.on_event("startup")
 def create_table():
@@ -71,91 +102,484 @@ def create_table():
             password VARCHAR(255)
         )
     """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS revoked_tokens (
+            id BIGINT AUTO_INCREMENT PRIMARY KEY,
+            jti CHAR(32) NOT NULL UNIQUE,
+            expires_at DATETIME NOT NULL,
+            INDEX idx_revoked_expires (expires_at)
+        )
+    """)
+    conn.commit()
+    cursor.close()
+    conn.close()
+    logger.info("Tabla 'users' verificada/creada")
+
+# ================================
+# MOTOR DE HASHING (POOL DE PROCESOS)
+# ================================
+
+# bcrypt corre en procesos propios: no ocupa el threadpool de FastAPI ni compite por el GIL,
+# así /profile y /health siguen respondiendo durante picos de login
+HASH_WORKERS = int(os.getenv("HASH_WORKERS", "0")) or os.cpu_count() or 1
+HASH_QUEUE_LIMIT = int(os.getenv("HASH_QUEUE_LIMIT", str(HASH_WORKERS * 8)))
+HASH_RETRY_AFTER = os.getenv("HASH_RETRY_AFTER", "1")
+
+bcrypt_seconds = metrics_registry.histogram(
+    "bcrypt_seconds", "Tiempo de bcrypt por operación, incluida la cola", ("operation",))
+hash_queue_depth = metrics_registry.gauge("hash_queue_depth", "Operaciones de bcrypt enviadas y sin terminar")
+hash_rejections = metrics_registry.counter(
+    "hash_rejections_total", "Operaciones de bcrypt rechazadas por cola llena", ("operation",))
+
+class HashQueueFullError(Exception):
+    pass
+
+class HashEngine:
+    """Pool de procesos para bcrypt con cola acotada: si está llena se falla rápido."""
+
+    def __init__(self, workers: int, queue_limit: int):
+        self.workers = workers
+        self.queue_limit = queue_limit
+        self.pending = 0
+        self.executor: Optional[ProcessPoolExecutor] = None
+        self.stats = {"submitted": 0, "rejected": 0, "restarts": 0}
+
+    def start(self):
+        # forkserver: este proceso ya tiene hilos (logging, threadpool) y hacer fork desde él
+        # puede dejar locks tomados en los hijos; los workers solo importan bcrypt
+        methods = multiprocessing.get_all_start_methods()
+        context = multiprocessing.get_context("forkserver" if "forkserver" in methods else None)
+        self.executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=context)
+
+    def shutdown(self, executor: Optional[ProcessPoolExecutor] = None):
+        """Apaga el pool actual, o solo `executor` si sigue siendo el actual."""
+        current = self.executor
+        if current is None or (executor is not None and executor is not current):
+            return
+        self.executor = None
+        current.shutdown(wait=False, cancel_futures=True)
+
+    async def run(self, operation: str, function, *args):
+        if self.pending >= self.queue_limit:
+            self.stats["rejected"] += 1
+            hash_rejections.inc(operation)
+            raise HashQueueFullError(operation)
+        if self.executor is None:
+            self.start()
+        # Se guarda el pool usado: un fallo tardío de un pool viejo no debe apagar el nuevo
+        executor = self.executor
+        self.pending += 1
+        self.stats["submitted"] += 1
+        hash_queue_depth.inc()
+        start_time = time.perf_counter()
+        try:
+            return await asyncio.wrap_future(executor.submit(function, *args))
+        except BrokenProcessPool:
+            # Un worker murió (ej. OOM): se recrea el pool y la petición falla una sola vez
+            if self.executor is executor:
+                logger.error("💥 Pool de hashing roto, recreándolo")
+                self.stats["restarts"] += 1
+                self.shutdown(executor)
+            raise
+        finally:
+            self.pending -= 1
+            hash_queue_depth.dec()
+            elapsed = time.perf_counter() - start_time
+            bcrypt_seconds.observe(elapsed, operation)
+            record_span("bcrypt", elapsed, operation)
+
+    def snapshot(self) -> dict:
+        return {"workers": self.workers, "queue_limit": self.queue_limit, "pending": self.pending, **self.stats}
+
+hash_engine = HashEngine(HASH_WORKERS, HASH_QUEUE_LIMIT)
+
+@app.on_event("startup")
+def start_hash_engine():
+    hash_engine.start()
+    logger.info("🔐 Pool de hashing con %s procesos (cola máx. %s)", HASH_WORKERS, HASH_QUEUE_LIMIT)
+
+@app.on_event("shutdown")
+def stop_hash_engine():
+    hash_engine.shutdown()
+
+def hash_busy_exception() -> HTTPException:
+    return HTTPException(
+        status_code=503,
+        detail="Servicio de autenticación saturado, intenta de nuevo",
+        headers={"Retry-After": HASH_RETRY_AFTER}
+    )
+
+async def hash_password(password: str) -> str:
+    salt = bcrypt.gensalt(bcrypt_policy["rounds"])
+    hashed = await hash_engine.run("hash", bcrypt.hashpw, password.encode(), salt)
+    return hashed.decode()
+
+async def verify_password(password: str, hashed: str) -> bool:
+    return await hash_engine.run("verify", bcrypt.checkpw, password.encode(), hashed.encode())
+
+# ================================
+# CALIBRACIÓN DEL COSTO DE BCRYPT
+# ================================
+
+# Al arrancar se elige el costo más alto cuyo hash entra en BCRYPT_TARGET_MS en este hardware;
+# BCRYPT_ROUNDS fija el costo y se salta la medición. Con varias réplicas conviene fijarlo:
+# cada una calibra por su cuenta y pueden quedar con costos distintos
+BCRYPT_TARGET_MS = float(os.getenv("BCRYPT_TARGET_MS", "250"))
+BCRYPT_MIN_ROUNDS = int(os.getenv("BCRYPT_MIN_ROUNDS", "10"))
+BCRYPT_MAX_ROUNDS = int(os.getenv("BCRYPT_MAX_ROUNDS", "15"))
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "0"))
+BCRYPT_CALIBRATION_SAMPLES = 3
+
+bcrypt_rehashes = metrics_registry.counter(
+    "bcrypt_rehashes_total", "Hashes actualizados al costo vigente tras un login", ("result",))
+
+bcrypt_policy = {
+    "rounds": BCRYPT_ROUNDS or 12,
+    "source": "env" if BCRYPT_ROUNDS else "default",
+    "target_ms": BCRYPT_TARGET_MS,
+    "measured_ms": {},
+    "calibrated_at": None
+}
+
+async def measure_rounds(rounds: int) -> float:
+    """Mediana en ms de varios hashes con ese costo, ejecutados en el pool de hashing."""
+    samples = []
+    for _ in range(BCRYPT_CALIBRATION_SAMPLES):
+        start_time = time.perf_counter()
+        await hash_engine.run("calibrate", bcrypt.hashpw, b"calibration-password", bcrypt.gensalt(rounds))
+        samples.append((time.perf_counter() - start_time) * 1000)
+    measured = sorted(samples)[len(samples) // 2]
+    bcrypt_policy["measured_ms"][rounds] = round(measured, 1)
+    return measured
+
+@app.on_event("startup")
+async def calibrate_bcrypt():
+    if BCRYPT_ROUNDS:
+        logger.info("🔐 Costo de bcrypt fijado por entorno: %s", BCRYPT_ROUNDS)
+        return
+    # Cada punto de costo duplica el tiempo: se mide el mínimo y se extrapola
+    base_ms = await measure_rounds(BCRYPT_MIN_ROUNDS)
+    steps = int(math.log2(BCRYPT_TARGET_MS / base_ms)) if base_ms < BCRYPT_TARGET_MS else 0
+    rounds = min(BCRYPT_MAX_ROUNDS, BCRYPT_MIN_ROUNDS + steps)
+    # Se confirma el costo elegido y se baja si la extrapolación se pasó
+    while rounds > BCRYPT_MIN_ROUNDS and await measure_rounds(rounds) > BCRYPT_TARGET_MS:
+        rounds -= 1
+
+    bcrypt_policy.update({
+        "rounds": rounds,
+        "source": "calibrated",
+        "calibrated_at": datetime.utcnow().isoformat() + "Z"
+    })
+    logger.info("🔐 Costo de bcrypt calibrado: %s (%s ms con costo %s, objetivo %s ms)",
+                rounds, round(base_ms, 1), BCRYPT_MIN_ROUNDS, BCRYPT_TARGET_MS)
+
+def hash_rounds(hashed: str) -> Optional[int]:
+    # Formato $2b$12$<salt+hash>
+    parts = hashed.split("$")
+    return int(parts[2]) if len(parts) > 3 and parts[2].isdigit() else None
+
+def update_password_hash(user_id: int, old_hash: str, new_hash: str) -> bool:
+    conn = get_connection()
+    cursor = conn.cursor()
+    # Solo si nadie cambió el hash mientras tanto
+    cursor.execute("UPDATE users SET password = %s WHERE id = %s AND password = %s", (new_hash, user_id, old_hash))
     conn.commit()
+    updated = cursor.rowcount == 1
     cursor.close()
     conn.close()
-    print("[auth-service] Tabla 'users' verificada/creada")
+    return updated
+
+async def rehash_password(user: dict, password: str):
+    """Tarea de fondo tras un login válido: rehace el hash si su costo es menor al vigente."""
+    try:
+        new_hash = await hash_password(password)
+        updated = await run_in_threadpool(update_password_hash, user["id"], user["password"], new_hash)
+        bcrypt_rehashes.inc("updated" if updated else "conflict")
+        if updated:
+            logger.info("🔐 Hash de %s actualizado a costo %s", user["email"], bcrypt_policy["rounds"])
+    except HashQueueFullError:
+        # Pool saturado: se reintenta en el próximo login
+        bcrypt_rehashes.inc("skipped")
+    except Exception as e:
+        bcrypt_rehashes.inc("error")
+        logger.warning("🔐 No se pudo rehacer el hash de %s: %s", user["email"], e)
+
+# ================================
+# TOKENS DE REFRESCO Y REVOCACIÓN
+# ================================
+
+REFRESH_TOKEN_EXPIRE_DAYS = int(os.getenv("REFRESH_TOKEN_EXPIRE_DAYS", "7"))
+REVOCATION_CAPACITY = int(os.getenv("REVOCATION_CAPACITY", "100000"))
+REVOCATION_FP_RATE = float(os.getenv("REVOCATION_FP_RATE", "0.001"))
+REVOCATION_SYNC_SECONDS = float(os.getenv("REVOCATION_SYNC_SECONDS", "30"))
+REVOCATION_REBUILD_SECONDS = float(os.getenv("REVOCATION_REBUILD_SECONDS", "3600"))
+
+# Claims de control que no se copian al emitir un par nuevo desde un refresh token
+TOKEN_CONTROL_CLAIMS = {"exp", "iat", "jti", "type"}
+
+revocation_list = RevocationList(metrics_registry, get_connection, REVOCATION_CAPACITY, REVOCATION_FP_RATE)
+revocation_sync_task: Optional[asyncio.Task] = None
+
+def reload_revocations(full: bool):
+    # Solo auth-service purga las vencidas; el gateway lee la misma tabla
+    if full:
+        revocation_list.purge_expired()
+    revocation_list.load(full)
+
+async def sync_revocations():
+    while True:
+        await asyncio.sleep(REVOCATION_SYNC_SECONDS)
+        full = time.monotonic() - revocation_list.rebuilt_at >= REVOCATION_REBUILD_SECONDS
+        try:
+            await run_in_threadpool(reload_revocations, full)
+        except Exception as e:
+            logger.warning("🚫 No se pudo sincronizar la lista de revocación: %s", e)
+
+@app.on_event("startup")
+async def start_revocation_sync():
+    global revocation_sync_task
+    await run_in_threadpool(reload_revocations, True)
+    revocation_sync_task = asyncio.create_task(sync_revocations())
+    logger.info("🚫 Lista de revocación cargada: %s tokens", revocation_list.filter.count)
+
+@app.on_event("shutdown")
+async def stop_revocation_sync():
+    if revocation_sync_task is not None:
+        revocation_sync_task.cancel()
 
 def create_access_token(data: dict, expires_delta: timedelta | None = None):
     to_encode = data.copy()
-    expire = datetime.utcnow() + (expires_delta or timedelta(minutes=15))
-    to_encode.update({"exp": expire})
+    expire = datetime.utcnow() + (expires_delta or timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES))
+    to_encode.update({"exp": expire, "jti": uuid.uuid4().hex, "type": "access"})
     return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
 
+def create_refresh_token(data: dict):
+    to_encode = data.copy()
+    expire = datetime.utcnow() + timedelta(days=REFRESH_TOKEN_EXPIRE_DAYS)
+    to_encode.update({"exp": expire, "jti": uuid.uuid4().hex, "type": "refresh"})
+    return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
+
+def issue_tokens(claims: dict) -> dict:
+    return {
+        "access_token": create_access_token(claims),
+        "refresh_token": create_refresh_token(claims),
+        "token_type": "bearer",
+        "expires_in": ACCESS_TOKEN_EXPIRE_MINUTES * 60
+    }
+
+def revoke_token(payload: dict) -> bool:
+    if not payload.get("jti"):
+        return False
+    return revocation_list.revoke(payload["jti"], datetime.utcfromtimestamp(payload["exp"]))
+
 def verify_token(token: str = Depends(oauth2_scheme)):
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        return payload
     except JWTError:
         raise HTTPException(status_code=401, detail="Token inválido")
+    # Un refresh token no sirve como token de acceso
+    if payload.get("type") == "refresh" or (payload.get("jti") and revocation_list.is_revoked(payload["jti"])):
+        raise HTTPException(status_code=401, detail="Token inválido")
+    return payload
+
+# ================================
+# PERFIL DESDE LOS CLAIMS
+# ================================
+
+# Los tokens llevan id y name; /profile solo consulta MySQL para tokens antiguos sin esos
+# claims, y aun así pasa antes por este cache
+PROFILE_CLAIMS = ("id", "name")
+PROFILE_CACHE_SIZE = int(os.getenv("PROFILE_CACHE_SIZE", "10000"))
+PROFILE_CACHE_TTL = float(os.getenv("PROFILE_CACHE_TTL", "300"))
+
+profile_requests = metrics_registry.counter("profile_requests_total", "Perfiles servidos por origen", ("source",))
+
+class ProfileCache:
+    """LRU email -> perfil con TTL; invalidate() se llama cuando cambian los datos del usuario."""
+
+    def __init__(self, max_entries: int, ttl: float):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries: "OrderedDict[str, tuple[float, dict]]" = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, email: str) -> Optional[dict]:
+        with self.lock:
+            entry = self.entries.get(email)
+            if entry is None:
+                return None
+            if entry[0] <= time.monotonic():
+                del self.entries[email]
+                return None
+            self.entries.move_to_end(email)
+            return entry[1]
+
+    def put(self, email: str, profile: dict):
+        with self.lock:
+            self.entries[email] = (time.monotonic() + self.ttl, profile)
+            self.entries.move_to_end(email)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def invalidate(self, email: str):
+        with self.lock:
+            self.entries.pop(email, None)
+
+    def snapshot(self) -> dict:
+        return {"entries": len(self.entries), "max_entries": self.max_entries, "ttl": self.ttl}
+
+profile_cache = ProfileCache(PROFILE_CACHE_SIZE, PROFILE_CACHE_TTL)
+
+def user_claims(user: dict) -> dict:
+    return {"sub": user["email"], "id": user["id"], "name": user["name"]}
 
 # ✅ RUTAS SIMPLES - Coinciden con lo que envía el API Gateway proxy
 
-@app.post("/register")
-def register_user(data: RegisterData):
-    try:
-        print(f"[auth-service] Registrando usuario: {data.email}")
-        hashed = bcrypt.hashpw(data.password.encode(), bcrypt.gensalt()).decode()
-        conn = get_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute("SELECT * FROM users WHERE email = %s", (data.email,))
-        if cursor.fetchone():
-            cursor.close()
-            conn.close()
-            raise HTTPException(status_code=409, detail="Correo ya registrado")
-        
-        cursor.execute("INSERT INTO users (name, email, password) VALUES (%s, %s, %s)",
-                       (data.name, data.email, hashed))
-        conn.commit()
+def insert_user(data: RegisterData, hashed: str):
+    conn = get_connection()
+    cursor = conn.cursor()
+    
+    cursor.execute("SELECT * FROM users WHERE email = %s", (data.email,))
+    if cursor.fetchone():
         cursor.close()
         conn.close()
+        raise HTTPException(status_code=409, detail="Correo ya registrado")
+    
+    cursor.execute("INSERT INTO users (name, email, password) VALUES (%s, %s, %s)",
+                   (data.name, data.email, hashed))
+    conn.commit()
+    cursor.close()
+    conn.close()
+    profile_cache.invalidate(data.email)
+
+def find_user(email: str) -> Optional[dict]:
+    conn = get_connection()
+    cursor = conn.cursor(dictionary=True)
+    cursor.execute("SELECT * FROM users WHERE email = %s", (email,))
+    user = cursor.fetchone()
+    cursor.close()
+    conn.close()
+    return user
+
+# Los handlers son async: el hashing espera al pool de procesos y MySQL va al threadpool,
+# así un login en curso no retiene un hilo mientras bcrypt trabaja
+
+@app.post("/register")
+async def register_user(data: RegisterData):
+    try:
+        logger.info("Registrando usuario: %s", data.email)
+        hashed = await hash_password(data.password)
+        await run_in_threadpool(insert_user, data, hashed)
         
-        print(f"[auth-service] Usuario registrado exitosamente: {data.email}")
+        logger.info("Usuario registrado exitosamente: %s", data.email)
         return {"message": "Usuario registrado exitosamente"}
     
     except HTTPException:
         raise
+    except HashQueueFullError:
+        logger.warning("🚦 Registro rechazado, cola de hashing llena: %s", data.email)
+        raise hash_busy_exception()
+    except BrokenProcessPool:
+        # El pool ya se está recreando: el cliente puede reintentar enseguida
+        raise hash_busy_exception()
     except Exception as e:
-        print(f"[auth-service] Error en registro: {e}")
+        logger.error("Error en registro: %s", e)
         raise HTTPException(status_code=500, detail="Error interno del servidor")
 
 @app.post("/login", response_model=Token)
-def login_user(form_data: OAuth2PasswordRequestForm = Depends()):
+async def login_user(background_tasks: BackgroundTasks, form_data: OAuth2PasswordRequestForm = Depends()):
     try:
-        print(f"[auth-service] Intento de login: {form_data.username}")
-        conn = get_connection()
-        cursor = conn.cursor(dictionary=True)
-        cursor.execute("SELECT * FROM users WHERE email = %s", (form_data.username,))
-        user = cursor.fetchone()
-        cursor.close()
-        conn.close()
+        logger.info("Intento de login: %s", form_data.username)
+        user = await run_in_threadpool(find_user, form_data.username)
         
-        if not user or not bcrypt.checkpw(form_data.password.encode(), user["password"].encode()):
-            print(f"[auth-service] Login fallido para: {form_data.username}")
+        if not user or not await verify_password(form_data.password, user["password"]):
+            logger.warning("Login fallido para: %s", form_data.username)
             raise HTTPException(status_code=401, detail="Credenciales inválidas")
         
-        token = create_access_token({"sub": user["email"]})
-        print(f"[auth-service] Login exitoso: {form_data.username}")
-        return {"access_token": token, "token_type": "bearer"}
+        # Solo se sube el costo: bajar haría que réplicas con costos distintos se pisen
+        # rehaciendo el mismo hash en cada login
+        if (hash_rounds(user["password"]) or 0) < bcrypt_policy["rounds"]:
+            background_tasks.add_task(rehash_password, user, form_data.password)
+        
+        logger.info("Login exitoso: %s", form_data.username)
+        return issue_tokens(user_claims(user))
     
     except HTTPException:
         raise
+    except HashQueueFullError:
+        logger.warning("🚦 Login rechazado, cola de hashing llena: %s", form_data.username)
+        raise hash_busy_exception()
+    except BrokenProcessPool:
+        # El pool ya se está recreando: el cliente puede reintentar enseguida
+        raise hash_busy_exception()
     except Exception as e:
-        print(f"[auth-service] Error en login: {e}")
+        logger.error("Error en login: %s", e)
         raise HTTPException(status_code=500, detail="Error interno del servidor")
 
+@app.post("/refresh", response_model=Token)
+def refresh_tokens(data: RefreshRequest, token: Optional[str] = Depends(optional_oauth2_scheme)):
+    """Emite un par nuevo sin verificar contraseña; el refresh token usado queda revocado,
+    igual que el token de acceso anterior si viene en Authorization y no venció."""
+    try:
+        payload = jwt.decode(data.refresh_token, SECRET_KEY, algorithms=[ALGORITHM])
+    except JWTError:
+        raise HTTPException(status_code=401, detail="Refresh token inválido")
+    if payload.get("type") != "refresh" or not payload.get("jti"):
+        raise HTTPException(status_code=401, detail="Refresh token inválido")
+
+    try:
+        if not revoke_token(payload):
+            logger.warning("🚫 Refresh token reutilizado para: %s", payload.get("sub"))
+            raise HTTPException(status_code=401, detail="Refresh token revocado")
+        if token:
+            try:
+                previous = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+            except JWTError:
+                previous = None
+            if previous and previous.get("type") == "access" and previous.get("sub") == payload.get("sub"):
+                revoke_token(previous)
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error("Error renovando token: %s", e)
+        raise HTTPException(status_code=500, detail="Error interno del servidor")
+
+    claims = {key: value for key, value in payload.items() if key not in TOKEN_CONTROL_CLAIMS}
+    return issue_tokens(claims)
+
 @app.post("/logout")
-def logout():
+def logout(data: Optional[LogoutRequest] = None, token: Optional[str] = Depends(optional_oauth2_scheme)):
+    # Se revocan el token de acceso y el refresh token recibidos; los inválidos se ignoran
+    for raw in (token, data.refresh_token if data else None):
+        if not raw:
+            continue
+        try:
+            revoke_token(jwt.decode(raw, SECRET_KEY, algorithms=[ALGORITHM]))
+        except JWTError:
+            continue
+        except Exception as e:
+            logger.error("Error revocando token en logout: %s", e)
+            raise HTTPException(status_code=500, detail="Error interno del servidor")
     return {"message": "Logout exitoso. Elimina el token en el cliente."}
 
 @app.get("/profile", response_model=UserOut)
 def get_profile(token_data=Depends(verify_token)):
     try:
-        print(f"[auth-service] Obteniendo perfil para: {token_data['sub']}")
+        email = token_data["sub"]
+        if all(claim in token_data for claim in PROFILE_CLAIMS):
+            profile_requests.inc("claims")
+            return {"id": token_data["id"], "name": token_data["name"], "email": email}
+
+        user = profile_cache.get(email)
+        if user is not None:
+            profile_requests.inc("cache")
+            return user
+
+        logger.info("Obteniendo perfil para: %s", email)
+        profile_requests.inc("database")
         conn = get_connection()
         cursor = conn.cursor(dictionary=True)
-        cursor.execute("SELECT id, name, email FROM users WHERE email = %s", (token_data["sub"],))
+        cursor.execute("SELECT id, name, email FROM users WHERE email = %s", (email,))
         user = cursor.fetchone()
         cursor.close()
         conn.close()
@@ -163,18 +587,233 @@ def get_profile(token_data=Depends(verify_token)):
         if not user:
             raise HTTPException(status_code=404, detail="Usuario no encontrado")
         
+        profile_cache.put(email, user)
         return user
     
     except HTTPException:
         raise
     except Exception as e:
-        print(f"[auth-service] Error obteniendo perfil: {e}")
+        logger.error("Error obteniendo perfil: %s", e)
         raise HTTPException(status_code=500, detail="Error interno del servidor")
 
+# ================================
+# IMPORTACIÓN MASIVA DE USUARIOS
+# ================================
+
+# Token para la importación (header X-Admin-Token); si no está configurado queda deshabilitada
+IMPORT_ADMIN_TOKEN = os.getenv("IMPORT_ADMIN_TOKEN", "")
+IMPORT_MAX_BYTES = int(os.getenv("IMPORT_MAX_BYTES", str(32 * 1024 * 1024)))
+IMPORT_CHUNK_SIZE = int(os.getenv("IMPORT_CHUNK_SIZE", "200"))
+# Hashes de la importación en vuelo a la vez: con uno por worker los logins no esperan detrás del lote
+IMPORT_HASH_CONCURRENCY = int(os.getenv("IMPORT_HASH_CONCURRENCY", str(HASH_WORKERS)))
+IMPORT_HASH_BACKOFF = 0.05
+# Línea de progreso mientras un chunk se hashea: mantiene viva la respuesta por debajo del
+# timeout de lectura del gateway aunque haya pocos cores
+IMPORT_PROGRESS_SECONDS = float(os.getenv("IMPORT_PROGRESS_SECONDS", "5"))
+
+import_rows_total = metrics_registry.counter(
+    "import_rows_total", "Filas procesadas por la importación masiva", ("result",))
+import_hash_slots = asyncio.Semaphore(IMPORT_HASH_CONCURRENCY)
+
+def import_format(request: Request) -> str:
+    requested = request.query_params.get("format")
+    content_type = request.headers.get("content-type", "")
+    if requested in ("csv", "ndjson"):
+        return requested
+    if "csv" in content_type:
+        return "csv"
+    if "ndjson" in content_type or "jsonl" in content_type:
+        return "ndjson"
+    raise HTTPException(status_code=415, detail="Formato no soportado: usa text/csv o application/x-ndjson")
+
+def parse_import(body: bytes, file_format: str) -> list[tuple[int, object]]:
+    """Filas (número, dict) en orden; una línea NDJSON inválida queda como texto para reportarla."""
+    text = body.decode("utf-8-sig")
+    if file_format == "csv":
+        # La fila 1 es el encabezado: name,email,password
+        return list(enumerate(csv.DictReader(io.StringIO(text)), start=2))
+    rows = []
+    for number, line in enumerate(text.splitlines(), start=1):
+        if not line.strip():
+            continue
+        try:
+            rows.append((number, json.loads(line)))
+        except ValueError:
+            rows.append((number, line))
+    return rows
+
+def row_result(number: int, email, status: str, detail: Optional[str] = None) -> dict:
+    import_rows_total.inc(status)
+    result = {"row": number, "email": email, "status": status}
+    if detail:
+        result["detail"] = detail
+    return result
+
+def existing_emails(conn, emails: list[str]) -> set[str]:
+    # Una sola consulta por chunk en vez de un SELECT por usuario
+    cursor = conn.cursor()
+    placeholders = ", ".join(["%s"] * len(emails))
+    cursor.execute(f"SELECT email FROM users WHERE email IN ({placeholders})", emails)
+    found = {row[0].lower() for row in cursor.fetchall()}
+    cursor.close()
+    return found
+
+def insert_users(conn, users: list[tuple[str, str, str]]) -> set[str]:
+    """Inserta el chunk en una transacción; devuelve los emails que ya existían.
+
+    Si otro registro ganó la carrera entre el IN y el INSERT, el lote falla entero y se
+    reintenta fila por fila para saber cuáles chocaron.
+    """
+    cursor = conn.cursor()
+    query = "INSERT INTO users (name, email, password) VALUES (%s, %s, %s)"
+    try:
+        cursor.executemany(query, users)
+        conn.commit()
+        cursor.close()
+        return set()
+    except mysql.connector.IntegrityError:
+        conn.rollback()
+    conflicts = set()
+    for user in users:
+        try:
+            cursor.execute(query, user)
+        except mysql.connector.IntegrityError:
+            conflicts.add(user[1].lower())
+    conn.commit()
+    cursor.close()
+    return conflicts
+
+async def import_hash(password: str) -> str:
+    async with import_hash_slots:
+        while True:
+            try:
+                return await hash_password(password)
+            except HashQueueFullError:
+                # Cola llena por logins: la importación cede y reintenta
+                await asyncio.sleep(IMPORT_HASH_BACKOFF)
+
+async def import_chunk(conn, chunk: list[tuple[int, object]], seen: set[str], progress: dict) -> list[dict]:
+    results: dict[int, dict] = {}
+    valid: list[tuple[int, RegisterData]] = []
+    for number, raw in chunk:
+        if not isinstance(raw, dict):
+            results[number] = row_result(number, None, "invalid", "Fila mal formada")
+            continue
+        try:
+            # Columnas sobrantes del CSV quedan bajo la clave None y se ignoran
+            data = RegisterData(**{key: value for key, value in raw.items() if isinstance(key, str)})
+        except ValidationError as e:
+            error = e.errors()[0]
+            field = ".".join(str(part) for part in error["loc"])
+            results[number] = row_result(number, raw.get("email"), "invalid", f"{field}: {error['msg']}")
+            continue
+        email = data.email.lower()
+        if email in seen:
+            results[number] = row_result(number, data.email, "duplicate", "Repetido en el archivo")
+            continue
+        seen.add(email)
+        valid.append((number, data))
+
+    if valid:
+        existing = await run_in_threadpool(existing_emails, conn, [data.email for _, data in valid])
+        new_users = []
+        for number, data in valid:
+            if data.email.lower() in existing:
+                results[number] = row_result(number, data.email, "duplicate", "Correo ya registrado")
+            else:
+                new_users.append((number, data))
+
+        async def counted_hash(password: str) -> str:
+            hashed = await import_hash(password)
+            progress["hashed"] += 1
+            return hashed
+
+        hashes = await asyncio.gather(*(counted_hash(data.password) for _, data in new_users))
+        conflicts = await run_in_threadpool(
+            insert_users, conn, [(data.name, data.email, hashed) for (_, data), hashed in zip(new_users, hashes)]
+        )
+        for number, data in new_users:
+            if data.email.lower() in conflicts:
+                results[number] = row_result(number, data.email, "duplicate", "Correo ya registrado")
+            else:
+                profile_cache.invalidate(data.email)
+                results[number] = row_result(number, data.email, "created")
+
+    return [results[number] for number, _ in chunk]
+
+async def stream_import(rows: list[tuple[int, object]]):
+    start_time = time.perf_counter()
+    summary = {"created": 0, "duplicate": 0, "invalid": 0, "error": 0}
+    seen: set[str] = set()
+    progress = {"hashed": 0, "processed_rows": 0}
+    conn = await run_in_threadpool(get_connection)
+    task: Optional[asyncio.Task] = None
+    try:
+        for start in range(0, len(rows), IMPORT_CHUNK_SIZE):
+            chunk = rows[start:start + IMPORT_CHUNK_SIZE]
+            task = asyncio.ensure_future(import_chunk(conn, chunk, seen, progress))
+            # Las filas de un chunk se informan tras su commit; hasta entonces solo progreso
+            while not (await asyncio.wait({task}, timeout=IMPORT_PROGRESS_SECONDS))[0]:
+                yield json.dumps({"progress": dict(progress, rows=len(rows))}) + "\n"
+            try:
+                results = task.result()
+            except Exception as e:
+                # Un chunk fallido se reporta y la importación sigue con el siguiente
+                logger.error("📥 Error importando filas %s-%s: %s", chunk[0][0], chunk[-1][0], e)
+                await run_in_threadpool(conn.rollback)
+                results = [row_result(number, raw.get("email") if isinstance(raw, dict) else None,
+                                      "error", "Error interno del servidor") for number, raw in chunk]
+            for result in results:
+                summary[result["status"]] += 1
+            progress["processed_rows"] = start + len(chunk)
+            yield "".join(json.dumps(result) + "\n" for result in results)
+    finally:
+        # Cliente desconectado: el chunk en curso no se sigue procesando
+        if task is not None and not task.done():
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+        await run_in_threadpool(conn.close)
+
+    elapsed = time.perf_counter() - start_time
+    logger.info("📥 Importación terminada en %.1fs: %s", elapsed, summary)
+    yield json.dumps({"summary": summary, "rows": len(rows), "seconds": round(elapsed, 2)}) + "\n"
+
+async def read_import_body(request: Request) -> bytes:
+    # El límite se aplica mientras se lee: un archivo enorme no llega a cargarse entero en memoria
+    too_large = HTTPException(status_code=413, detail=f"Archivo mayor a {IMPORT_MAX_BYTES} bytes")
+    content_length = request.headers.get("content-length")
+    if content_length and content_length.isdigit() and int(content_length) > IMPORT_MAX_BYTES:
+        raise too_large
+    chunks = []
+    received = 0
+    async for chunk in request.stream():
+        received += len(chunk)
+        if received > IMPORT_MAX_BYTES:
+            raise too_large
+        chunks.append(chunk)
+    return b"".join(chunks)
+
+@app.post("/import")
+async def import_users(request: Request):
+    """Registra usuarios en lote desde CSV o NDJSON y devuelve un resultado NDJSON por fila."""
+    if not IMPORT_ADMIN_TOKEN or request.headers.get("x-admin-token") != IMPORT_ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Operación administrativa no autorizada")
+
+    file_format = import_format(request)
+    body = await read_import_body(request)
+    try:
+        rows = parse_import(body, file_format)
+    except (UnicodeDecodeError, csv.Error) as e:
+        raise HTTPException(status_code=400, detail=f"Archivo inválido: {e}")
+
+    logger.info("📥 Importando %s filas (%s)", len(rows), file_format)
+    return StreamingResponse(stream_import(rows), media_type="application/x-ndjson")
+
 @app.get("/health")
 def health():
     try:
-        conn = get_connection()
+        # Un solo intento: el health check no debe quedarse esperando reintentos
+        conn = get_connection(attempts=1)
         cursor = conn.cursor()
         cursor.execute("SELECT 1")
         cursor.fetchone()
@@ -192,11 +831,22 @@ def debug_info():
         "routes": [
             "/register (POST)",
             "/login (POST)", 
+            "/refresh (POST)",
+            "/import (POST)",
             "/logout (POST)",
             "/profile (GET)",
             "/health (GET)",
-            "/debug (GET)"
+            "/debug (GET)",
+            "/metrics (GET)"
         ],
         "proxy_info": "API Gateway: /api/v0/auth/{path} → /{path}",
-        "database": {"host": "db", "name": "users_db"}
+        "database": {"host": "db", "name": "users_db"},
+        "hash_engine": hash_engine.snapshot(),
+        "bcrypt": bcrypt_policy,
+        "tokens": {
+            "access_minutes": ACCESS_TOKEN_EXPIRE_MINUTES,
+            "refresh_days": REFRESH_TOKEN_EXPIRE_DAYS,
+            "revocation": revocation_list.snapshot()
+        },
+        "profile_cache": profile_cache.snapshot()
     }
\ No newline at end of file
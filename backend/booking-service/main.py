@@ -1,14 +1,29 @@
 # backend/booking-service/main.py - ELIMINA FÍSICAMENTE LAS RESERVAS CANCELADAS
 
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Depends, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel, EmailStr, Field
-import mysql.connector
-import time
+import json
+import sys
+import os
 from datetime import datetime, timedelta
 from typing import Optional
 
-app = FastAPI(title="Booking Service", version="1.2")
+# El módulo compartido vive en backend/common (en Docker se copia a /app/common)
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.observability import (
+    MetricsRegistry, MySQLDatabase, TimedJSONResponse, instrument_service, setup_logging
+)
+
+# ================================
+# LOGGING, MÉTRICAS Y TRAZAS
+# ================================
+
+SERVICE_NAME = "booking-service"
+logger = setup_logging(SERVICE_NAME)
+metrics_registry = MetricsRegistry()
+
+app = FastAPI(title="Booking Service", version="1.2", default_response_class=TimedJSONResponse)
 
 app.add_middleware(
     CORSMiddleware,
@@ -18,6 +33,8 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+instrument_service(app, metrics_registry)
+
 # ================================
 # MODELOS PYDANTIC
 # ================================
@@ -40,19 +57,35 @@ class CancelBookingRequest(BaseModel):
 # FUNCIONES DE BASE DE DATOS
 # ================================
 
-def get_connection():
-    for attempt in range(20):
-        try:
-            return mysql.connector.connect(
-                host="db",
-                user="root",
-                password="12345",
-                database="users_db"
-            )
-        except mysql.connector.Error:
-            print(f"[booking-service] Intento {attempt+1} fallido, esperando...")
-            time.sleep(3)
-    raise Exception("No se pudo conectar a la base de datos.")
+database = MySQLDatabase(metrics_registry, "users_db")
+get_connection = database.connect
+
+# ================================
+# IDENTIDAD VERIFICADA POR EL GATEWAY
+# ================================
+
+# El API Gateway verifica el JWT y reenvía el "sub" en este header de confianza
+IDENTITY_HEADER = os.getenv("IDENTITY_HEADER", "X-User-Email")
+
+def get_identity(request: Request) -> Optional[str]:
+    """Email verificado por el gateway, o None si la petición no trae token."""
+    return request.headers.get(IDENTITY_HEADER)
+
+def check_scope(identity: Optional[str], email: str):
+    """Impide que un usuario autenticado consulte o modifique datos de otro usuario."""
+    if identity and identity.lower() != str(email).lower():
+        raise HTTPException(status_code=403, detail="No autorizado para acceder a datos de otro usuario")
+
+# ================================
+# EVENTOS PARA EL CANAL PUSH
+# ================================
+
+# El gateway lee este header, lo quita de la respuesta y reenvía los eventos por SSE
+PUSH_EVENT_HEADER = "X-Push-Event"
+
+def attach_push_events(response: Response, *events: dict):
+    response.headers[PUSH_EVENT_HEADER] = json.dumps(list(events), ensure_ascii=True, default=str,
+                                                     separators=(",", ":"))
 
 @app.on_event("startup")
 def create_table():
@@ -90,16 +123,17 @@ def create_table():
     conn.commit()
     cursor.close()
     conn.close()
-    print("[booking-service] Tablas verificadas/creadas: bookings + cancelled_bookings_log")
+    logger.info("Tablas verificadas/creadas: bookings + cancelled_bookings_log")
 
 # ================================
 # RUTAS PRINCIPALES
 # ================================
 
 @app.post("/reservar", summary="Reservar un taller con validación completa")
-def reservar_taller(data: BookingRequest):
+def reservar_taller(data: BookingRequest, response: Response, identity: Optional[str] = Depends(get_identity)):
+    check_scope(identity, data.user_email)
     try:
-        print(f"[booking-service] Nueva reserva: {data.user_email} -> taller {data.workshop_id}")
+        logger.info("Nueva reserva: %s -> taller %s", data.user_email, data.workshop_id)
         conn = get_connection()
         cursor = conn.cursor(dictionary=True)
 
@@ -141,30 +175,42 @@ def reservar_taller(data: BookingRequest):
             WHERE id = %s
         """, (data.workshop_id,))
 
-        conn.commit()
+        # Cupos leídos antes del commit: la fila sigue bloqueada por el UPDATE, así el evento
+        # lleva el valor que dejó esta reserva y no el de otra concurrente
         cursor.execute("SELECT * FROM bookings WHERE user_email = %s AND workshop_id = %s",
                        (data.user_email, data.workshop_id))
         reserva = cursor.fetchone()
+        cursor.execute("SELECT current_participants, max_participants FROM workshops WHERE id = %s",
+                       (data.workshop_id,))
+        cupos = cursor.fetchone()
+        conn.commit()
         cursor.close()
         conn.close()
         
-        print(f"[booking-service] Reserva creada exitosamente: ID {reserva['id']}")
+        logger.info("Reserva creada exitosamente: ID %s", reserva['id'])
+        attach_push_events(
+            response,
+            {"type": "booking.created", "user_email": data.user_email,
+             "booking_id": reserva["id"], "workshop_id": data.workshop_id},
+            {"type": "workshop.seats_changed", "workshop_id": data.workshop_id, **cupos}
+        )
         return reserva
         
     except HTTPException:
         raise
     except Exception as e:
-        print(f"[booking-service] Error en reserva: {e}")
+        logger.error("Error en reserva: %s", e)
         raise HTTPException(status_code=500, detail="Error interno del servidor")
 
 @app.get("/usuario/{email}", response_model=list[BookingResponse], summary="Listar reservas por usuario")
-def listar_reservas(email: EmailStr):
+def listar_reservas(email: EmailStr, identity: Optional[str] = Depends(get_identity)):
     """
     Lista todas las reservas activas del usuario.
     Las canceladas ya no existen en la tabla.
     """
+    check_scope(identity, email)
     try:
-        print(f"[booking-service] Obteniendo reservas para: {email}")
+        logger.info("Obteniendo reservas para: %s", email)
         conn = get_connection()
         cursor = conn.cursor(dictionary=True)
         
@@ -176,13 +222,13 @@ def listar_reservas(email: EmailStr):
         if not reservas:
             raise HTTPException(status_code=404, detail="No se encontraron reservas")
         
-        print(f"[booking-service] Encontradas {len(reservas)} reservas para {email}")
+        logger.info("Encontradas %s reservas para %s", len(reservas), email)
         return reservas
         
     except HTTPException:
         raise
     except Exception as e:
-        print(f"[booking-service] Error obteniendo reservas: {e}")
+        logger.error("Error obteniendo reservas: %s", e)
         raise HTTPException(status_code=500, detail="Error interno del servidor")
 
 # ================================
@@ -190,15 +236,16 @@ def listar_reservas(email: EmailStr):
 # ================================
 
 @app.post("/cancelar/{booking_id}", summary="Cancelar y eliminar una reserva")
-def cancelar_reserva(booking_id: int, cancel_data: CancelBookingRequest):
+def cancelar_reserva(booking_id: int, cancel_data: CancelBookingRequest, response: Response,
+                     identity: Optional[str] = Depends(get_identity)):
     """
     Cancela una reserva ELIMINÁNDOLA físicamente de la tabla.
     Esto permite al usuario hacer una nueva reserva para el mismo taller.
     Se guarda un log en cancelled_bookings_log para auditoría.
     """
     try:
-        print(f"[booking-service] 🗑️ Cancelando y eliminando reserva ID: {booking_id}")
-        print(f"[booking-service] Razón: {cancel_data.reason}")
+        logger.info("🗑️ Cancelando y eliminando reserva ID: %s", booking_id)
+        logger.info("Razón: %s", cancel_data.reason)
         
         conn = get_connection()
         cursor = conn.cursor(dictionary=True)
@@ -212,6 +259,12 @@ def cancelar_reserva(booking_id: int, cancel_data: CancelBookingRequest):
             conn.close()
             raise HTTPException(status_code=404, detail="Reserva no encontrada")
 
+        # Solo el dueño de la reserva puede cancelarla
+        if identity and identity.lower() != reserva['user_email'].lower():
+            cursor.close()
+            conn.close()
+            raise HTTPException(status_code=403, detail="No autorizado para acceder a datos de otro usuario")
+
         # 2. Verificar que no esté pagada (regla de negocio)
         if reserva['payment_status'] == 'Pagado':
             cursor.close()
@@ -264,7 +317,7 @@ def cancelar_reserva(booking_id: int, cancel_data: CancelBookingRequest):
         # 5. ✅ ELIMINAR FÍSICAMENTE LA RESERVA
         cursor.execute("DELETE FROM bookings WHERE id = %s", (booking_id,))
         
-        print(f"[booking-service] 🗑️ Reserva {booking_id} ELIMINADA físicamente de la tabla")
+        logger.info("🗑️ Reserva %s ELIMINADA físicamente de la tabla", booking_id)
 
         # 6. Decrementar el contador de participantes del taller
         if taller:
@@ -274,11 +327,20 @@ def cancelar_reserva(booking_id: int, cancel_data: CancelBookingRequest):
                 WHERE id = %s
             """, (reserva['workshop_id'],))
 
+        # Cupos leídos dentro de la transacción, antes de que otra reserva los cambie
+        cursor.execute("SELECT current_participants, max_participants FROM workshops WHERE id = %s",
+                       (reserva['workshop_id'],))
+        cupos = cursor.fetchone()
         conn.commit()
         cursor.close()
         conn.close()
 
-        print(f"[booking-service] ✅ Cancelación completada para reserva {booking_id}")
+        logger.info("✅ Cancelación completada para reserva %s", booking_id)
+        events = [{"type": "booking.cancelled", "user_email": reserva['user_email'],
+                   "booking_id": booking_id, "workshop_id": reserva['workshop_id']}]
+        if cupos:
+            events.append({"type": "workshop.seats_changed", "workshop_id": reserva['workshop_id'], **cupos})
+        attach_push_events(response, *events)
         
         return {
             "message": f"Reserva #{booking_id} cancelada y eliminada exitosamente",
@@ -295,7 +357,7 @@ def cancelar_reserva(booking_id: int, cancel_data: CancelBookingRequest):
     except HTTPException:
         raise
     except Exception as e:
-        print(f"[booking-service] ❌ Error cancelando reserva: {e}")
+        logger.error("❌ Error cancelando reserva: %s", e)
         raise HTTPException(status_code=500, detail=f"Error interno del servidor: {str(e)}")
 
 # ================================
@@ -303,12 +365,13 @@ def cancelar_reserva(booking_id: int, cancel_data: CancelBookingRequest):
 # ================================
 
 @app.get("/usuario/{email}/canceladas", summary="Ver historial de cancelaciones del usuario")
-def historial_cancelaciones(email: EmailStr):
+def historial_cancelaciones(email: EmailStr, identity: Optional[str] = Depends(get_identity)):
     """
     Muestra el historial de reservas canceladas del usuario.
     """
+    check_scope(identity, email)
     try:
-        print(f"[booking-service] Obteniendo historial de cancelaciones para: {email}")
+        logger.info("Obteniendo historial de cancelaciones para: %s", email)
         conn = get_connection()
         cursor = conn.cursor(dictionary=True)
         
@@ -329,16 +392,17 @@ def historial_cancelaciones(email: EmailStr):
         }
         
     except Exception as e:
-        print(f"[booking-service] Error obteniendo historial de cancelaciones: {e}")
+        logger.error("Error obteniendo historial de cancelaciones: %s", e)
         raise HTTPException(status_code=500, detail="Error interno del servidor")
 
 @app.get("/usuario/{email}/estadisticas", summary="Estadísticas completas del usuario")
-def estadisticas_usuario(email: EmailStr):
+def estadisticas_usuario(email: EmailStr, identity: Optional[str] = Depends(get_identity)):
     """
     Estadísticas completas: reservas activas + historial de cancelaciones
     """
+    check_scope(identity, email)
     try:
-        print(f"[booking-service] Obteniendo estadísticas completas para: {email}")
+        logger.info("Obteniendo estadísticas completas para: %s", email)
         conn = get_connection()
         cursor = conn.cursor(dictionary=True)
         
@@ -370,7 +434,7 @@ def estadisticas_usuario(email: EmailStr):
         }
         
     except Exception as e:
-        print(f"[booking-service] Error obteniendo estadísticas: {e}")
+        logger.error("Error obteniendo estadísticas: %s", e)
         raise HTTPException(status_code=500, detail="Error interno del servidor")
 
 # ================================
@@ -380,7 +444,8 @@ def estadisticas_usuario(email: EmailStr):
 @app.get("/health")
 def health():
     try:
-        conn = get_connection()
+        # Un solo intento: el health check no debe quedarse esperando reintentos
+        conn = get_connection(attempts=1)
         cursor = conn.cursor()
         cursor.execute("SELECT 1")
         cursor.fetchone()
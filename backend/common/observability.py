@@ -0,0 +1,391 @@
+# backend/common/observability.py - LOGGING, MÉTRICAS, TRAZAS Y CONEXIONES MYSQL COMPARTIDAS
+#
+# Lo importan los cuatro microservicios y el API Gateway. En Docker se copia a /app/common
+# (ver additional_contexts en docker-compose.yml); en local se agrega backend/ al sys.path.
+
+import atexit
+import bisect
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import threading
+import time
+import uuid
+from contextvars import ContextVar
+from datetime import datetime
+from typing import Optional
+
+import mysql.connector
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, PlainTextResponse
+
+# ================================
+# LOGGING ESTRUCTURADO (JSON LINES)
+# ================================
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_DEBUG_SAMPLE_RATE = float(os.getenv("LOG_DEBUG_SAMPLE_RATE", "0.01"))
+
+class JsonLinesFormatter(logging.Formatter):
+    """Una línea JSON por registro. Corre en el hilo del QueueListener, fuera del request."""
+
+    def __init__(self, service_name: str):
+        super().__init__()
+        self.service_name = service_name
+
+    def format(self, record):
+        entry = {
+            "ts": datetime.fromtimestamp(record.created).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "service": self.service_name,
+            "logger": record.name,
+            "msg": record.getMessage()
+        }
+        request_id = getattr(record, "request_id", None)
+        if request_id:
+            entry["request_id"] = request_id
+        fields = getattr(record, "fields", None)
+        if fields:
+            entry.update(fields)
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    """Encola el LogRecord tal cual; el mensaje se formatea en el hilo de fondo."""
+
+    def prepare(self, record):
+        # Corre en el hilo que loguea, así el request_id del contexto viaja con el registro
+        trace = current_trace.get()
+        if trace is not None:
+            record.request_id = trace.request_id
+        return record
+
+def start_queue_listener(handler: logging.Handler) -> DeferredQueueHandler:
+    """Handler que solo encola; `handler` escribe desde el hilo del QueueListener."""
+    log_queue = queue.SimpleQueue()
+    listener = logging.handlers.QueueListener(log_queue, handler)
+    listener.start()
+    atexit.register(listener.stop)
+    return DeferredQueueHandler(log_queue)
+
+def setup_logging(service_name: str) -> logging.Logger:
+    stream_handler = logging.StreamHandler(sys.stdout)
+    stream_handler.setFormatter(JsonLinesFormatter(service_name))
+
+    root = logging.getLogger()
+    root.handlers = [start_queue_listener(stream_handler)]
+    root.setLevel(LOG_LEVEL)
+    return logging.getLogger(service_name)
+
+def sample_debug() -> bool:
+    """Detalle de debug solo para una fracción LOG_DEBUG_SAMPLE_RATE de las peticiones."""
+    return logging.getLogger().isEnabledFor(logging.DEBUG) and random.random() < LOG_DEBUG_SAMPLE_RATE
+
+# ================================
+# MÉTRICAS (FORMATO PROMETHEUS)
+# ================================
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+class Metric:
+    """Serie con etiquetas. Cada observación es un lock sin contención + una suma (~1 µs)."""
+
+    kind = "untyped"
+
+    def __init__(self, name: str, help_text: str, label_names: tuple = ()):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        # Las series sin etiquetas existen desde el arranque (valor 0)
+        self.values: dict = {} if label_names else {(): 0}
+        self.lock = threading.Lock()
+
+    def format_labels(self, labels: tuple, extra: str = "") -> str:
+        pairs = [f'{name}="{value}"' for name, value in zip(self.label_names, labels)]
+        if extra:
+            pairs.append(extra)
+        return "{" + ",".join(pairs) + "}" if pairs else ""
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.kind}"]
+        with self.lock:
+            items = list(self.values.items())
+        for labels, value in items:
+            lines.append(f"{self.name}{self.format_labels(labels)} {value}")
+        return lines
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, *labels, amount: float = 1):
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def inc(self, *labels, amount: float = 1):
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    def dec(self, *labels, amount: float = 1):
+        self.inc(*labels, amount=-amount)
+
+    def set(self, value: float, *labels):
+        with self.lock:
+            self.values[labels] = value
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, label_names: tuple = (), buckets: tuple = LATENCY_BUCKETS):
+        super().__init__(name, help_text, label_names)
+        self.buckets = buckets
+
+    def observe(self, value: float, *labels):
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            series = self.values.get(labels)
+            if not series:
+                # [conteo por bucket..., conteo en +Inf, suma]
+                series = self.values[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[index] += 1
+            series[-1] += value
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.kind}"]
+        with self.lock:
+            items = [(labels, list(series)) for labels, series in self.values.items()]
+        for labels, series in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                bucket_labels = self.format_labels(labels, f'le="{bound}"')
+                lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+            cumulative += series[len(self.buckets)]
+            bucket_labels = self.format_labels(labels, 'le="+Inf"')
+            lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+            lines.append(f"{self.name}_sum{self.format_labels(labels)} {series[-1]:.6f}")
+            lines.append(f"{self.name}_count{self.format_labels(labels)} {cumulative}")
+        return lines
+
+class MetricsRegistry:
+    """Métricas de una app. Cada servicio tiene la suya (en modo compuesto conviven en un proceso)."""
+
+    def __init__(self):
+        self.metrics: list[Metric] = []
+
+    def counter(self, name: str, help_text: str, label_names: tuple = ()) -> Counter:
+        return self.register(Counter(name, help_text, label_names))
+
+    def gauge(self, name: str, help_text: str, label_names: tuple = ()) -> Gauge:
+        return self.register(Gauge(name, help_text, label_names))
+
+    def histogram(self, name: str, help_text: str, label_names: tuple = (),
+                  buckets: tuple = LATENCY_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, help_text, label_names, buckets))
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+def metrics_response(registry: MetricsRegistry) -> PlainTextResponse:
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
+
+def route_label(request: Request) -> str:
+    """Plantilla de la ruta (no el path real) para no disparar la cardinalidad."""
+    route = request.scope.get("route")
+    return getattr(route, "path", "unmatched")
+
+def http_request_metrics(registry: MetricsRegistry) -> tuple[Histogram, Gauge]:
+    return (
+        registry.histogram("http_request_duration_seconds", "Latencia de las peticiones HTTP por ruta",
+                           ("method", "route", "status")),
+        registry.gauge("http_requests_in_flight", "Peticiones HTTP en curso")
+    )
+
+# ================================
+# TRAZAS (X-Request-ID / SERVER-TIMING)
+# ================================
+
+REQUEST_ID_HEADER = "X-Request-ID"
+TRACE_MAX_SPANS = int(os.getenv("TRACE_MAX_SPANS", "32"))
+
+class RequestTrace:
+    """Spans de una petición; se devuelven al gateway en el header Server-Timing."""
+
+    __slots__ = ("request_id", "spans")
+
+    def __init__(self, request_id: str):
+        self.request_id = request_id
+        self.spans: list = []
+
+    def add(self, name: str, duration: float, desc: Optional[str] = None):
+        if len(self.spans) < TRACE_MAX_SPANS:
+            self.spans.append((name, duration, desc))
+
+    def server_timing(self, total: float) -> str:
+        entries = [format_timing(name, duration, desc) for name, duration, desc in self.spans]
+        entries.append(format_timing("app", total))
+        return ", ".join(entries)
+
+def format_timing(name: str, duration: float, desc: Optional[str] = None) -> str:
+    entry = f"{name};dur={duration * 1000:.2f}"
+    return f'{entry};desc="{desc}"' if desc else entry
+
+current_trace: ContextVar[Optional[RequestTrace]] = ContextVar("current_trace", default=None)
+
+def record_span(name: str, duration: float, desc: Optional[str] = None):
+    trace = current_trace.get()
+    if trace is not None:
+        trace.add(name, duration, desc)
+
+def incoming_request_id(request: Request) -> str:
+    """Reutiliza el X-Request-ID recibido si es razonable; si no, genera uno."""
+    value = request.headers.get(REQUEST_ID_HEADER, "")
+    if 0 < len(value) <= 128 and value.isascii() and value.isprintable() and "," not in value:
+        return value
+    return uuid.uuid4().hex
+
+class TimedJSONResponse(JSONResponse):
+    """JSONResponse que registra la serialización como span."""
+
+    def render(self, content) -> bytes:
+        start_time = time.perf_counter()
+        body = super().render(content)
+        record_span("serialize", time.perf_counter() - start_time)
+        return body
+
+def instrument_service(app: FastAPI, registry: MetricsRegistry):
+    """Traza + latencia por petición y endpoint /metrics de un microservicio."""
+    http_request_seconds, http_requests_in_flight = http_request_metrics(registry)
+
+    @app.middleware("http")
+    async def instrument_request(request: Request, call_next):
+        start_time = time.perf_counter()
+        trace = RequestTrace(incoming_request_id(request))
+        # En modo compuesto el servicio corre en la tarea del gateway: la traza de este se
+        # restaura al salir
+        token = current_trace.set(trace)
+        http_requests_in_flight.inc()
+        status_code = 500
+        try:
+            response = await call_next(request)
+            status_code = response.status_code
+            response.headers[REQUEST_ID_HEADER] = trace.request_id
+            response.headers["Server-Timing"] = trace.server_timing(time.perf_counter() - start_time)
+            return response
+        finally:
+            current_trace.reset(token)
+            http_requests_in_flight.dec()
+            http_request_seconds.observe(time.perf_counter() - start_time, request.method,
+                                         route_label(request), str(status_code))
+
+    @app.get("/metrics", include_in_schema=False)
+    async def metrics():
+        return metrics_response(registry)
+
+# ================================
+# CONEXIONES MYSQL INSTRUMENTADAS
+# ================================
+
+def statement_kind(operation) -> str:
+    words = str(operation).split(None, 1)
+    return words[0].upper() if words else "OTHER"
+
+class TimedCursor:
+    """Cursor que mide execute y fetch; todo lo demás se delega al cursor real."""
+
+    def __init__(self, cursor, database: "MySQLDatabase"):
+        self._cursor = cursor
+        self._database = database
+        self._statement = "OTHER"
+
+    def _timed(self, histogram, span_name, method, *args, **kwargs):
+        start_time = time.perf_counter()
+        try:
+            return method(*args, **kwargs)
+        finally:
+            elapsed = time.perf_counter() - start_time
+            histogram.observe(elapsed, self._statement)
+            record_span(span_name, elapsed, self._statement)
+
+    def execute(self, operation, *args, **kwargs):
+        self._statement = statement_kind(operation)
+        return self._timed(self._database.query_seconds, "db-query", self._cursor.execute,
+                           operation, *args, **kwargs)
+
+    def executemany(self, operation, *args, **kwargs):
+        self._statement = statement_kind(operation)
+        return self._timed(self._database.query_seconds, "db-query", self._cursor.executemany,
+                           operation, *args, **kwargs)
+
+    def fetchone(self):
+        return self._timed(self._database.fetch_seconds, "db-fetch", self._cursor.fetchone)
+
+    def fetchmany(self, *args, **kwargs):
+        return self._timed(self._database.fetch_seconds, "db-fetch", self._cursor.fetchmany, *args, **kwargs)
+
+    def fetchall(self):
+        return self._timed(self._database.fetch_seconds, "db-fetch", self._cursor.fetchall)
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+class TimedConnection:
+    """Conexión MySQL cuyos cursores quedan instrumentados."""
+
+    def __init__(self, connection, database: "MySQLDatabase"):
+        self._connection = connection
+        self._database = database
+
+    def cursor(self, *args, **kwargs):
+        return TimedCursor(self._connection.cursor(*args, **kwargs), self._database)
+
+    def __getattr__(self, name):
+        return getattr(self._connection, name)
+
+class MySQLDatabase:
+    """Abre conexiones con reintentos; las métricas van al registro del servicio."""
+
+    def __init__(self, registry: MetricsRegistry, database: str, **options):
+        self.params = {"host": "db", "user": "root", "password": "12345", "database": database, **options}
+        self.connect_seconds = registry.histogram("mysql_connect_seconds", "Tiempo en abrir una conexión MySQL")
+        self.connect_errors = registry.counter("mysql_connect_errors_total", "Intentos de conexión MySQL fallidos")
+        self.query_seconds = registry.histogram(
+            "mysql_query_seconds", "Tiempo de execute por tipo de sentencia", ("statement",))
+        self.fetch_seconds = registry.histogram(
+            "mysql_fetch_seconds", "Tiempo leyendo filas por tipo de sentencia", ("statement",))
+
+    def connect(self, attempts: int = 20) -> TimedConnection:
+        # El span db-connect incluye las esperas entre reintentos
+        connect_started = time.perf_counter()
+        for attempt in range(attempts):
+            try:
+                start_time = time.perf_counter()
+                connection = mysql.connector.connect(**self.params)
+                self.connect_seconds.observe(time.perf_counter() - start_time)
+                record_span("db-connect", time.perf_counter() - connect_started,
+                            f"attempts={attempt + 1}" if attempt else None)
+                return TimedConnection(connection, self)
+            except mysql.connector.Error as e:
+                self.connect_errors.inc()
+                logging.getLogger(__name__).warning("Intento %s fallido: %s, esperando...", attempt+1, e)
+                if attempt + 1 < attempts:
+                    time.sleep(3)
+        record_span("db-connect", time.perf_counter() - connect_started, "failed")
+        raise Exception("No se pudo conectar a la base de datos.")
@@ -0,0 +1,148 @@
+# backend/common/revocation.py - LISTA DE TOKENS REVOCADOS (TABLA revoked_tokens)
+#
+# auth-service escribe las revocaciones (logout, rotación de refresh tokens); el API Gateway
+# lee la misma tabla para rechazar los tokens de acceso revocados antes de su expiración.
+
+import hashlib
+import logging
+import math
+import threading
+import time
+from datetime import datetime
+from typing import Callable
+
+from common.observability import MetricsRegistry
+
+logger = logging.getLogger(__name__)
+
+class BloomFilter:
+    """Filtro de Bloom sobre un bytearray: "no está" es seguro, "puede estar" hay que confirmarlo."""
+
+    def __init__(self, capacity: int, fp_rate: float):
+        self.size = max(64, int(-capacity * math.log(fp_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def positions(self, item: str):
+        # Doble hashing: k posiciones a partir de un solo digest
+        digest = hashlib.blake2b(item.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hashes)]
+
+    def add(self, item: str):
+        for position in self.positions(item):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, item: str) -> bool:
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self.positions(item))
+
+class RevocationList:
+    """jti revocados: filtro de Bloom en memoria respaldado por la tabla revoked_tokens.
+
+    Casi todos los tokens no están revocados y se resuelven sin tocar MySQL; un positivo
+    del filtro (revocado o falso positivo) se confirma con una consulta por clave única.
+    Los jti ya confirmados quedan en memoria hasta la próxima reconstrucción del filtro.
+    """
+
+    def __init__(self, registry: MetricsRegistry, connect: Callable, capacity: int, fp_rate: float):
+        self.connect = connect
+        self.capacity = capacity
+        self.fp_rate = fp_rate
+        self.filter = BloomFilter(capacity, fp_rate)
+        self.confirmed: set[str] = set()
+        self.last_id = 0
+        self.rebuilt_at = 0.0
+        self.lock = threading.Lock()
+        self.checks = registry.counter(
+            "revocation_checks_total", "Consultas a la lista de revocación por resultado", ("result",))
+
+    def purge_expired(self):
+        conn = self.connect()
+        cursor = conn.cursor()
+        cursor.execute("DELETE FROM revoked_tokens WHERE expires_at < UTC_TIMESTAMP()")
+        conn.commit()
+        cursor.close()
+        conn.close()
+
+    def load(self, full: bool = False):
+        # Incremental: solo las filas nuevas (otras réplicas); completa: rehace el filtro
+        conn = self.connect()
+        cursor = conn.cursor()
+        cursor.execute("SELECT id, jti FROM revoked_tokens WHERE id > %s ORDER BY id",
+                       (0 if full else self.last_id,))
+        rows = cursor.fetchall()
+        cursor.close()
+        conn.close()
+
+        with self.lock:
+            if full:
+                self.filter = BloomFilter(self.capacity, self.fp_rate)
+                self.confirmed = set()
+                self.rebuilt_at = time.monotonic()
+            for row_id, jti in rows:
+                self.filter.add(jti)
+                self.last_id = max(self.last_id, row_id)
+        if self.filter.count > self.capacity:
+            logger.warning("🚫 Lista de revocación sobre su capacidad (%s), suben los falsos positivos",
+                           self.filter.count)
+
+    def revoke(self, jti: str, expires_at: datetime) -> bool:
+        """Revoca el jti; devuelve False si ya estaba revocado.
+
+        La clave única de jti hace del INSERT la comprobación atómica: de dos peticiones
+        concurrentes con el mismo token solo una inserta la fila.
+        """
+        conn = self.connect()
+        cursor = conn.cursor()
+        cursor.execute("INSERT IGNORE INTO revoked_tokens (jti, expires_at) VALUES (%s, %s)", (jti, expires_at))
+        inserted = cursor.rowcount == 1
+        conn.commit()
+        cursor.close()
+        conn.close()
+        self.add(jti)
+        return inserted
+
+    def add(self, jti: str):
+        """Marca el jti en el filtro sin escribir la tabla (otro proceso ya lo revocó)."""
+        with self.lock:
+            self.filter.add(jti)
+
+    def might_be_revoked(self, jti: str) -> bool:
+        """Solo memoria: False es definitivo, True hay que confirmarlo con confirm()."""
+        with self.lock:
+            maybe = jti in self.filter
+        if not maybe:
+            self.checks.inc("negative")
+        return maybe
+
+    def confirm(self, jti: str) -> bool:
+        if jti in self.confirmed:
+            self.checks.inc("revoked")
+            return True
+        conn = self.connect()
+        cursor = conn.cursor()
+        cursor.execute("SELECT 1 FROM revoked_tokens WHERE jti = %s", (jti,))
+        revoked = cursor.fetchone() is not None
+        cursor.close()
+        conn.close()
+        if revoked:
+            with self.lock:
+                self.confirmed.add(jti)
+        self.checks.inc("revoked" if revoked else "false_positive")
+        return revoked
+
+    def is_revoked(self, jti: str) -> bool:
+        return self.might_be_revoked(jti) and self.confirm(jti)
+
+    def snapshot(self) -> dict:
+        return {
+            "entries": self.filter.count,
+            "capacity": self.capacity,
+            "bits": self.filter.size,
+            "hashes": self.filter.hashes,
+            "confirmed": len(self.confirmed),
+            "last_id": self.last_id
+        }
@@ -1,16 +1,31 @@
 # backend/payment-service/main.py - CON TABLA PAYMENTS COMO ENTIDAD
 
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Depends, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel, EmailStr, Field
-import mysql.connector
-import time
+import json
+import sys
+import os
 import uuid
 import random
 from datetime import datetime, timedelta
 from typing import Optional
 
-app = FastAPI(title="Payment Mock Service", version="1.1")
+# El módulo compartido vive en backend/common (en Docker se copia a /app/common)
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.observability import (
+    MetricsRegistry, MySQLDatabase, TimedJSONResponse, instrument_service, setup_logging
+)
+
+# ================================
+# LOGGING, MÉTRICAS Y TRAZAS
+# ================================
+
+SERVICE_NAME = "payment-service"
+logger = setup_logging(SERVICE_NAME)
+metrics_registry = MetricsRegistry()
+
+app = FastAPI(title="Payment Mock Service", version="1.1", default_response_class=TimedJSONResponse)
 
 app.add_middleware(
     CORSMiddleware,
@@ -20,6 +35,8 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+instrument_service(app, metrics_registry)
+
 # Modelos Pydantic (SIN CAMBIOS)
 class PaymentRequest(BaseModel):
     user_email: EmailStr
@@ -43,19 +60,35 @@ class RefundRequest(BaseModel):
     payment_id: str
     reason: Optional[str] = None
 
-def get_connection():
-    for attempt in range(20):
-        try:
-            return mysql.connector.connect(
-                host="db",
-                user="root",
-                password="12345",
-                database="users_db"
-            )
-        except mysql.connector.Error:
-            print(f"[payment-service] Intento {attempt+1} fallido, esperando...")
-            time.sleep(3)
-    raise Exception("No se pudo conectar a la base de datos.")
+database = MySQLDatabase(metrics_registry, "users_db")
+get_connection = database.connect
+
+# ================================
+# IDENTIDAD VERIFICADA POR EL GATEWAY
+# ================================
+
+# El API Gateway verifica el JWT y reenvía el "sub" en este header de confianza
+IDENTITY_HEADER = os.getenv("IDENTITY_HEADER", "X-User-Email")
+
+def get_identity(request: Request) -> Optional[str]:
+    """Email verificado por el gateway, o None si la petición no trae token."""
+    return request.headers.get(IDENTITY_HEADER)
+
+def check_scope(identity: Optional[str], email: str):
+    """Impide que un usuario autenticado consulte o modifique datos de otro usuario."""
+    if identity and identity.lower() != str(email).lower():
+        raise HTTPException(status_code=403, detail="No autorizado para acceder a datos de otro usuario")
+
+# ================================
+# EVENTOS PARA EL CANAL PUSH
+# ================================
+
+# El gateway lee este header, lo quita de la respuesta y reenvía los eventos por SSE
+PUSH_EVENT_HEADER = "X-Push-Event"
+
+def attach_push_events(response: Response, *events: dict):
+    response.headers[PUSH_EVENT_HEADER] = json.dumps(list(events), ensure_ascii=True, default=str,
+                                                     separators=(",", ":"))
 
 @app.on_event("startup")
 def create_payments_table():
@@ -87,7 +120,7 @@ def create_payments_table():
     conn.commit()
     cursor.close()
     conn.close()
-    print("[payment-service] Tabla payments verificada/creada")
+    logger.info("Tabla payments verificada/creada")
 
 def validate_booking(user_email: str, workshop_id: int):
     conn = get_connection()
@@ -147,10 +180,10 @@ def save_payment_to_database(payment_data: dict):
         ))
         
         conn.commit()
-        print(f"[payment-service] Pago guardado en BD: {payment_data['payment_id']}")
+        logger.info("Pago guardado en BD: %s", payment_data['payment_id'])
         
     except Exception as e:
-        print(f"[payment-service]  Error guardando pago: {e}")
+        logger.error("Error guardando pago: %s", e)
         # No lanzamos excepción para no afectar la respuesta al usuario
     finally:
         cursor.close()
@@ -176,9 +209,11 @@ async def hello_world():
     return {"message": "Hello World - Payment Mock Service"}
 
 @app.post("/process", response_model=PaymentResponse, summary="Procesar pago de reserva")
-async def process_payment(payment_request: PaymentRequest):
+async def process_payment(payment_request: PaymentRequest, http_response: Response,
+                          identity: Optional[str] = Depends(get_identity)):
+    check_scope(identity, payment_request.user_email)
     try:
-        print(f"[payment-service] Procesando pago: {payment_request.user_email} -> taller {payment_request.workshop_id}")
+        logger.info("Procesando pago: %s -> taller %s", payment_request.user_email, payment_request.workshop_id)
         
         # Validar que existe la reserva (SIN CAMBIOS)
         booking = validate_booking(payment_request.user_email, payment_request.workshop_id)
@@ -250,19 +285,26 @@ async def process_payment(payment_request: PaymentRequest):
             message=message
         )
         
-        print(f"[payment-service] Pago procesado: {payment_status} - {payment_id}")
+        logger.info("Pago procesado: %s - %s", payment_status, payment_id)
+        attach_push_events(http_response, {
+            "type": "payment.status_changed",
+            "user_email": payment_request.user_email,
+            "workshop_id": payment_request.workshop_id,
+            "payment_id": payment_id,
+            "status": payment_status
+        })
         return response
         
     except HTTPException:
         raise
     except Exception as e:
-        print(f"[payment-service] Error procesando pago: {e}")
+        logger.error("Error procesando pago: %s", e)
         raise HTTPException(status_code=500, detail="Error interno del servidor")
 
 @app.get("/status/{payment_id}", summary="Consultar estado de pago")
 async def get_payment_status(payment_id: str):
     try:
-        print(f"[payment-service] Consultando estado de pago: {payment_id}")
+        logger.info("Consultando estado de pago: %s", payment_id)
         
         #  MEJORADO: Intentar buscar en la tabla payments primero
         conn = get_connection()
@@ -283,7 +325,7 @@ async def get_payment_status(payment_id: str):
                     "workshop_id": payment['id_workshop']
                 }
         except Exception as db_error:
-            print(f"[payment-service] Error consultando BD: {db_error}")
+            logger.error("Error consultando BD: %s", db_error)
         finally:
             cursor.close()
             conn.close()
@@ -314,13 +356,13 @@ async def get_payment_status(payment_id: str):
     except HTTPException:
         raise
     except Exception as e:
-        print(f"[payment-service] Error consultando estado: {e}")
+        logger.error("Error consultando estado: %s", e)
         raise HTTPException(status_code=500, detail="Error interno del servidor")
 
 @app.post("/refund", summary="Procesar reembolso")
 async def process_refund(refund_request: RefundRequest):
     try:
-        print(f"[payment-service] Procesando reembolso: {refund_request.payment_id}")
+        logger.info("Procesando reembolso: %s", refund_request.payment_id)
         
         refund_id = str(uuid.uuid4())
         
@@ -341,7 +383,7 @@ async def process_refund(refund_request: RefundRequest):
         }
         
     except Exception as e:
-        print(f"[payment-service] Error en reembolso: {e}")
+        logger.error("Error en reembolso: %s", e)
         raise HTTPException(status_code=500, detail="Error interno del servidor")
 
 @app.get("/methods", summary="Obtener métodos de pago disponibles")
@@ -399,10 +441,11 @@ async def validate_card(card_data: dict):
     }
 
 @app.get("/history/{user_email}", summary="Obtener historial de pagos")
-async def get_payment_history(user_email: EmailStr):
+async def get_payment_history(user_email: EmailStr, identity: Optional[str] = Depends(get_identity)):
     """ MEJORADO: Usar datos reales de la tabla payments"""
+    check_scope(identity, user_email)
     try:
-        print(f"[payment-service] Obteniendo historial de: {user_email}")
+        logger.info("Obteniendo historial de: %s", user_email)
         
         conn = get_connection()
         cursor = conn.cursor(dictionary=True)
@@ -458,11 +501,13 @@ async def get_payment_history(user_email: EmailStr):
         }
         
     except Exception as e:
-        print(f"[payment-service] Error obteniendo historial: {e}")
+        logger.error("Error obteniendo historial: %s", e)
         raise HTTPException(status_code=500, detail="Error interno del servidor")
 
 @app.get("/booking/{user_email}/{workshop_id}", summary="Verificar estado de pago de reserva")
-async def get_booking_payment_status(user_email: EmailStr, workshop_id: int):
+async def get_booking_payment_status(user_email: EmailStr, workshop_id: int,
+                                     identity: Optional[str] = Depends(get_identity)):
+    check_scope(identity, user_email)
     try:
         booking = validate_booking(user_email, workshop_id)
         if not booking:
@@ -480,12 +525,13 @@ async def get_booking_payment_status(user_email: EmailStr, workshop_id: int):
     except HTTPException:
         raise
     except Exception as e:
-        print(f"[payment-service] Error verificando estado: {e}")
+        logger.error("Error verificando estado: %s", e)
         raise HTTPException(status_code=500, detail="Error interno del servidor")
 
 
 @app.get("/stats/{user_email}", summary="Estadísticas de pagos del usuario")
-async def get_payment_stats(user_email: EmailStr):
+async def get_payment_stats(user_email: EmailStr, identity: Optional[str] = Depends(get_identity)):
+    check_scope(identity, user_email)
     try:
         conn = get_connection()
         cursor = conn.cursor(dictionary=True)
@@ -523,13 +569,14 @@ async def get_payment_stats(user_email: EmailStr):
         }
         
     except Exception as e:
-        print(f"[payment-service] Error obteniendo estadísticas: {e}")
+        logger.error("Error obteniendo estadísticas: %s", e)
         raise HTTPException(status_code=500, detail="Error interno del servidor")
 
 @app.get("/health")
 def health():
     try:
-        conn = get_connection()
+        # Un solo intento: el health check no debe quedarse esperando reintentos
+        conn = get_connection(attempts=1)
         cursor = conn.cursor()
         cursor.execute("SELECT 1")
         cursor.fetchone()
@@ -4,11 +4,25 @@ from fastapi import FastAPI, HTTPException, Query
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel, Field, validator
 from typing import Optional, List
-import mysql.connector
-import time
+import os
+import sys
 from datetime import date, datetime
 
-app = FastAPI(title="Workshops Service", version="1.3")
+# El módulo compartido vive en backend/common (en Docker se copia a /app/common)
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.observability import (
+    MetricsRegistry, MySQLDatabase, TimedJSONResponse, instrument_service, sample_debug, setup_logging
+)
+
+# ================================
+# LOGGING, MÉTRICAS Y TRAZAS
+# ================================
+
+SERVICE_NAME = "workshops-service"
+logger = setup_logging(SERVICE_NAME)
+metrics_registry = MetricsRegistry()
+
+app = FastAPI(title="Workshops Service", version="1.3", default_response_class=TimedJSONResponse)
 
 app.add_middleware(
     CORSMiddleware,
@@ -18,6 +32,8 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+instrument_service(app, metrics_registry)
+
 class WorkshopCreate(BaseModel):
     title: str = Field(..., min_length=4, max_length=100)
     description: str
@@ -42,24 +58,15 @@ class Workshop(BaseModel):
     current_participants: int
     price: float
 
-def get_connection():
-    for attempt in range(20):
-        try:
-            # 🔧 CONEXIÓN CON UTF-8 CORREGIDO
-            return mysql.connector.connect(
-                host="db",
-                user="root",
-                password="12345",
-                database="users_db",
-                charset='utf8mb4',           #  CHARSET UTF-8
-                collation='utf8mb4_unicode_ci',  #  COLLATION UNICODE
-                use_unicode=True,            #  USAR UNICODE
-                autocommit=True              #  AUTOCOMMIT PARA CONSISTENCIA
-            )
-        except mysql.connector.Error:
-            print(f"[workshops-service] Intento {attempt+1} fallido, esperando...")
-            time.sleep(3)
-    raise Exception("No se pudo conectar a la base de datos.")
+database = MySQLDatabase(
+    metrics_registry, "users_db",
+    # 🔧 CONEXIÓN CON UTF-8 CORREGIDO
+    charset='utf8mb4',               #  CHARSET UTF-8
+    collation='utf8mb4_unicode_ci',  #  COLLATION UNICODE
+    use_unicode=True,                #  USAR UNICODE
+    autocommit=True                  #  AUTOCOMMIT PARA CONSISTENCIA
+)
+get_connection = database.connect
 
 @app.on_event("startup")
 def create_table():
@@ -90,12 +97,12 @@ def create_table():
     conn.commit()
     cursor.close()
     conn.close()
-    print("[workshops-service] Tabla 'workshops' verificada/creada con UTF-8")
+    logger.info("Tabla 'workshops' verificada/creada con UTF-8")
 
 @app.post("/", summary="Registrar un nuevo taller", response_model=Workshop)
 def crear_taller(data: WorkshopCreate):
     try:
-        print(f"[workshops-service] Creando taller: {data.title}")
+        logger.info("Creando taller: %s", data.title)
         conn = get_connection()
         cursor = conn.cursor(dictionary=True)
 
@@ -120,19 +127,19 @@ def crear_taller(data: WorkshopCreate):
         cursor.close()
         conn.close()
 
-        print(f"[workshops-service] Taller creado exitosamente: ID {taller['id']}")
+        logger.info("Taller creado exitosamente: ID %s", taller['id'])
         return taller
         
     except HTTPException:
         raise
     except Exception as e:
-        print(f"[workshops-service] Error creando taller: {e}")
+        logger.error("Error creando taller: %s", e)
         raise HTTPException(status_code=500, detail="Error interno del servidor")
 
 @app.get("/", response_model=List[Workshop], summary="Listar todos los talleres disponibles")
 def listar_talleres():
     try:
-        print("[workshops-service] Obteniendo lista de talleres")
+        logger.info("Obteniendo lista de talleres")
         conn = get_connection()
         cursor = conn.cursor(dictionary=True)
         
@@ -152,18 +159,19 @@ def listar_talleres():
         if not talleres:
             raise HTTPException(status_code=404, detail="No hay talleres disponibles")
         
-        print(f"[workshops-service] Encontrados {len(talleres)} talleres disponibles")
+        logger.info("Encontrados %s talleres disponibles", len(talleres))
         
-        # 🔧 LOG PARA VERIFICAR ENCODING
-        for taller in talleres[:2]:  # Solo los primeros 2 para debug
-            print(f"[UTF-8 CHECK] Taller: {taller['title']} - Categoría: {taller['category']}")
+        # 🔧 LOG PARA VERIFICAR ENCODING (muestreado, solo en nivel DEBUG)
+        if sample_debug():
+            for taller in talleres[:2]:  # Solo los primeros 2 para debug
+                logger.debug("UTF-8 check - Taller: %s - Categoría: %s", taller['title'], taller['category'])
         
         return talleres
         
     except HTTPException:
         raise
     except Exception as e:
-        print(f"[workshops-service] Error obteniendo talleres: {e}")
+        logger.error("Error obteniendo talleres: %s", e)
         raise HTTPException(status_code=500, detail="Error interno del servidor")
 
 @app.get("/buscar", response_model=List[Workshop], summary="Buscar talleres por categoría o palabra clave")
@@ -172,7 +180,7 @@ def buscar_talleres(
     palabra: Optional[str] = Query(None)
 ):
     try:
-        print(f"[workshops-service] Búsqueda - Categoría: {categoria}, Palabra: {palabra}")
+        logger.info("Búsqueda - Categoría: %s, Palabra: %s", categoria, palabra)
         conn = get_connection()
         cursor = conn.cursor(dictionary=True)
 
@@ -204,19 +212,20 @@ def buscar_talleres(
         if not resultados:
             raise HTTPException(status_code=404, detail="No se encontraron talleres con los filtros especificados")
 
-        print(f"[workshops-service] Búsqueda completada: {len(resultados)} resultados")
+        logger.info("Búsqueda completada: %s resultados", len(resultados))
         return resultados
         
     except HTTPException:
         raise
     except Exception as e:
-        print(f"[workshops-service] Error en búsqueda: {e}")
+        logger.error("Error en búsqueda: %s", e)
         raise HTTPException(status_code=500, detail="Error interno del servidor")
 
 @app.get("/health", summary="Verifica si el microservicio está activo")
 def health():
     try:
-        conn = get_connection()
+        # Un solo intento: el health check no debe quedarse esperando reintentos
+        conn = get_connection(attempts=1)
         cursor = conn.cursor()
         cursor.execute("SET NAMES utf8mb4")
         cursor.execute("SELECT 1")
@@ -1,7 +1,7 @@
 // frontend/src/context/BookingsContext.tsx - VERSIÓN MEJORADA CON API REAL
 import React, { createContext, useContext, useState, useEffect, useCallback } from 'react';
 import { Booking, Workshop } from '../types';
-import { bookingService, workshopsService } from '../services/api';
+import { bookingService, dashboardService, eventsService } from '../services/api';
 import { useAuth } from './AuthContext';
 
 interface BookingWithWorkshop extends Booking {
@@ -37,7 +37,6 @@ export const BookingsProvider: React.FC<BookingsProviderProps> = ({ children })
   const [bookings, setBookings] = useState<BookingWithWorkshop[]>([]);
   const [loading, setLoading] = useState(false);
   const [error, setError] = useState<string | null>(null);
-  const [workshops, setWorkshops] = useState<Workshop[]>([]);
   const [isOnline, setIsOnline] = useState(navigator.onLine);
 
   // ====================================================
@@ -73,23 +72,8 @@ export const BookingsProvider: React.FC<BookingsProviderProps> = ({ children })
   // FUNCIONES DE CARGA DE DATOS
   // ====================================================
 
-  // Cargar talleres disponibles (para combinar con reservas)
-  const loadWorkshops = useCallback(async (): Promise<Workshop[]> => {
-    try {
-      console.log('🔄 [BOOKINGS_CONTEXT] Cargando talleres...');
-      const workshopsData = await workshopsService.getAllWorkshops();
-      setWorkshops(workshopsData);
-      console.log(`✅ [BOOKINGS_CONTEXT] ${workshopsData.length} talleres cargados`);
-      return workshopsData;
-    } catch (error: any) {
-      console.error('❌ [BOOKINGS_CONTEXT] Error cargando talleres:', error);
-      // No es crítico si fallan los talleres, las reservas pueden mostrarse sin detalles completos
-      return workshops; // Retornar talleres existentes
-    }
-  }, [workshops]);
-
   // Cargar reservas del usuario con manejo robusto de errores
-  const loadBookings = useCallback(async (workshopsData?: Workshop[]) => {
+  const loadBookings = useCallback(async () => {
     if (!user?.email) {
       console.log('ℹ️ [BOOKINGS_CONTEXT] No hay usuario autenticado');
       setBookings([]);
@@ -103,20 +87,16 @@ export const BookingsProvider: React.FC<BookingsProviderProps> = ({ children })
       
       console.log('🔄 [BOOKINGS_CONTEXT] Cargando reservas para:', user.email);
       
-      // Usar talleres pasados como parámetro o los existentes
-      const currentWorkshops = workshopsData || workshops;
-      
-      // Cargar reservas del usuario
-      const userBookings = await bookingService.getUserBookings(user.email);
-      
-      // Combinar reservas con información de talleres
-      const bookingsWithWorkshops = userBookings.map(booking => {
-        const workshop = currentWorkshops.find(w => w.id === booking.workshop_id);
-        return {
-          ...booking,
-          workshop
-        };
-      });
+      // ✅ Una sola llamada al dashboard del gateway: las reservas ya vienen unidas a su
+      // taller, sin descargar el catálogo completo
+      const dashboard = await dashboardService.getDashboard(user.email);
+      if (dashboard.bookings === null) {
+        throw new Error(dashboard.errors.bookings || 'Error al obtener reservas');
+      }
+      const bookingsWithWorkshops: BookingWithWorkshop[] = dashboard.bookings.map(booking => ({
+        ...booking,
+        workshop: booking.workshop || undefined
+      }));
 
       setBookings(bookingsWithWorkshops);
       console.log(`✅ [BOOKINGS_CONTEXT] ${bookingsWithWorkshops.length} reservas cargadas`);
@@ -140,7 +120,7 @@ export const BookingsProvider: React.FC<BookingsProviderProps> = ({ children })
     } finally {
       setLoading(false);
     }
-  }, [user?.email, workshops]);
+  }, [user?.email]);
 
   // ====================================================
   // FUNCIONES PÚBLICAS
@@ -151,20 +131,12 @@ export const BookingsProvider: React.FC<BookingsProviderProps> = ({ children })
     console.log('🔄 [BOOKINGS_CONTEXT] Refrescando reservas...');
     
     try {
-      // Cargar talleres primero si no están cargados o hay pocos
-      let currentWorkshops = workshops;
-      if (workshops.length === 0) {
-        currentWorkshops = await loadWorkshops();
-      }
-      
-      // Cargar reservas con los talleres actualizados
-      await loadBookings(currentWorkshops);
-      
+      await loadBookings();
     } catch (error: any) {
       console.error('❌ [BOOKINGS_CONTEXT] Error en refresh:', error);
       setError('Error al refrescar datos. Intenta nuevamente.');
     }
-  }, [loadBookings, loadWorkshops, workshops]);
+  }, [loadBookings]);
 
   // Cancelar reserva con la API real
   const cancelBooking = useCallback(async (bookingId: number, reason?: string): Promise<boolean> => {
@@ -223,11 +195,10 @@ export const BookingsProvider: React.FC<BookingsProviderProps> = ({ children })
   // Cargar datos iniciales
   useEffect(() => {
     if (user?.email) {
-      // Cargar talleres y reservas en paralelo al montar
+      // Cargar reservas (con sus talleres) al montar
       const initializeData = async () => {
         try {
-          const workshopsData = await loadWorkshops();
-          await loadBookings(workshopsData);
+          await loadBookings();
         } catch (error) {
           console.error('❌ [BOOKINGS_CONTEXT] Error en inicialización:', error);
         }
@@ -237,22 +208,22 @@ export const BookingsProvider: React.FC<BookingsProviderProps> = ({ children })
     } else {
       // Limpiar estado si no hay usuario
       setBookings([]);
-      setWorkshops([]);
       setError(null);
       setLoading(false);
     }
   }, [user?.email]); // Solo depender del email del usuario
 
-  // Auto-refresh periódico (cada 5 minutos si hay usuario activo)
+  // ✅ Actualización por eventos del gateway (reemplaza el auto-refresh cada 5 minutos)
   useEffect(() => {
     if (!user?.email || !isOnline) return;
 
-    const intervalId = setInterval(() => {
-      console.log('⏰ [BOOKINGS_CONTEXT] Auto-refresh periódico');
-      refreshBookings();
-    }, 5 * 60 * 1000); // 5 minutos
-
-    return () => clearInterval(intervalId);
+    return eventsService.subscribe((event) => {
+      if (event.type === 'booking.created' || event.type === 'booking.cancelled' ||
+          event.type === 'payment.status_changed' || event.type === 'channel.resync') {
+        console.log('📡 [BOOKINGS_CONTEXT] Evento recibido:', event.type);
+        refreshBookings();
+      }
+    });
   }, [user?.email, isOnline, refreshBookings]);
 
   // ====================================================
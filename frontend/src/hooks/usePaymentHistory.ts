@@ -1,6 +1,6 @@
 // frontend/src/hooks/usePaymentHistory.ts - HOOK PARA MANEJO DE HISTORIAL DE PAGOS
 import { useState, useCallback, useEffect } from 'react';
-import { paymentService } from '../services/api';
+import { paymentService, eventsService } from '../services/api';
 import { useAuth } from '../context/AuthContext';
 import React from 'react';
 
@@ -262,17 +262,17 @@ export const usePaymentHistory = (): UsePaymentHistoryReturn => {
     }
   }, [user?.email, loadPaymentHistory]);
 
-  // Auto-refresh cada 10 minutos si hay usuario activo
+  // ✅ Refrescar cuando el gateway avisa un cambio de pago (reemplaza el auto-refresh cada 10 minutos)
   useEffect(() => {
-    if (!user?.email || !historyData) return;
+    if (!user?.email) return;
 
-    const intervalId = setInterval(() => {
-      console.log('⏰ [USE_PAYMENT_HISTORY] Auto-refresh periódico');
-      refreshHistory();
-    }, 10 * 60 * 1000); // 10 minutos
-
-    return () => clearInterval(intervalId);
-  }, [user?.email, historyData, refreshHistory]);
+    return eventsService.subscribe((event) => {
+      if (event.type === 'payment.status_changed' || event.type === 'channel.resync') {
+        console.log('📡 [USE_PAYMENT_HISTORY] Evento de pago recibido');
+        refreshHistory();
+      }
+    });
+  }, [user?.email, refreshHistory]);
 
   // Limpiar error automáticamente después de 15 segundos
   useEffect(() => {
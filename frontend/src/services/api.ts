@@ -11,7 +11,10 @@ import {
   Booking,
   BookingRequest,
   PaymentRequest,
-  PaymentResponse 
+  PaymentResponse,
+  DashboardData,
+  PushEvent,
+  PushEventType
 } from '../types';
 
 // ✅ CORRECTO: Puerto 5004 del API Gateway
@@ -34,10 +37,56 @@ api.interceptors.request.use((config) => {
   return config;
 });
 
+function tokenExpired(token: string): boolean {
+  try {
+    const payload = JSON.parse(atob(token.split('.')[1].replace(/-/g, '+').replace(/_/g, '/')));
+    return typeof payload.exp === 'number' && payload.exp * 1000 <= Date.now();
+  } catch {
+    return false;
+  }
+}
+
+// Renovación del token de acceso con el refresh token (una sola a la vez para todas las requests)
+let refreshInFlight: Promise<string | null> | null = null;
+
+function refreshAccessToken(): Promise<string | null> {
+  const refreshToken = localStorage.getItem('refreshToken');
+  if (!refreshToken) {
+    return Promise.resolve(null);
+  }
+  if (!refreshInFlight) {
+    // El token de acceso anterior, si no venció, queda revocado junto con el refresh token
+    const previousToken = localStorage.getItem('authToken');
+    const revokePrevious = previousToken && !tokenExpired(previousToken);
+    refreshInFlight = axios
+      .post<AuthResponse>(
+        `${API_BASE_URL}/api/v0/auth/refresh`,
+        { refresh_token: refreshToken },
+        revokePrevious ? { headers: { Authorization: `Bearer ${previousToken}` } } : undefined
+      )
+      .then((response) => {
+        localStorage.setItem('authToken', response.data.access_token);
+        if (response.data.refresh_token) {
+          localStorage.setItem('refreshToken', response.data.refresh_token);
+        }
+        console.log('🔄 [API] Token de acceso renovado');
+        return response.data.access_token;
+      })
+      .catch(() => {
+        localStorage.removeItem('refreshToken');
+        return null;
+      })
+      .finally(() => {
+        refreshInFlight = null;
+      });
+  }
+  return refreshInFlight;
+}
+
 // ✅ INTERCEPTOR MEJORADO: No redirigir durante login/register
 api.interceptors.response.use(
   (response) => response,
-  (error) => {
+  async (error) => {
     // Log para debugging
     console.error('API Error:', {
       url: error.config?.url,
@@ -53,10 +102,31 @@ api.interceptors.response.use(
                              error.config?.url?.includes('/auth/register') ||
                              error.config?.url?.includes('/auth/profile');
       
+      // Token vencido: se renueva una vez con el refresh token y se repite la request
+      const canRefresh = !error.config?.url?.includes('/auth/login') &&
+                         !error.config?.url?.includes('/auth/register');
+      if (canRefresh && error.config && !error.config._retried) {
+        // Otra request ya renovó el token mientras esta viajaba: se repite sin volver a renovar
+        // (un segundo refresh revocaría el token recién emitido)
+        const sentToken = String(error.config.headers?.Authorization ?? '').replace(/^Bearer /, '');
+        const currentToken = localStorage.getItem('authToken');
+        if (sentToken && currentToken && sentToken !== currentToken) {
+          error.config._retried = true;
+          return api(error.config);
+        }
+        const newToken = await refreshAccessToken();
+        if (newToken) {
+          error.config._retried = true;
+          error.config.headers.Authorization = `Bearer ${newToken}`;
+          return api(error.config);
+        }
+      }
+
       if (!isAuthOperation) {
         // Solo limpiar y redirigir si no es login/register
         console.log('🔒 [API] Token inválido en operación protegida, limpiando sesión...');
         localStorage.removeItem('authToken');
+        localStorage.removeItem('refreshToken');
         localStorage.removeItem('user');
         
         // Solo redirigir si no estamos ya en login/register
@@ -75,6 +145,34 @@ api.interceptors.response.use(
   }
 );
 
+// crypto.randomUUID solo existe en contextos seguros (HTTPS o localhost); por HTTP en una IP
+// de la red local se arma un UUID v4 con getRandomValues
+function newIdempotencyKey(): string {
+  if (typeof crypto.randomUUID === 'function') {
+    return crypto.randomUUID();
+  }
+  const bytes = crypto.getRandomValues(new Uint8Array(16));
+  bytes[6] = (bytes[6] & 0x0f) | 0x40;
+  bytes[8] = (bytes[8] & 0x3f) | 0x80;
+  const hex = Array.from(bytes, (byte) => byte.toString(16).padStart(2, '0')).join('');
+  return `${hex.slice(0, 8)}-${hex.slice(8, 12)}-${hex.slice(12, 16)}-${hex.slice(16, 20)}-${hex.slice(20)}`;
+}
+
+// POST con Idempotency-Key: si se corta la red se reintenta una vez con la misma clave,
+// y el gateway devuelve la respuesta original en lugar de repetir la operación
+async function postIdempotent<T>(url: string, data: unknown): Promise<AxiosResponse<T>> {
+  const headers = { 'Idempotency-Key': newIdempotencyKey() };
+  try {
+    return await api.post<T>(url, data, { headers });
+  } catch (error: any) {
+    if (error.response) {
+      throw error;
+    }
+    console.log('🔁 [API] Reintentando con la misma Idempotency-Key:', url);
+    return api.post<T>(url, data, { headers });
+  }
+}
+
 // ================================
 // SERVICIOS DE AUTENTICACIÓN
 // ================================
@@ -131,6 +229,9 @@ export const authService = {
       );
       
       console.log('[API] Login exitoso:', { token_type: response.data.token_type });
+      if (response.data.refresh_token) {
+        localStorage.setItem('refreshToken', response.data.refresh_token);
+      }
       return response.data;
     } catch (error: any) {
       console.error('[API] Error en login:', error.response?.data);
@@ -172,7 +273,9 @@ export const authService = {
   // Logout
   async logout(): Promise<{ message: string }> {
     try {
-      const response: AxiosResponse = await api.post('/api/v0/auth/logout');
+      const refreshToken = localStorage.getItem('refreshToken');
+      localStorage.removeItem('refreshToken');
+      const response: AxiosResponse = await api.post('/api/v0/auth/logout', { refresh_token: refreshToken });
       console.log('[API] Logout exitoso');
       return response.data;
     } catch (error: any) {
@@ -258,7 +361,7 @@ export const bookingService = {
   async createBooking(data: BookingRequest): Promise<Booking> {
     try {
       console.log('[API] Creando reserva:', data);
-      const response: AxiosResponse<Booking> = await api.post('/api/v0/booking/reservar', data);
+      const response: AxiosResponse<Booking> = await postIdempotent<Booking>('/api/v0/booking/reservar', data);
       console.log('[API] Reserva creada:', response.data.id);
       return response.data;
     } catch (error: any) {
@@ -373,7 +476,7 @@ export const paymentService = {
   async processPayment(data: PaymentRequest): Promise<PaymentResponse> {
     try {
       console.log('[API] Procesando pago...');
-      const response: AxiosResponse<PaymentResponse> = await api.post('/api/v0/payment/process', data);
+      const response: AxiosResponse<PaymentResponse> = await postIdempotent<PaymentResponse>('/api/v0/payment/process', data);
       console.log('[API] Pago procesado:', response.data.status);
       return response.data;
     } catch (error: any) {
@@ -433,6 +536,164 @@ export const paymentService = {
   }
 };
 
+// ================================
+// SERVICIO DE DASHBOARD
+// ================================
+
+export const dashboardService = {
+  // ✅ NUEVO: Reservas con talleres, pagos y estadísticas en una sola llamada al gateway
+  async getDashboard(email: string): Promise<DashboardData> {
+    try {
+      console.log('[API] Obteniendo dashboard para:', email);
+      const response: AxiosResponse<DashboardData> = await api.get(`/api/v0/dashboard/${encodeURIComponent(email)}`);
+      if (response.data.partial) {
+        console.warn('[API] Dashboard parcial:', response.data.errors);
+      }
+      return response.data;
+    } catch (error: any) {
+      console.error('[API] Error al obtener dashboard:', error.response?.data);
+      const errorMessage = error.response?.data?.detail || error.message || 'Error al obtener dashboard';
+      throw new Error(errorMessage);
+    }
+  }
+};
+
+// ================================
+// CANAL PUSH (SERVER-SENT EVENTS)
+// ================================
+
+const PUSH_EVENT_TYPES: PushEventType[] = [
+  'booking.created',
+  'booking.cancelled',
+  'payment.status_changed',
+  'workshop.seats_changed'
+];
+
+// Mientras el canal está caído se pide una recarga lenta a los suscriptores
+const PUSH_FALLBACK_POLL_MS = 60000;
+const PUSH_RECONNECT_MS = 5000;
+
+type PushListener = (event: PushEvent) => void;
+const pushListeners = new Set<PushListener>();
+let pushSource: EventSource | null = null;
+let pushFallbackTimer: ReturnType<typeof setInterval> | null = null;
+let pushReconnectTimer: ReturnType<typeof setTimeout> | null = null;
+// Cada apertura lleva un número: una apertura que quedó vieja mientras pedía el ticket se descarta
+let pushGeneration = 0;
+let lastPushEventId = '';
+
+function notifyPush(event: PushEvent) {
+  pushListeners.forEach((notify) => notify(event));
+}
+
+function startPushFallback() {
+  if (pushFallbackTimer === null) {
+    pushFallbackTimer = setInterval(() => notifyPush({ type: 'channel.resync' }), PUSH_FALLBACK_POLL_MS);
+  }
+}
+
+function stopPushTimers() {
+  if (pushFallbackTimer !== null) {
+    clearInterval(pushFallbackTimer);
+    pushFallbackTimer = null;
+  }
+  if (pushReconnectTimer !== null) {
+    clearTimeout(pushReconnectTimer);
+    pushReconnectTimer = null;
+  }
+}
+
+function schedulePushReconnect() {
+  if (pushReconnectTimer === null) {
+    pushReconnectTimer = setTimeout(() => {
+      pushReconnectTimer = null;
+      reopenPushSource();
+    }, PUSH_RECONNECT_MS);
+  }
+}
+
+async function openPushSource() {
+  const generation = ++pushGeneration;
+  const params = new URLSearchParams();
+  if (localStorage.getItem('authToken')) {
+    // El JWT no va en la URL (quedaría en los access logs): se cambia por un ticket de un solo uso.
+    // La request pasa por el interceptor, que renueva el token si venció.
+    try {
+      const response = await api.post<{ ticket: string }>('/api/v0/events/ticket');
+      params.set('ticket', response.data.ticket);
+    } catch (error) {
+      if (generation === pushGeneration) {
+        console.warn('[API] No se pudo obtener el ticket del canal push, reintentando...');
+        startPushFallback();
+        schedulePushReconnect();
+      }
+      return;
+    }
+  }
+  if (generation !== pushGeneration) return;
+  if (lastPushEventId) params.set('last_event_id', lastPushEventId);
+
+  const source = new EventSource(`${API_BASE_URL}/api/v0/events/stream?${params}`);
+  const dispatch = (message: MessageEvent) => {
+    lastPushEventId = message.lastEventId || lastPushEventId;
+    try {
+      notifyPush(JSON.parse(message.data) as PushEvent);
+    } catch (error) {
+      console.error('[API] Evento push inválido:', error);
+    }
+  };
+  PUSH_EVENT_TYPES.forEach((type) => source.addEventListener(type, dispatch as EventListener));
+
+  source.onopen = () => {
+    if (pushFallbackTimer !== null) {
+      // Se volvió después de una caída: lo ocurrido entretanto puede no haberse reenviado
+      stopPushTimers();
+      notifyPush({ type: 'channel.resync' });
+    }
+  };
+  source.onerror = () => {
+    // La reconexión automática de EventSource repetiría la URL con el ticket ya usado:
+    // se cierra y se reabre con un ticket nuevo y el último id recibido
+    source.close();
+    startPushFallback();
+    if (pushSource === source) {
+      console.warn('[API] Canal push desconectado, reconectando...');
+      schedulePushReconnect();
+    }
+  };
+  pushSource = source;
+}
+
+function reopenPushSource() {
+  if (pushListeners.size === 0) return;
+  pushSource?.close();
+  pushSource = null;
+  openPushSource();
+}
+
+export const eventsService = {
+  // ✅ NUEVO: Una sola conexión SSE por pestaña compartida por todos los suscriptores.
+  // Si se corta se reabre con un ticket nuevo y el gateway reenvía lo perdido (last_event_id);
+  // mientras tanto se emite "channel.resync".
+  subscribe(listener: PushListener): () => void {
+    const first = pushListeners.size === 0;
+    pushListeners.add(listener);
+    if (first) {
+      openPushSource();
+    }
+
+    return () => {
+      pushListeners.delete(listener);
+      if (pushListeners.size === 0) {
+        pushGeneration++;
+        pushSource?.close();
+        pushSource = null;
+        stopPushTimers();
+      }
+    };
+  }
+};
+
 // ================================
 // SERVICIO GENERAL
 // ================================
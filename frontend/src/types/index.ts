@@ -19,6 +19,8 @@ export interface RegisterData {
 export interface AuthResponse {
   access_token: string;
   token_type: string;
+  refresh_token?: string;
+  expires_in?: number;
 }
 
 export interface AuthContextType {
@@ -70,6 +72,44 @@ export interface BookingWithWorkshop extends Booking {
   workshop?: Workshop;
 }
 
+// TIPO PARA EL DASHBOARD AGREGADO DEL GATEWAY
+export interface DashboardData {
+  user_email: string;
+  bookings: BookingWithWorkshop[] | null;
+  payments: any[] | null;
+  total_payments: number;
+  stats: {
+    user_email: string;
+    reservas_activas: number;
+    reservas_canceladas: number;
+    pagos_pendientes: number;
+    total_actividad: number;
+  } | null;
+  partial: boolean;
+  errors: Record<string, string>;
+  timestamp: string;
+}
+
+// EVENTOS DEL CANAL PUSH (SSE) DEL GATEWAY
+export type PushEventType =
+  | 'booking.created'
+  | 'booking.cancelled'
+  | 'payment.status_changed'
+  | 'workshop.seats_changed'
+  // Sintético (lo emite el cliente): el canal estuvo caído y conviene recargar
+  | 'channel.resync';
+
+export interface PushEvent {
+  type: PushEventType;
+  user_email?: string;
+  workshop_id?: number;
+  booking_id?: number;
+  payment_id?: string;
+  status?: string;
+  current_participants?: number;
+  max_participants?: number;
+}
+
 // Tipos para pagos
 export interface PaymentRequest {
   user_email: string;